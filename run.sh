@@ -8,7 +8,7 @@ INPUT_DATA="$(find $LINTOL_INPUT_DATA -type f | head -n 1)"
 echo "Processing ${INPUT_DATA} with ${PROCESSOR} given ${METADATA} to ${OUTPUT_FILE}"
 
 exec ltldoorstep \
-    --output json \
+    --output ${LINTOL_OUTPUT_FORMAT:-json} \
     --output-file=${OUTPUT_FILE} \
     process \
     ${INPUT_DATA} ${PROCESSOR} \
@@ -41,6 +41,8 @@ setup(
     setup_requires=['pytest-runner'],
     extras_require={
         'examples': ['shapely', 'piianalyzer', 'geojson_utils', 'geopandas'],
+        'binary-reports': ['msgpack'],
+        'zstd-compression': ['zstandard'],
         'babel-commands': ['Babel'],
         'sphinx-commands': ['sphinx']
     },
@@ -59,6 +61,7 @@ setup(
         'autobahn',
         'ckanapi',
         'requests',
+        'chardet',
         'docker',
         'retry',
         'minio',
@@ -0,0 +1,110 @@
+"""Compression of large WAMP call arguments and results.
+
+Strings and bytes above a threshold are replaced by an envelope holding
+their compressed form, which both ends unwrap transparently. zlib is always
+available; zstandard is used in preference where both ends have it. Each
+side only sends compressed payloads once the other has said, through the
+server's capabilities, which codecs it accepts - so older clients and
+servers carry on exchanging plain values.
+"""
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENVELOPE_KEY = '__ltldoorstep_compressed__'
+DEFAULT_THRESHOLD = 64 * 1024
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+def get_codecs():
+    """Codecs this installation can compress and decompress with, most preferred first."""
+
+    if zstandard:
+        return ['zstd', 'zlib']
+    return ['zlib']
+
+def choose_codec(offered):
+    """Pick the first of our codecs that the other side also accepts, or None."""
+
+    for codec in get_codecs():
+        if codec in offered:
+            return codec
+    return None
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, ZLIB_LEVEL)
+    raise RuntimeError(_("Unknown compression codec: %s") % codec)
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if not zstandard:
+            raise RuntimeError(_("zstd-compressed payload received, but zstandard is not installed"))
+        # Frames from ZstdCompressor.compress always record their content size
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise RuntimeError(_("Unknown compression codec: %s") % codec)
+
+def is_envelope(value):
+    return isinstance(value, dict) and ENVELOPE_KEY in value
+
+def pack(value, codec, threshold=DEFAULT_THRESHOLD):
+    """Compress a string or bytes value if it is large, and if that makes it smaller.
+
+    Dicts (such as the processor modules posted with a workflow) and lists
+    have their members packed in turn. Anything else is returned unchanged,
+    as is everything when codec is None.
+    """
+
+    if not codec:
+        return value
+
+    if isinstance(value, dict):
+        return {key: pack(member, codec, threshold) for key, member in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [pack(member, codec, threshold) for member in value]
+
+    if isinstance(value, str):
+        data = value.encode('utf-8')
+        value_type = 'str'
+    elif isinstance(value, (bytes, bytearray)):
+        data = bytes(value)
+        value_type = 'bytes'
+    else:
+        return value
+
+    if len(data) < threshold:
+        return value
+
+    compressed = compress(data, codec)
+    if len(compressed) >= len(data):
+        return value
+
+    return {
+        ENVELOPE_KEY: codec,
+        'type': value_type,
+        'data': compressed
+    }
+
+def unpack(value):
+    """Reverse pack, restoring any compressed strings and bytes inside value."""
+
+    if is_envelope(value):
+        data = decompress(value['data'], value[ENVELOPE_KEY])
+        if value['type'] == 'str':
+            return data.decode('utf-8')
+        return data
+
+    if isinstance(value, dict):
+        return {key: unpack(member) for key, member in value.items()}
+    if isinstance(value, list):
+        return [unpack(member) for member in value]
+
+    return value
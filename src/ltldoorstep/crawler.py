@@ -1,5 +1,8 @@
 import uuid
 import json
+import asyncio
+import functools
+import collections
 from autobahn.wamp.exception import ApplicationError
 from autobahn.wamp.types import PublishOptions
 import logging
@@ -7,56 +10,134 @@ import requests
 from ltldoorstep.metadata import DoorstepContext
 from ltldoorstep.ini import DoorstepIni
 from ltldoorstep.file import make_file_manager
+from ltldoorstep.rate_limit import HostRateLimiter
+from ltldoorstep.errors import LintolDoorstepBusyException
+from ltldoorstep.wamp_client import ENGAGE_ATTEMPTS, ENGAGE_RETRY_DELAY
 from retry import api as retry_api
 import os
 
 ALLOWED_FORMATS = ('CSV', 'GeoJSON')
+DEFAULT_METADATA_WORKERS = 4
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_WORKFLOW_WORKERS = 2
 
 def ckan_retry(f, **kwargs):
     # runs code until it's successful?
     return retry_api.retry_call(f, fkwargs=kwargs, tries=6, delay=1)
 
-async def do_crawl(component, url, workflow, printer, publish, update=False):
+async def do_crawl(component, url, workflow, printer, publish, update=False,
+                   metadata_workers=DEFAULT_METADATA_WORKERS, download_workers=DEFAULT_DOWNLOAD_WORKERS,
+                   workflow_workers=DEFAULT_WORKFLOW_WORKERS, host_rate=None, fingerprints=None):
     """
     gets all the datasets on the ckan instance
+
+    Package metadata, resource downloads and workflow runs each have their
+    own bounded pool of workers, and requests to any one host are limited
+    to host_rate per second (if given). Reports still reach the printer in
+    package and resource order. With a ResourceFingerprintCache as
+    fingerprints, resources that have not changed since they were last
+    fetched are neither checked nor announced again, unless update is set.
     """
     # is it worth using datastore to create te client here?
     from ckanapi import RemoteCKAN
     client = RemoteCKAN(url, user_agent='lintol-doorstep-crawl/1.0 (+http://lintol.io)')
 
+    loop = asyncio.get_event_loop()
+    limiter = HostRateLimiter(host_rate)
+    metadata_pool = asyncio.Semaphore(metadata_workers)
+    download_pool = asyncio.Semaphore(download_workers)
+    workflow_pool = asyncio.Semaphore(workflow_workers)
+
     # gets the packages to iterate through using the retry method
-    packages = ckan_retry(client.action.package_list)
+    await limiter.acquire(url)
+    packages = await loop.run_in_executor(None, ckan_retry, client.action.package_list)
+
+    # A forced update re-checks everything
+    if update:
+        fingerprints = None
 
-    for package in packages:
+    async def check_resource(resource, ini):
+        result = None
+        fingerprint = None
+        if workflow or fingerprints:
+            # creates response oject from the url column
+            async with download_pool:
+                await limiter.acquire(resource['url'])
+                if fingerprints:
+                    # Only a workflow needs the data itself, rather than its fingerprint
+                    r, fingerprint = await loop.run_in_executor(None, functools.partial(
+                        fingerprints.fetch, resource['url'], resource, keep_body=bool(workflow)
+                    ))
+                else:
+                    r = await loop.run_in_executor(None, requests.get, resource['url'])
+
+            if r is None:
+                logging.info("Unchanged resource: {}".format(resource['url']))
+                return None
+
+        if workflow:
+            with make_file_manager(content={'data.csv': r.text}) as file_manager:
+                # makes file etc
+                filename = file_manager.get('data.csv')
+                async with workflow_pool:
+                    result = await execute_workflow(component, filename, workflow, ini, priority='crawler')
+                print(result)
+        if publish:
+            await announce_resource(component, resource, ini, url, update)
+
+        # Only once dealt with, so that a failed workflow is retried next time
+        if fingerprint and (result is not None or not workflow):
+            fingerprints.commit(resource['url'], fingerprint)
+        return result
+
+    async def crawl_package(package):
         # creates package metadata
-        package_metadata = ckan_retry(client.action.package_show, id=package)
+        async with metadata_pool:
+            await limiter.acquire(url)
+            package_metadata = await loop.run_in_executor(
+                None,
+                functools.partial(ckan_retry, client.action.package_show, id=package)
+            )
 
         ini = DoorstepIni(context_package=package_metadata) # classes = studley case
+        checks = []
         for resource in ini.package['resources']:
             # checks if the resource is either CSV or geoJson (why geojson but not json?? is it more standarised re: columns)
             if resource['format'] in ALLOWED_FORMATS:
-                if workflow:
-                    # if workflow is initisialised
-                    # creates response oject from the url column
-                    r = requests.get(resource['url'])
-                    with make_file_manager(content={'data.csv': r.text}) as file_manager:
-                        # makes file etc
-                        filename = file_manager.get('data.csv')
-                        # calls async function to exec the workflow?
-                        result = await execute_workflow(component, filename, workflow, ini)
-                        print(result)
-                        if result:
-                            printer.build_report(result)
-                if publish:
-                    # what is publish in this context?
-                    # probably, if there is something to publish that is returned from the component, then do whatevs
-                    result = await announce_resource(component, resource, ini, url, update)
+                checks.append(check_resource(resource, ini))
             else:
                 if not resource['format']:
                     print(resource)
                 logging.warn("Not allowed format: {}".format(resource['format']))
+
+        return await asyncio.gather(*checks)
+
+    # Packages are started in order, a bounded window at a time, and their
+    # results printed as each of the oldest finishes, so output order is kept
+    window = metadata_workers + download_workers + workflow_workers
+    in_flight = collections.deque()
+    try:
+        for package in packages:
+            in_flight.append(asyncio.ensure_future(crawl_package(package)))
+            if len(in_flight) >= window:
+                build_reports(printer, await in_flight.popleft())
+
+        while in_flight:
+            build_reports(printer, await in_flight.popleft())
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+    if fingerprints:
+        fingerprints.log_counts()
+
     printer.print_output()
 
+def build_reports(printer, results):
+    for result in results:
+        if result:
+            printer.build_report(result)
+
 async def announce_resource(component, resource, ini, source, update=False):
     """When we join the server, execute the client workflow."""
 
@@ -66,7 +147,7 @@ async def announce_resource(component, resource, ini, source, update=False):
     component.publish('com.ltldoorstep.event_found_resource', resource['id'], resource, ini.to_dict(), source, update, options=PublishOptions(acknowledge=True))
 
 
-async def execute_workflow(component, filename, workflow, ini):
+async def execute_workflow(component, filename, workflow, ini, priority=None):
     """When we join the server, execute the client workflow.
     Series of instructions to create a report
     """
@@ -93,20 +174,34 @@ async def execute_workflow(component, filename, workflow, ini):
     elif not ini.definitions:
         ini.definitions = definitions
 
-    component._server, component._session = await component.call('com.ltldoorstep.engage')
-
-    await component.call_server('processor.post', {workflow: module}, ini.to_dict())
     content = "file://{}".format(os.path.abspath(filename))
 
-    await component.call_server('data.post', basefilename, content, True)
+    # A busy server releases the session it turns a job away from, so back
+    # off and engage afresh - the router may pass the job to another server
+    for attempt in range(ENGAGE_ATTEMPTS):
+        try:
+            # A session of its own, so that several workflows can run on one component
+            session = await component.open_session()
+
+            await session.call_server('processor.post', {workflow: module}, ini.to_dict())
+            await session.post_data(basefilename, content, True, priority=priority)
+            break
+        except (LintolDoorstepBusyException, ApplicationError) as e:
+            busy = isinstance(e, LintolDoorstepBusyException) or e.error == 'LintolDoorstepBusyException'
+            if not busy:
+                raise
+            if attempt == ENGAGE_ATTEMPTS - 1:
+                logging.error("Servers too busy, giving up on {}".format(basefilename))
+                return None
+            logging.warning("Server busy, retrying {}".format(basefilename))
+            await asyncio.sleep(ENGAGE_RETRY_DELAY * (attempt + 1))
 
     try:
-        result = await component.call_server('report.get')
+        result = await session.get_report()
     except ApplicationError as e:
         logging.error(e)
         result = None
 
-    result = json.loads(result)
     return result
 
     #temp commented out
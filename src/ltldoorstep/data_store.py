@@ -1,5 +1,19 @@
+import os
+import json
+import tempfile
+
+DEFAULT_PAGE_SIZE = 100
+
+def solr_date(metadata_modified):
+    """CKAN's metadata_modified, as a date Solr accepts in a range query."""
+
+    if metadata_modified.endswith('Z'):
+        return metadata_modified
+    return metadata_modified + 'Z'
+
 class DataStore:
     exception = RuntimeError
+    cursor = None
 
     def get_identifier(self):
         return '-dummy-'
@@ -16,13 +30,21 @@ class DataStore:
     def recently_changed_packages_activity_list(self):
         raise NotImplementedError()
 
+    def packages_changed_since(self, since=None, start=0, rows=DEFAULT_PAGE_SIZE):
+        raise NotImplementedError()
+
+    def set_cursor(self, cursor):
+        self.cursor = cursor
+
 class CkanDataStore(DataStore):
     """
     connects to CKAN client to use the APIs to return packages from the ckan instance
     """
-    def __init__(self, url):
+    def __init__(self, url, cursor_path=None):
         self.url = url
         self.client = self.make_client(url)
+        self.cursor_path = cursor_path
+        self.cursor = self.load_cursor()
 
         from ckanapi.errors import CKANAPIError
         self.exception = CKANAPIError
@@ -62,6 +84,52 @@ class CkanDataStore(DataStore):
         recently_changed = self.client.action.recently_changed_packages_activity_list()
         return recently_changed
 
+    def packages_changed_since(self, since=None, start=0, rows=DEFAULT_PAGE_SIZE):
+        """A page of packages modified at or after since (a metadata_modified value), oldest first.
+
+        The results are full package dicts, as package_show would give.
+        """
+        settings = {
+            'sort': 'metadata_modified asc',
+            'start': start,
+            'rows': rows
+        }
+        if since:
+            settings['fq'] = 'metadata_modified:[{} TO *]'.format(solr_date(since))
+
+        return self.package_search(**settings)
+
+    def load_cursor(self):
+        """The metadata_modified high-water mark saved for this CKAN instance, if any."""
+
+        if not self.cursor_path:
+            return None
+
+        try:
+            with open(self.cursor_path, 'r') as cursor_file:
+                return json.load(cursor_file).get(self.url)
+        except (IOError, ValueError):
+            return None
+
+    def set_cursor(self, cursor):
+        self.cursor = cursor
+        if not self.cursor_path:
+            return
+
+        try:
+            with open(self.cursor_path, 'r') as cursor_file:
+                cursors = json.load(cursor_file)
+        except (IOError, ValueError):
+            cursors = {}
+        cursors[self.url] = cursor
+
+        # Written aside and moved into place, so an interrupted write cannot lose the cursor
+        directory = os.path.dirname(os.path.abspath(self.cursor_path))
+        handle, path = tempfile.mkstemp(dir=directory, prefix='.cursor-')
+        with os.fdopen(handle, 'w') as cursor_file:
+            json.dump(cursors, cursor_file)
+        os.replace(path, self.cursor_path)
+
 class DummyDataStore(DataStore):
     """
     object to return dummy data.
@@ -0,0 +1,104 @@
+"""Character encoding detection, reading no more of a file than needed."""
+
+import codecs
+import logging
+import chardet
+
+SAMPLE_SIZE = 64 * 1024
+DETECTION_LIMIT = 4 * 1024 * 1024
+
+# Not valid UTF-8, and beyond chardet, but every byte has a meaning in Latin-1
+FALLBACK_ENCODING = 'latin-1'
+
+# UTF-32 marks must be tried before UTF-16, as they share a prefix
+_boms = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16')
+)
+
+def encoding_from_bom(sample):
+    for bom, encoding in _boms:
+        if sample.startswith(bom):
+            return encoding
+    return None
+
+class Utf8Validator:
+    """Check, a chunk at a time, that a whole stream is valid UTF-8.
+
+    Only a stream validated to its end counts as UTF-8 - an all-ASCII
+    opening says nothing about the rest. `invalid_at` gives the offset of
+    the chunk in which validation failed.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.valid = True
+        self.invalid_at = None
+        self._seen = 0
+        self._last = 0
+
+    def feed(self, chunk):
+        self._last = self._seen
+        if self.valid:
+            try:
+                self._decoder.decode(chunk)
+            except UnicodeDecodeError:
+                self.valid = False
+                self.invalid_at = self._seen
+        self._seen += len(chunk)
+        return self.valid
+
+    def close(self):
+        if self.valid:
+            try:
+                self._decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                # A sequence cut off at the end, so the last chunk is to blame
+                self.valid = False
+                self.invalid_at = self._last
+        return self.valid
+
+def detect_encoding(file_obj, sample_size=SAMPLE_SIZE, limit=DETECTION_LIMIT, validator=None):
+    """Guess the encoding of a seekable binary file object.
+
+    A byte-order mark wins outright, then a file that is valid UTF-8 all the
+    way through is taken as UTF-8. Otherwise chardet is fed, starting from
+    the first sample that was not valid UTF-8, as an ASCII opening would
+    tell it nothing, until it is confident or has seen `limit` bytes. A
+    validator already fed the whole file, as it was written, saves reading
+    it all again.
+    """
+
+    sample = file_obj.read(sample_size)
+
+    encoding = encoding_from_bom(sample)
+    if encoding:
+        return encoding
+
+    if validator is None:
+        validator = Utf8Validator()
+        while sample and validator.feed(sample):
+            sample = file_obj.read(sample_size)
+
+    if validator.close():
+        return 'utf-8'
+
+    file_obj.seek(validator.invalid_at)
+    detector = chardet.UniversalDetector()
+    seen = 0
+    sample = file_obj.read(sample_size)
+    while sample and not detector.done and seen < limit:
+        detector.feed(sample)
+        seen += len(sample)
+        sample = file_obj.read(sample_size)
+    detector.close()
+
+    encoding = detector.result['encoding']
+    if not encoding:
+        logging.warning(_("Could not detect encoding, assuming %s"), FALLBACK_ENCODING)
+        return FALLBACK_ENCODING
+
+    return encoding
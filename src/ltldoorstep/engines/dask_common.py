@@ -1,27 +1,94 @@
 """Common routines for dask engine."""
 
 import os
-from dask import threaded
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dask import threaded, multiprocessing, local
 from ltldoorstep.reports.report import Report
+from ltldoorstep.reports.budget import IssueBudget
+
+SCHEDULERS = ('threaded', 'processes', 'synchronous')
+
+_scheduler = 'threaded'
+_num_workers = 2
+_pool = None
+_pool_lock = threading.Lock()
+
+def configure(scheduler=None, num_workers=None):
+    """Choose the dask scheduler, and worker count, used by every subsequent run."""
+
+    global _scheduler, _num_workers, _pool
+
+    if scheduler is not None and scheduler not in SCHEDULERS:
+        raise RuntimeError(_("Dask scheduler must be one of: %s") % ', '.join(SCHEDULERS))
+
+    with _pool_lock:
+        if scheduler is not None:
+            _scheduler = scheduler
+        if num_workers is not None:
+            _num_workers = max(1, int(num_workers))
+
+        if _pool:
+            _pool.shutdown(wait=False)
+        _pool = None
+
+def get_pool():
+    """Return the pool shared by all runs, creating it if necessary."""
+
+    global _pool
+
+    with _pool_lock:
+        if not _pool and _scheduler != 'synchronous':
+            if _scheduler == 'processes':
+                _pool = ProcessPoolExecutor(max_workers=_num_workers)
+            else:
+                _pool = ThreadPoolExecutor(max_workers=_num_workers)
+        return _pool
+
+def compute(workflow, key='output'):
+    """Execute a workflow graph with the configured scheduler."""
+
+    if _scheduler == 'synchronous':
+        return local.get_sync(workflow, key)
+
+    pool = get_pool()
+    if _scheduler == 'processes':
+        return multiprocessing.get(workflow, key, num_workers=_num_workers, pool=pool)
+    return threaded.get(workflow, key, num_workers=_num_workers, pool=pool)
 
 def execute(filename, module_name, metadata):
     """Import and run a workflow on a data file."""
     mod = __import__(module_name)
     return run(filename, mod, metadata)
 
-def run(filename, mod, metadata, compiled=True):
-    """Real runner for a given ltldoorstep processor module and datafile."""
+def run(filename, mod, metadata, compiled=True, budget=None):
+    """Real runner for a given ltldoorstep processor module and datafile.
+
+    If given, `budget` holds IssueBudget arguments, capping the issues kept
+    in the processor's report as they are added.
+    """
 
     processor = mod.processor()
     workflow = processor.build_workflow(filename, metadata)
 
-    result = threaded.get(workflow, 'output', num_workers=2)
+    # Pass on the data encoding, if the engine already knows it
+    if processor.metadata and processor.metadata.context_encoding:
+        processor.get_report().set_properties(encoding=processor.metadata.context_encoding)
+
+    if budget:
+        processor.get_report().set_budget(IssueBudget(**budget))
+
+    result = compute(workflow, 'output')
 
     if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], Report):
         processor.set_report(result[1])
     elif isinstance(result, Report):
         processor.set_report(result)
 
+    # A workflow may have built a fresh report, rather than filling in ours
+    if budget and not processor.get_report().budget:
+        processor.set_report(processor.get_report().with_budget(IssueBudget(**budget)))
+
     if compiled:
         return processor.compile_report(filename, metadata)
     return processor.get_report()
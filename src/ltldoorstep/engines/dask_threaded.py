@@ -1,14 +1,19 @@
 """Engine for running a job, using dask, within this process."""
 
 import uuid
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from importlib.machinery import SourceFileLoader
+from importlib.util import spec_from_loader, module_from_spec
 from ..errors import LintolDoorstepException, LintolDoorstepContainerException
 from ..reports.report import combine_reports
-from ..file import make_file_manager
+from ..file import make_file_manager, DataFile
 from ..encoders import json_dumps
-from .dask_common import run as dask_run
+from .dask_common import run as dask_run, configure as dask_configure
 from .engine import Engine
 import asyncio
 from asyncio import Event, ensure_future, Queue
@@ -17,6 +22,8 @@ from ..config import examples_dir
 import re
 import os
 
+MODULE_CACHE_SIZE = 32
+
 def try_example_processor(processor_name):
     processor_file = re.sub(r'.*/([\w-]*):.*', r'\1', processor_name).replace('-', '_')
     processor_file = os.path.join(examples_dir(), f'{processor_file}.py')
@@ -28,9 +35,177 @@ def try_example_processor(processor_name):
 
     return False
 
+def load_processor_module(path, name='custom_processor'):
+    """Load a processor module from a file.
+
+    The module is not registered in sys.modules, so processors loaded
+    concurrently cannot overwrite one another's namespace.
+    """
+
+    loader = SourceFileLoader(name, path)
+    mod = module_from_spec(spec_from_loader(name, loader))
+    loader.exec_module(mod)
+    return mod
+
+class ProcessorModuleCache:
+    """Loaded processor modules, keyed by a hash of their source, with LRU eviction.
+
+    A processor seen before skips writing its source out, compiling it and
+    running its top-level imports. Each module is loaded once, even if several
+    sessions ask for it at the same time.
+    """
+
+    def __init__(self, size=MODULE_CACHE_SIZE):
+        self.size = size
+        self._modules = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_from_source(source):
+        if type(source) != bytes:
+            source = source.encode('utf-8')
+        return 'source:%s' % hashlib.sha256(source).hexdigest()
+
+    @staticmethod
+    def key_from_path(path):
+        return 'path:%s:%f' % (path, os.path.getmtime(path))
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            self._evict()
+
+    def _evict(self):
+        while len(self._modules) > self.size:
+            self._modules.popitem(last=False)
+
+    def load(self, key, loader):
+        """Return the module for key, calling loader() to load it if it is not cached."""
+
+        with self._lock:
+            if key in self._modules:
+                self._modules.move_to_end(key)
+                return self._modules[key]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._modules:
+                    return self._modules[key]
+
+            mod = loader()
+
+            with self._lock:
+                self._modules[key] = mod
+                self._evict()
+                self._loading.pop(key, None)
+
+        return mod
+
+# Module-level, so processors are shared across sessions (and, with a
+# process pool, each worker process keeps its own)
+module_cache = ProcessorModuleCache()
+
+def run_processor(filename, content, processor, budget=None):
+    """Run a single processor over the data, in its own temporary directory.
+
+    This is module-level so that it can be sent to a process pool.
+    """
+
+    workflow_module = processor['content']
+    if type(workflow_module) == bytes:
+        workflow_module = workflow_module.decode('utf-8')
+
+    metadata = processor['metadata']
+
+    if processor['filename']:
+        processor_filename = processor['filename']
+    else:
+        processor_filename = 'processor.py'
+
+    with make_file_manager(content={filename: content}) as file_manager:
+        if workflow_module:
+            mod = module_cache.load(
+                ProcessorModuleCache.key_from_source(workflow_module),
+                lambda: load_processor_module(file_manager.put(processor_filename, workflow_module))
+            )
+        else:
+            path = try_example_processor(metadata.tag)
+            if not path:
+                raise RuntimeError(_("The requested processor had no body, nor was an example processor."))
+            mod = module_cache.load(
+                ProcessorModuleCache.key_from_path(path),
+                lambda: load_processor_module(path)
+            )
+
+        local_file = file_manager.get(filename)
+        return dask_run(local_file, mod, metadata, compiled=False, budget=budget)
+
 class DaskThreadedEngine(Engine):
     """Allow execution of a dask workflow within this process."""
 
+    processor_workers = 1
+    processor_pool = 'thread'
+    report_budget = None
+
+    def __init__(self, config=None):
+        self._executor = None
+
+        if config and 'report' in config and config['report'].get('max-issues-per-code') is not None:
+            self.report_budget = {
+                'max_per_code': int(config['report']['max-issues-per-code']),
+                'sample_size': int(config['report'].get('issue-sample-size', 0))
+            }
+
+        if config and 'engine' in config:
+            config = config['engine']
+            if 'processor-workers' in config:
+                self.processor_workers = max(1, int(config['processor-workers']))
+            if 'processor-pool' in config:
+                if config['processor-pool'] not in ('thread', 'process'):
+                    raise RuntimeError(_("Processor pool must be one of 'thread' or 'process'"))
+                self.processor_pool = config['processor-pool']
+
+            if 'module-cache-size' in config:
+                module_cache.resize(max(0, int(config['module-cache-size'])))
+
+            if 'scheduler' in config or 'scheduler-workers' in config:
+                dask_configure(
+                    scheduler=config.get('scheduler'),
+                    num_workers=config.get('scheduler-workers')
+                )
+
+    @staticmethod
+    def description():
+        return _("Run processor(s) within this process, using dask")
+
+    @staticmethod
+    def config_help():
+        return {
+            'processor-workers': _("Number of a session's processors to run at once (default 1,\n" +
+                "i.e. one after another)"),
+            'processor-pool': _("'thread' (default) or 'process' - the latter needs processor\n" +
+                "reports to be picklable"),
+            'module-cache-size': _("Number of loaded processor modules kept for reuse across\n" +
+                "sessions (default 32, 0 to disable)"),
+            'scheduler': _("Dask scheduler for each processor's workflow: 'threaded' (default),\n" +
+                "'processes' or 'synchronous'. With 'processes', a workflow must return\n" +
+                "its report from the 'output' task"),
+            'scheduler-workers': _("Worker count for the dask scheduler's pool (default 2), shared\n" +
+                "by all runs in this process")
+        }
+
+    def get_executor(self):
+        """Return the pool that session processors are run on, creating it if necessary."""
+
+        if not self._executor:
+            if self.processor_pool == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.processor_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.processor_workers)
+        return self._executor
+
     def add_data(self, filename, content, redirect, session):
         data = {
             'filename': filename,
@@ -83,8 +258,12 @@ class DaskThreadedEngine(Engine):
             if data == 0:
                 logging.warn("Releasing session")
                 session['completion'].set()
+                return
             try:
-                result = await self.run_with_content(data['filename'], data['content'], session['processors'])
+                result = await self.schedule(
+                    session,
+                    lambda: self.run_with_content(data['filename'], data['content'], session['processors'])
+                )
                 session['result'] = result
             except Exception as error:
                 if not isinstance(error, LintolDoorstepException):
@@ -107,39 +286,32 @@ class DaskThreadedEngine(Engine):
 
         return result
 
-    @staticmethod
-    async def run_with_content(filename, content, processors):
-        reports = []
-        # if type(content) == bytes:
-        #     content = content.decode('utf-8')
-
-        for processor in processors:
-            workflow_module = processor['content']
-            if type(workflow_module) == bytes:
-                workflow_module = workflow_module.decode('utf-8')
-
-            metadata = processor['metadata']
-            if not filename:
-                filename = 'data.file'
-
-            if processor['filename']:
-                processor_filename = processor['filename']
-            else:
-                processor_filename = 'processor.py'
+    async def run_with_content(self, filename, content, processors):
+        """Run each processor over the data, up to processor-workers at a time.
+
+        Reports are combined in the order the processors were added, so the
+        result does not depend on how many run at once.
+        """
+
+        if not filename:
+            filename = 'data.file'
+
+        encoding = content.encoding if isinstance(content, DataFile) else None
+        if encoding:
+            for processor in processors:
+                processor['metadata'].context_encoding = encoding
+
+        loop = asyncio.get_event_loop()
+        executor = self.get_executor()
+
+        reports = await asyncio.gather(*[
+            loop.run_in_executor(executor, run_processor, filename, content, processor, self.report_budget)
+            for processor in processors
+        ])
 
-            with make_file_manager(content={filename: content, processor_filename: workflow_module}) as file_manager:
-                if workflow_module:
-                    mod = file_manager.get(processor_filename)
-                else:
-                    mod = try_example_processor(metadata.tag)
-                    if not mod:
-                        raise RuntimeError(_("The requested processor had no body, nor was an example processor."))
-
-                mod = SourceFileLoader('custom_processor', mod)
-                local_file = file_manager.get(filename)
-                report = dask_run(local_file, mod.load_module(), metadata, compiled=False)
-                reports.append(report)
         report = combine_reports(*reports)
+        if encoding:
+            report.set_properties(encoding=encoding)
 
         return report
 
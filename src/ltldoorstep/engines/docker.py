@@ -3,40 +3,73 @@
 import aiodocker
 import sys
 import traceback
-import shutil
-import requests
 import uuid
 import os
 import logging
 import asyncio
+import functools
 from urllib.parse import urlparse
 from contextlib import contextmanager
-from ..reports.report import Report, get_report_class_from_preset, combine_reports
-from ..file import make_file_manager
+from ..reports.report import get_report_class_from_preset, merge_reports
+from ..reports.binary import get_report_formats
+from ..file import DataFile
+from ..supplementary_cache import SupplementaryCache, download_supplementary, DEFAULT_CACHE_SIZE
 import docker
 import tempfile
 import json
 from .engine import Engine
+from .docker_pool import DockerWarmPool, DEFAULT_MAX_JOBS, DEFAULT_MAX_CONTAINERS, DEFAULT_IDLE_TIMEOUT
 from ..errors import LintolDoorstepException, LintolDoorstepContainerException
 from ..metadata import DoorstepContext
 from ..ini import DoorstepIni
 
 
 DEFAULT_CLIENT = 'tcp://localhost:8786'
+DEFAULT_CONCURRENCY = 4
 
 class DockerEngine(Engine):
     """Allow execution on local docker containers."""
 
     client_url = DEFAULT_CLIENT
     bind_ltldoorstep_module = False
+    warm_pool_size = 0
+    warm_pool_jobs = DEFAULT_MAX_JOBS
+    warm_pool_max = DEFAULT_MAX_CONTAINERS
+    warm_pool_idle = DEFAULT_IDLE_TIMEOUT
+    concurrency = DEFAULT_CONCURRENCY
+    supplementary_cache_dir = None
+    supplementary_cache_size = DEFAULT_CACHE_SIZE
+    report_format = 'json'
 
     def __init__(self, config=None):
+        self.warm_pool = None
+        self.client = None
+        self.supplementary_cache = None
+
         if config and 'engine' in config:
             config = config['engine']
             if 'url' in config:
                 self.client_url = config['url']
             if 'bind' in config and config['bind']:
                 self.bind_ltldoorstep_module = True
+            if 'warm-pool' in config:
+                self.warm_pool_size = max(0, int(config['warm-pool']))
+            if 'warm-pool-jobs' in config:
+                self.warm_pool_jobs = max(1, int(config['warm-pool-jobs']))
+            if 'warm-pool-max' in config:
+                self.warm_pool_max = max(1, int(config['warm-pool-max']))
+            if 'warm-pool-idle' in config:
+                self.warm_pool_idle = max(0, int(config['warm-pool-idle']))
+            if 'concurrency' in config:
+                self.concurrency = max(1, int(config['concurrency']))
+            if 'report-format' in config:
+                if config['report-format'] not in get_report_formats():
+                    raise RuntimeError(_("Report format must be one of: %s") % ', '.join(get_report_formats()))
+                self.report_format = config['report-format']
+            if 'supplementary-cache' in config:
+                self.supplementary_cache_dir = config['supplementary-cache']
+            if 'supplementary-cache-size' in config:
+                self.supplementary_cache_size = max(0, int(config['supplementary-cache-size'])) * 1024 * 1024
 
     @staticmethod
     def description():
@@ -46,9 +79,75 @@ class DockerEngine(Engine):
     def config_help():
         return {
             'bind': _("Useful for debugging ltldoorstep itself,\n" +
-                "bind-mounts the ltldoorstep module into the executing container")
+                "bind-mounts the ltldoorstep module into the executing container"),
+            'concurrency': _("Maximum number of a session's processor containers to run\n" +
+                "at once (default %d)") % DEFAULT_CONCURRENCY,
+            'report-format': _("Format processor containers write their reports in: 'json'\n" +
+                "(default) or 'msgpack', which needs images with msgpack installed"),
+            'supplementary-cache': _("Directory for caching supplementary data between runs\n" +
+                "(default: within the system temporary directory)"),
+            'supplementary-cache-size': _("Size limit of the supplementary data cache, in MB\n" +
+                "(default %d, 0 to disable)") % (DEFAULT_CACHE_SIZE // (1024 * 1024)),
+            'warm-pool': _("Keep up to this many idle containers per image and processor\n" +
+                "code, and run jobs in them, rather than starting a container per\n" +
+                "processor (default 0, off). Only runs of the same processor code share\n" +
+                "a container, but a job may see processes or files left outside /pfs\n" +
+                "by an earlier one, so leave off where sessions must be fully isolated"),
+            'warm-pool-jobs': _("Replace a warm container after it has run this many jobs\n" +
+                "(default %d)") % DEFAULT_MAX_JOBS,
+            'warm-pool-max': _("Most warm containers to keep across all images and processors\n" +
+                "(default %d)") % DEFAULT_MAX_CONTAINERS,
+            'warm-pool-idle': _("Remove a warm container once it has been idle this many seconds\n" +
+                "(default %d, 0 to keep until replaced)") % DEFAULT_IDLE_TIMEOUT
         }
 
+    def get_client(self):
+        """Return the docker client shared by this engine, connecting if necessary."""
+
+        if not self.client:
+            self.client = docker.from_env()
+        return self.client
+
+    def get_warm_pool(self):
+        """Return the warm container pool, creating it if necessary, or None if disabled."""
+
+        if self.warm_pool_size and not self.warm_pool:
+            self.warm_pool = DockerWarmPool(
+                self.get_client(),
+                self.warm_pool_size,
+                self.warm_pool_jobs,
+                extra_mounts=self._get_extra_mounts(),
+                max_containers=self.warm_pool_max,
+                idle_timeout=self.warm_pool_idle
+            )
+        return self.warm_pool
+
+    def get_supplementary_cache(self):
+        """Return the supplementary data cache, creating it if necessary, or None if disabled."""
+
+        if self.supplementary_cache_size and not self.supplementary_cache:
+            self.supplementary_cache = SupplementaryCache(
+                self.supplementary_cache_dir,
+                self.supplementary_cache_size
+            )
+        return self.supplementary_cache
+
+    def _get_extra_mounts(self):
+        mounts = []
+        if self.bind_ltldoorstep_module:
+            ltldoorstep_root_dir = os.path.join(
+                os.path.dirname(__file__),
+                '..',
+                '..',
+                '..'
+            )
+            mounts.append(docker.types.Mount(
+                '/doorstep',
+                ltldoorstep_root_dir,
+                type='bind'
+            ))
+        return mounts
+
     def add_data(self, filename, content, redirect, session):
         data = {
             'filename': filename,
@@ -103,7 +202,7 @@ class DockerEngine(Engine):
     async def run(self, filename, workflow_module, metadata, bucket=None):
         """Start the execution process over the cluster."""
 
-        with open(filename, 'r') as data_file:
+        with open(filename, 'rb') as data_file:
             data_content = data_file.read()
 
         basename = os.path.basename(workflow_module)
@@ -117,7 +216,7 @@ class DockerEngine(Engine):
             'content': workflow_content
         }]
 
-        return await self._run(filename, data_content, processors, self.bind_ltldoorstep_module)
+        return await self._run(filename, data_content, processors)
 
     async def monitor_pipeline(self, session):
         session['completion'] = asyncio.Event()
@@ -125,8 +224,15 @@ class DockerEngine(Engine):
         async def run_when_ready():
             # await session['completion'].acquire()
             data = await session['queue'].get()
+            if data == 0:
+                # Released before any data came, so there is nothing to run
+                session['completion'].set()
+                return
             try:
-                result = await self._run(data['filename'], data['content'], session['processors'], self.bind_ltldoorstep_module)
+                result = await self.schedule(
+                    session,
+                    lambda: self._run(data['filename'], data['content'], session['processors'])
+                )
                 session['result'] = result
             except Exception as error:
                 __, __, exc_traceback = sys.exc_info()
@@ -151,36 +257,32 @@ class DockerEngine(Engine):
 
         return result
 
-    @staticmethod
-    async def _run(data_filename, data_content, processors, bind_ltldoorstep_module):
+    async def _run(self, data_filename, data_content, processors):
         """Start the execution process over the cluster for a given client."""
 
-        result = None
-
-        filename = data_filename
-        if type(data_content) == bytes:
-            data_content = data_content.decode('utf-8')
+        encoding = data_content.encoding if isinstance(data_content, DataFile) else None
+        data_basename = os.path.basename(data_filename)
 
-        content = {
-            filename: data_content
-        }
-        for processor in processors:
-            pc = processor['content']
-            if not pc:
-                pc = ''
-            if processor['filename']:
-                if type(pc) == bytes:
-                    pc = pc.decode('utf-8')
-                content[processor['filename']] = pc
-
-        with tempfile.TemporaryDirectory('-doorstep-docker-engine-storage') as mounted_dir, make_file_manager(content=content) as file_manager:
-            data_file = file_manager.get(data_filename)
+        with tempfile.TemporaryDirectory('-doorstep-docker-engine-storage') as mounted_dir:
             out_root = os.path.join(mounted_dir, 'out')
             data_root = os.path.join(mounted_dir, 'data')
             os.makedirs(data_root)
             os.makedirs(os.path.join(out_root, 'raw'))
 
+            # The data is placed once, as-is, and mounted read-only for every processor
+            data_path = os.path.join(data_root, data_basename)
+            if isinstance(data_content, DataFile):
+                data_content.link_to(data_path)
+            else:
+                mode = 'wb' if type(data_content) == bytes else 'w'
+                with open(data_path, mode) as data_file:
+                    data_file.write(data_content)
+
+            loop = asyncio.get_event_loop()
+            supplementary_cache = self.get_supplementary_cache()
+
             report_files = []
+            jobs = []
             for processor in processors:
                 processor_root = os.path.join(mounted_dir, 'processors', processor['name'])
                 metadata = processor['metadata']
@@ -197,14 +299,11 @@ class DockerEngine(Engine):
 
                         supplementary_basename = 's%d-%s' % (i, os.path.basename(urlparse(supplementary).path))
 
-                        r = requests.get(supplementary, stream=True)
-                        if r.status_code != 200:
-                            raise RuntimeError(_("Could not retrieve supplementary data: %d" % r.status_code))
-
-                        print(_("Downloading %s") % supplementary)
-                        with open(os.path.join(processor_root, supplementary_basename), 'wb') as supplementary_file:
-                            for chunk in r.iter_content(chunk_size=1024):
-                                supplementary_file.write(chunk)
+                        supplementary_path = os.path.join(processor_root, supplementary_basename)
+                        if supplementary_cache:
+                            await loop.run_in_executor(None, supplementary_cache.fetch, supplementary, supplementary_path)
+                        else:
+                            await loop.run_in_executor(None, download_supplementary, supplementary, supplementary_path)
 
                         supplementary_internal[key] = {
                             'source': supplementary,
@@ -213,15 +312,19 @@ class DockerEngine(Engine):
 
                     metadata.supplementary = supplementary_internal
 
+                if encoding:
+                    metadata.context_encoding = encoding
+
                 with open(os.path.join(processor_root, 'metadata.json'), 'w') as metadata_file:
                     json.dump(metadata.to_dict(), metadata_file)
 
                 if processor['filename']:
-                    shutil.copy(file_manager.get(processor['filename']), os.path.join(processor_root, processor['filename']))
-                data_basename = os.path.basename(data_filename)
-                shutil.copy(data_file, os.path.join(data_root, data_basename))
-
-                mounts = [('mounted_dir', '/pfs')]
+                    pc = processor['content']
+                    if not pc:
+                        pc = ''
+                    mode = 'wb' if type(pc) == bytes else 'w'
+                    with open(os.path.join(processor_root, os.path.basename(processor['filename'])), mode) as processor_file:
+                        processor_file.write(pc)
 
                 docker_image = 'lintol/doorstep'
                 docker_revision = 'latest'
@@ -239,62 +342,97 @@ class DockerEngine(Engine):
                 envs = {
                     'LANG': lang,
                     'LINTOL_PROCESSOR_DIRECTORY': '/pfs/processors/%s' % processor['name'],
-                    'LINTOL_OUTPUT_FILE': '/pfs/out/raw/%s.json' % processor['name'],
+                    'LINTOL_OUTPUT_FILE': '/pfs/out/raw/%s.%s' % (processor['name'], self.report_format),
                     'LINTOL_METADATA': '/pfs/processors/%s/metadata.json' % processor['name'],
                     'LINTOL_INPUT_DATA': '/pfs/data',
-                    'LINTOL_DATA_FILE': data_basename
+                    'LINTOL_DATA_FILE': data_basename,
+                    'LINTOL_OUTPUT_FORMAT': self.report_format
                 }
-                report_files.append(os.path.join(out_root, 'raw', '%s.json' % processor['name']))
-
-                client = docker.from_env()
-                mounts = [
-                    docker.types.Mount('/pfs', mounted_dir, type='bind')
-                ]
-
-                if bind_ltldoorstep_module:
-                    ltldoorstep_root_dir = os.path.join(
-                        os.path.dirname(__file__),
-                        '..',
-                        '..',
-                        '..'
-                    )
-                    mounts.append(docker.types.Mount(
-                        '/doorstep',
-                        ltldoorstep_root_dir,
-                        type='bind'
-                    ))
-
-                try:
-                    ctr = client.containers.run(
-                        '%s:%s' % (docker_image, docker_revision),
-                        environment=envs,
-                        mounts=mounts,
-                        user=os.getuid(),
-                        network_mode='none',
-                        cap_drop='ALL',
-                        detach=True
-                    )
-                except docker.errors.ContainerError as error:
-                    doorstep_exception = LintolDoorstepContainerException(
-                        error,
-                        processor=docker_image
-                    )
-                    raise doorstep_exception
-
-                adkr = aiodocker.Docker()
-                actr = await adkr.containers.get(ctr.name)
-                await actr.wait()
-                await adkr.close()
+                report_files.append(os.path.join(out_root, 'raw', '%s.%s' % (processor['name'], self.report_format)))
+
+                processor_filename = os.path.basename(processor['filename']) if processor['filename'] else None
+                jobs.append((processor['name'], '%s:%s' % (docker_image, docker_revision), envs, processor_filename))
 
-            reports = []
-            for report_file in report_files:
-                with open(report_file, 'r') as report_f:
-                    reports.append(Report.load(report_f))
+            await self._run_jobs(jobs, mounted_dir, data_basename)
 
-            report = combine_reports(*reports)
+            report = merge_reports(report_files)
+            if encoding:
+                report.set_properties(encoding=encoding)
 
         return report
 
+    async def _run_jobs(self, jobs, mounted_dir, data_basename):
+        """Run every processor container at once, up to the concurrency limit.
+
+        All containers are waited for before returning, so none outlive the job
+        directory; the first failure, in processor order, is then raised.
+        """
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        warm_pool = self.get_warm_pool()
+        adkr = None if warm_pool else aiodocker.Docker()
+
+        async def _run_job(processor_name, image, envs, processor_filename):
+            async with semaphore:
+                if warm_pool:
+                    await warm_pool.execute(image, envs, mounted_dir, processor_name, data_basename, processor_filename)
+                else:
+                    await self._run_container(adkr, processor_name, image, envs, mounted_dir)
+
+        try:
+            results = await asyncio.gather(
+                *[_run_job(*job) for job in jobs],
+                return_exceptions=True
+            )
+        finally:
+            if adkr:
+                await adkr.close()
+
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    async def _run_container(self, adkr, processor_name, image, envs, mounted_dir):
+        """Run a one-off processor container over the job directory, waiting for it to exit."""
+
+        loop = asyncio.get_event_loop()
+        client = self.get_client()
+        mounts = [
+            docker.types.Mount('/pfs', mounted_dir, type='bind'),
+            docker.types.Mount('/pfs/data', os.path.join(mounted_dir, 'data'), type='bind', read_only=True)
+        ] + self._get_extra_mounts()
+
+        try:
+            ctr = await loop.run_in_executor(None, functools.partial(
+                client.containers.run,
+                image,
+                environment=envs,
+                mounts=mounts,
+                user=os.getuid(),
+                network_mode='none',
+                cap_drop='ALL',
+                detach=True
+            ))
+        except docker.errors.ContainerError as error:
+            doorstep_exception = LintolDoorstepContainerException(
+                error,
+                processor=processor_name
+            )
+            raise doorstep_exception
+
+        actr = await adkr.containers.get(ctr.name)
+        try:
+            status = await actr.wait()
+            exit_code = status['StatusCode']
+            if exit_code != 0:
+                stderr = await actr.log(stderr=True)
+                raise LintolDoorstepContainerException(
+                    docker.errors.ContainerError(ctr, exit_code, None, image, ''.join(stderr).encode('utf-8')),
+                    processor=processor_name
+                )
+        finally:
+            await actr.delete(force=True)
+
     @contextmanager
     def make_session(self):
         """Set up a workflow session.
@@ -0,0 +1,300 @@
+"""Long-lived, sandboxed containers that take processor jobs through /pfs."""
+
+import os
+import time
+import shutil
+import hashlib
+import asyncio
+import atexit
+import logging
+import tempfile
+import functools
+import docker
+from ..errors import LintolDoorstepContainerException
+
+WARM_POOL_LABEL = 'io.lintol.doorstep.warm-pool'
+DEFAULT_MAX_JOBS = 50
+DEFAULT_MAX_CONTAINERS = 16
+DEFAULT_IDLE_TIMEOUT = 300
+
+def link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+def empty_directory(path, keep=()):
+    for entry in os.listdir(path):
+        if entry in keep:
+            continue
+
+        entry_path = os.path.join(path, entry)
+        if os.path.isdir(entry_path) and not os.path.islink(entry_path):
+            shutil.rmtree(entry_path)
+        else:
+            os.unlink(entry_path)
+
+def file_digest(path):
+    """A digest of a processor's code, or None if it has no code of its own."""
+
+    if not path:
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        for chunk in iter(functools.partial(file_obj.read, 64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class WarmContainer:
+    """A running container, idling until given a job, with its own /pfs directory."""
+
+    def __init__(self, container, workspace, command):
+        self.container = container
+        self.workspace = workspace
+        self.command = command
+        self.jobs = 0
+        self.idle_since = None
+
+    def is_healthy(self):
+        try:
+            self.container.reload()
+        except docker.errors.APIError:
+            return False
+        return self.container.status == 'running'
+
+    def clear_workspace(self):
+        # data has a read-only mount of its own, so is emptied rather than replaced
+        empty_directory(self.workspace, keep=('data',))
+        empty_directory(os.path.join(self.workspace, 'data'))
+
+        os.makedirs(os.path.join(self.workspace, 'processors'))
+        os.makedirs(os.path.join(self.workspace, 'out', 'raw'))
+
+    def remove(self):
+        try:
+            self.container.remove(force=True)
+        except docker.errors.APIError as e:
+            logging.warning(_("Could not remove warm container %s: %s"), self.container.name, e)
+        shutil.rmtree(self.workspace, ignore_errors=True)
+
+class DockerWarmPool:
+    """Up to `size` warm containers per image and processor, each recycled after `max_jobs` jobs.
+
+    Containers are started with the same sandboxing as one-off processor
+    containers (no network, all capabilities dropped), but idle rather than
+    running the image's entrypoint. Each job is linked into the container's
+    bind-mounted directory, the data under a read-only mount of its own, and
+    the entrypoint is exec'd inside it, saving the container start-up time.
+
+    Containers are pooled by image and a digest of the processor's code, so
+    one processor's code never runs where another's has, but a job can
+    still find anything an earlier run of the same code left behind outside
+    /pfs, or still running. No more than `max_containers` run in all, the
+    longest idle making way for new ones, and any idle for `idle_timeout`
+    seconds are removed.
+    """
+
+    def __init__(self, client, size, max_jobs=DEFAULT_MAX_JOBS, extra_mounts=None,
+                 max_containers=DEFAULT_MAX_CONTAINERS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self._client = client
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_containers = max(max_containers, 1)
+        self.idle_timeout = idle_timeout
+        self._extra_mounts = extra_mounts if extra_mounts else []
+        self._root = tempfile.mkdtemp(prefix='ltldoorstep-warm-pool-')
+        self._idle = {}
+        self._live = {}
+        self._condition = None
+        self._commands = {}
+
+        atexit.register(self.close)
+
+    def _get_command(self, image):
+        """Find the command a one-off container of this image would have run."""
+
+        if image not in self._commands:
+            config = self._client.images.get(image).attrs['Config']
+            self._commands[image] = (config['Entrypoint'] or []) + (config['Cmd'] or [])
+        return self._commands[image]
+
+    def _start(self, image):
+        command = self._get_command(image)
+
+        workspace = tempfile.mkdtemp(dir=self._root)
+        os.chmod(workspace, 0o755)
+        os.makedirs(os.path.join(workspace, 'data'))
+
+        # As for one-off containers, the data - linked in, not copied - is read-only
+        mounts = [
+            docker.types.Mount('/pfs', workspace, type='bind'),
+            docker.types.Mount('/pfs/data', os.path.join(workspace, 'data'), type='bind', read_only=True)
+        ] + self._extra_mounts
+
+        container = self._client.containers.run(
+            image,
+            entrypoint=['sleep', 'infinity'],
+            mounts=mounts,
+            user=os.getuid(),
+            network_mode='none',
+            cap_drop=['ALL'],
+            labels={WARM_POOL_LABEL: 'true'},
+            detach=True
+        )
+
+        warm = WarmContainer(container, workspace, command)
+        warm.clear_workspace()
+        return warm
+
+    def live(self):
+        return sum(self._live.values())
+
+    def _take_idle(self, expired_only=False):
+        """Remove idle containers from the pool - only those past the idle timeout, or else the longest idle."""
+
+        idle = [(warm.idle_since, key, warm) for key, containers in self._idle.items() for warm in containers]
+        if expired_only:
+            cutoff = time.monotonic() - self.idle_timeout
+            taken = [(key, warm) for since, key, warm in idle if since < cutoff]
+        else:
+            taken = [min(idle, key=lambda item: item[0])[1:]] if idle else []
+
+        for key, warm in taken:
+            self._idle[key].remove(warm)
+            self._live[key] -= 1
+
+        return [warm for key, warm in taken]
+
+    async def _remove(self, containers):
+        loop = asyncio.get_event_loop()
+        for warm in containers:
+            await loop.run_in_executor(None, warm.remove)
+
+    async def _expire_idle(self):
+        async with self._condition:
+            expired = self._take_idle(expired_only=True)
+            if expired:
+                self._condition.notify_all()
+
+        await self._remove(expired)
+
+    async def _acquire(self, key):
+        loop = asyncio.get_event_loop()
+
+        # The condition belongs to a loop, so is made once there is one
+        if not self._condition:
+            self._condition = asyncio.Condition()
+        self._idle.setdefault(key, [])
+        self._live.setdefault(key, 0)
+
+        async with self._condition:
+            while True:
+                while self._idle[key]:
+                    warm = self._idle[key].pop()
+                    if await loop.run_in_executor(None, warm.is_healthy):
+                        return warm
+
+                    logging.warning(_("Replacing unhealthy warm container %s"), warm.container.name)
+                    self._live[key] -= 1
+                    await loop.run_in_executor(None, warm.remove)
+
+                if self._live[key] < self.size:
+                    if self.live() < self.max_containers:
+                        self._live[key] += 1
+                        break
+
+                    # Make way by removing whichever container has been idle longest
+                    await self._remove(self._take_idle())
+                    if self.live() < self.max_containers:
+                        continue
+
+                await self._condition.wait()
+
+        try:
+            return await loop.run_in_executor(None, self._start, key[0])
+        except Exception:
+            async with self._condition:
+                self._live[key] -= 1
+                self._condition.notify_all()
+            raise
+
+    async def _release(self, key, warm):
+        loop = asyncio.get_event_loop()
+
+        recycle = warm.jobs >= self.max_jobs
+        if not recycle:
+            try:
+                await loop.run_in_executor(None, warm.clear_workspace)
+            except OSError as e:
+                logging.warning(_("Could not clear warm container workspace: %s"), e)
+                recycle = True
+
+        if recycle:
+            await loop.run_in_executor(None, warm.remove)
+
+        async with self._condition:
+            if recycle:
+                self._live[key] -= 1
+            else:
+                warm.idle_since = time.monotonic()
+                self._idle[key].append(warm)
+            self._condition.notify_all()
+
+        if not recycle and self.idle_timeout:
+            loop.call_later(self.idle_timeout, lambda: asyncio.ensure_future(self._expire_idle()))
+
+    async def execute(self, image, envs, job_root, processor_name, data_basename, processor_filename=None):
+        """Run one processor job, laid out as in job_root, on a warm container.
+
+        processor_filename names the processor's code within its directory,
+        if it has any. The processor's report is moved back into
+        job_root/out/raw.
+        """
+
+        loop = asyncio.get_event_loop()
+        processor_root = os.path.join(job_root, 'processors', processor_name)
+        code_path = os.path.join(processor_root, processor_filename) if processor_filename else None
+        key = (image, await loop.run_in_executor(None, file_digest, code_path))
+        warm = await self._acquire(key)
+
+        try:
+            workspace = warm.workspace
+            link_or_copy(
+                os.path.join(job_root, 'data', data_basename),
+                os.path.join(workspace, 'data', data_basename)
+            )
+            shutil.copytree(
+                processor_root,
+                os.path.join(workspace, 'processors', processor_name),
+                copy_function=link_or_copy
+            )
+
+            warm.jobs += 1
+            exit_code, output = await loop.run_in_executor(None, functools.partial(
+                warm.container.exec_run,
+                warm.command,
+                environment=envs,
+                user=str(os.getuid())
+            ))
+
+            if exit_code != 0:
+                raise LintolDoorstepContainerException(
+                    docker.errors.ContainerError(warm.container, exit_code, warm.command, image, output),
+                    processor=processor_name
+                )
+
+            report_name = os.path.basename(envs['LINTOL_OUTPUT_FILE'])
+            shutil.move(
+                os.path.join(workspace, 'out', 'raw', report_name),
+                os.path.join(job_root, 'out', 'raw', report_name)
+            )
+        finally:
+            await self._release(key, warm)
+
+    def close(self):
+        for containers in self._idle.values():
+            for warm in containers:
+                warm.remove()
+            containers.clear()
+        shutil.rmtree(self._root, ignore_errors=True)
@@ -1,9 +1,19 @@
 from contextlib import contextmanager
 
 class Engine:
+    # Set by a server to bound and prioritize the sessions it runs
+    scheduler = None
+
     def download(self):
         return True
 
+    async def schedule(self, session, job):
+        """Run a session's job, a coroutine function, through the scheduler if there is one."""
+
+        if self.scheduler:
+            return await self.scheduler.submit(job, session.get('priority'))
+        return await job()
+
     def __init__(self, config=None):
         pass
 
@@ -2,7 +2,9 @@
 
 from contextlib import contextmanager
 import traceback
+import functools
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 import re
 import asyncio
@@ -18,8 +20,10 @@ from ..errors import LintolDoorstepException, LintolDoorstepContainerException
 from concurrent.futures import ThreadPoolExecutor
 from .engine import Engine
 from ..reports.report import Report, combine_reports
+from ..reports.binary import loads_report
 
 OPENFAAS_HOST = 'http://127.0.0.1:8084'
+OPENFAAS_CONCURRENCY = 8
 FUNCTION_CONTAINER_PREFIX = '/home/user/.local/lib/python3.6/site-packages/'
 
 def _check_allowed_functions(x, fn, allowed_functions):
@@ -38,9 +42,50 @@ def _check_allowed_functions(x, fn, allowed_functions):
     return None, None
 
 
+class OpenFaaSGateway:
+    """Keep-alive connection pool to an OpenFaaS gateway, for use from coroutines.
+
+    Requests run on a bounded thread pool, so at most `concurrency` are in
+    flight at once and none of them block the event loop.
+    """
+
+    def __init__(self, host, credential, concurrency=OPENFAAS_CONCURRENCY):
+        self.host = host
+
+        self._session = requests.Session()
+        self._session.auth = HTTPBasicAuth('admin', credential)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def request(self, method, path, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(self._session.request, method, f'{self.host}{path}', **kwargs)
+        )
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+
 class OpenFaaSEngine(Engine):
     """Allow execution of workflows on a OpenFaaS cluster."""
 
+    openfaas_host = OPENFAAS_HOST
+    openfaas_cred = ''
+    openfaas_concurrency = OPENFAAS_CONCURRENCY
+    gateway = None
+
     def download(self):
         return False
 
@@ -50,9 +95,6 @@ class OpenFaaSEngine(Engine):
         if config and 'engine' in config:
             config = config['engine']
 
-            self.openfaas_host = OPENFAAS_HOST
-            self.openfaas_cred = ''
-
             if 'openfaas' in config:
                 config = config['openfaas']
                 if 'host' in config:
@@ -64,6 +106,16 @@ class OpenFaaSEngine(Engine):
                 if 'allowed-functions' in config:
                     self.allowed_functions = config['allowed-functions']
 
+                if 'concurrency' in config:
+                    self.openfaas_concurrency = max(1, int(config['concurrency']))
+
+    def get_gateway(self):
+        """Return the pooled gateway connection, creating it if necessary."""
+
+        if not self.gateway:
+            self.gateway = OpenFaaSGateway(self.openfaas_host, self.openfaas_cred, self.openfaas_concurrency)
+        return self.gateway
+
     @staticmethod
     def description():
         return '(not provided)'
@@ -122,7 +174,7 @@ class OpenFaaSEngine(Engine):
             'filename': filename,
             'content': filename
         }]
-        report = await self._run(filename, filename, processors, self.openfaas_host, self.openfaas_cred, self.allowed_functions)
+        report = await self._run(filename, filename, processors, self.get_gateway(), self.allowed_functions)
         return report.compile(filename, metadata)
 
     async def monitor_pipeline(self, session):
@@ -131,8 +183,15 @@ class OpenFaaSEngine(Engine):
         async def run_when_ready():
             # await session['completion'].acquire()
             data = await session['queue'].get()
+            if data == 0:
+                # Released before any data came, so there is nothing to run
+                session['completion'].set()
+                return
             try:
-                result = await self._run(data['filename'], data['content'], session['processors'], self.openfaas_host, self.openfaas_cred, self.allowed_functions)
+                result = await self.schedule(
+                    session,
+                    lambda: self._run(data['filename'], data['content'], session['processors'], self.get_gateway(), self.allowed_functions)
+                )
                 session['result'] = result
             except Exception as error:
                 __, __, exc_traceback = sys.exc_info()
@@ -158,15 +217,15 @@ class OpenFaaSEngine(Engine):
         return result
 
     async def check_processor_statuses(self):
-        content = await self._get_functions(self.openfaas_host, self.openfaas_cred, self.allowed_functions)
+        content = await self._get_functions(self.get_gateway(), self.allowed_functions)
         return content
 
     @staticmethod
-    async def _get_functions(openfaas_host, openfaas_cred, allowed_functions={}):
+    async def _get_functions(gateway, allowed_functions={}):
         rq = None
         try:
-            rq = requests.get(f'{openfaas_host}/function/ltl-openfaas-status', json={
-            }, auth=HTTPBasicAuth('admin', openfaas_cred))
+            rq = await gateway.get('/function/ltl-openfaas-status', json={
+            })
         except Exception as e:
             logging.error(e)
             if rq:
@@ -211,77 +270,84 @@ class OpenFaaSEngine(Engine):
         return content
 
     @staticmethod
-    async def _run(filename, content, processors, openfaas_host, openfaas_cred, allowed_functions={}):
-        reports = []
-        for processor in processors:
-            metadata = processor['metadata']
+    async def _run(filename, content, processors, gateway, allowed_functions={}):
+        """Invoke every processor's function at once, combining reports in processor order."""
 
-            tag, function = _check_allowed_functions(metadata.tag, metadata.docker['image'], allowed_functions)
-            if not tag:
-                tag, function = _check_allowed_functions(processor['name'], metadata.docker['image'], allowed_functions)
+        reports = await asyncio.gather(*[
+            OpenFaaSEngine._run_processor(content, processor, gateway, allowed_functions)
+            for processor in processors
+        ])
 
-            if not tag:
-                error_msg = _("Could not find {} or {} in allowed processors for OpenFaaS engine.").format(metadata.tag, processor['name'])
-                error_msg += _("\nUpdate .ltldoorstep.yml to add more")
-                raise RuntimeError(error_msg)
+        report = combine_reports(*reports)
+        report.filename = filename
 
-            rq = None
-            try:
-                rq = requests.post(f'{openfaas_host}/function/{function}', json={
-                    'filename': content,
-                    'workflow': tag,
-                    'metadata': json.dumps(metadata.to_dict()),
-                }, auth=HTTPBasicAuth('admin', openfaas_cred))
-            except Exception as e:
-                logging.error(e)
-                if rq:
-                    status_code = rq.status_code
-                else:
-                    status_code = -1
+        return report
 
-                raise LintolDoorstepException(
-                    e,
-                    processor=processor['name'],
-                    status_code=str(status_code)
-                )
+    @staticmethod
+    async def _run_processor(content, processor, gateway, allowed_functions):
+        metadata = processor['metadata']
 
-            try:
-                content = json.loads(rq.content)
-            except Exception as e:
-                logging.error(rq.content)
-                raise LintolDoorstepException(
-                    e,
-                    message=rq.content,
-                    processor=processor['name']
-                )
+        tag, function = _check_allowed_functions(metadata.tag, metadata.docker['image'], allowed_functions)
+        if not tag:
+            tag, function = _check_allowed_functions(processor['name'], metadata.docker['image'], allowed_functions)
 
-            if 'error' in content and content['error']:
-                exception = json.loads(content['exception'])
-                if 'code' in exception:
-                    status_code = exception['code']
-                else:
-                    status_code = rq.status_code
+        if not tag:
+            error_msg = _("Could not find {} or {} in allowed processors for OpenFaaS engine.").format(metadata.tag, processor['name'])
+            error_msg += _("\nUpdate .ltldoorstep.yml to add more")
+            raise RuntimeError(error_msg)
 
-                raise LintolDoorstepException(
-                    exception['exception'],
-                    processor=processor['name'],
-                    message=exception['message'],
-                    status_code=str(status_code)
-                )
+        rq = None
+        try:
+            rq = await gateway.post(f'/function/{function}', json={
+                'filename': content,
+                'workflow': tag,
+                'metadata': json.dumps(metadata.to_dict()),
+            })
+        except Exception as e:
+            logging.error(e)
+            if rq:
+                status_code = rq.status_code
+            else:
+                status_code = -1
 
-            try:
-                report = Report.parse(content)
-            except Exception as e:
-                logging.error(rq.content)
-                raise LintolDoorstepException(
-                    e,
-                    processor=processor['name']
-                )
+            raise LintolDoorstepException(
+                e,
+                processor=processor['name'],
+                status_code=str(status_code)
+            )
+
+        try:
+            result = loads_report(rq.content)
+        except Exception as e:
+            logging.error(rq.content)
+            raise LintolDoorstepException(
+                e,
+                message=rq.content,
+                processor=processor['name']
+            )
 
-            reports.append(report)
+        if 'error' in result and result['error']:
+            exception = json.loads(result['exception'])
+            if 'code' in exception:
+                status_code = exception['code']
+            else:
+                status_code = rq.status_code
 
-        report = combine_reports(*reports)
-        report.filename = filename
+            raise LintolDoorstepException(
+                exception['exception'],
+                processor=processor['name'],
+                message=exception['message'],
+                status_code=str(status_code)
+            )
+
+        try:
+            report = Report.parse(result)
+        except Exception as e:
+            logging.error(rq.content)
+            raise LintolDoorstepException(
+                e,
+                processor=processor['name']
+            )
 
         return report
 
@@ -16,6 +16,7 @@ from .pachyderm_proxy.pipeline import make_pipeline
 from .pachyderm_proxy.job_error import JobFailedException
 from .pachyderm_proxy.pypachy_wrapper import PfsClientWrapper
 from .engine import Engine
+from ..file import DataFile
 
 ALLOWED_IMAGES = [
     ('lintol/doorstep', 'latest'),
@@ -135,6 +136,9 @@ class PachydermEngine(Engine):
 
         filename = '/%s' % filename
 
+        if isinstance(content, DataFile):
+            content = content.iter_chunks()
+
         self._add_files('data', {filename: content}, session, bucket)
 
         self.logger.debug("Added data")
@@ -55,6 +55,9 @@ class LintolDoorstepException(Serializable, ApplicationError):
             'message': self.message
         }
 
+class LintolDoorstepBusyException(LintolDoorstepException):
+    pass
+
 class LintolDoorstepContainerException(LintolDoorstepException):
     @property
     def status_code(self):
@@ -1,8 +1,101 @@
 import boto3
+import codecs
 import contextlib
+import logging
 import os
 import tempfile
 import shutil
+import requests
+from .encoding_utils import detect_encoding, Utf8Validator
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+class DataFile:
+    """Data that lives on local disk, passed to engines in place of an in-memory body.
+
+    If this owns a temporary file, the file is removed once the object is discarded.
+    """
+
+    def __init__(self, path, encoding=None, owner=None):
+        self.path = path
+        self.encoding = encoding
+        self._owner = owner
+
+    def __repr__(self):
+        return '<DataFile: %s (%s)>' % (self.path, self.encoding)
+
+    def __getstate__(self):
+        # The owning process keeps the temporary file alive, so copies
+        # (e.g. sent to a process pool) only need the path
+        return {'path': self.path, 'encoding': self.encoding, '_owner': None}
+
+    def iter_chunks(self, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        with open(self.path, 'rb') as file_obj:
+            for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+                yield chunk
+
+    def link_to(self, target):
+        """Make the data available at target, hard-linking where possible rather than copying."""
+
+        try:
+            os.link(self.path, target)
+        except OSError:
+            shutil.copyfile(self.path, target)
+
+    @classmethod
+    def make_temporary(cls):
+        owner = tempfile.NamedTemporaryFile(prefix='ltldoorstep-data-')
+        return cls(owner.name, owner=owner), owner
+
+def recode_file(data_file, encoding, target_encoding='utf-8'):
+    """Transcode a DataFile chunk by chunk, returning a new DataFile."""
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+    recoded, file_obj = DataFile.make_temporary()
+
+    for chunk in data_file.iter_chunks():
+        file_obj.write(decoder.decode(chunk).encode(target_encoding))
+    file_obj.write(decoder.decode(b'', final=True).encode(target_encoding))
+    file_obj.flush()
+
+    recoded.encoding = target_encoding
+    return recoded
+
+def download_to_file(url, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Stream a URL to a temporary file, recoding to UTF-8 where needed.
+
+    At most one chunk is held in memory at a time, however large the resource.
+    """
+
+    r = requests.get(url, stream=True)
+
+    if r.status_code != 200:
+        raise RuntimeError(_("Could not retrieve data from redirected URL: %d") % r.status_code)
+
+    # Validated as it streams, so only the whole file can count as UTF-8
+    validator = Utf8Validator()
+    data_file, file_obj = DataFile.make_temporary()
+    for chunk in r.iter_content(chunk_size=chunk_size):
+        file_obj.write(chunk)
+        validator.feed(chunk)
+    file_obj.flush()
+
+    if r.encoding:
+        encoding = r.encoding
+    else:
+        with open(data_file.path, 'rb') as sample_file:
+            encoding = detect_encoding(sample_file, validator=validator)
+
+    try:
+        if codecs.lookup(encoding).name in ('utf-8', 'ascii'):
+            data_file.encoding = 'utf-8'
+        else:
+            data_file = recode_file(data_file, encoding)
+    except (LookupError, TypeError, UnicodeError):
+        logging.warn(_("Could not recode content from {} to UTF-8").format(encoding))
+        data_file.encoding = encoding
+
+    return data_file
 
 
 class DummyFileManager:
@@ -14,10 +107,21 @@ class TempFileManager:
         self._local = local_directory
 
         for filename, body in content.items():
-            local_filename = os.path.join(self._local, os.path.basename(filename))
-            mode = 'wb' if type(body) == bytes else 'w'
-            with open(local_filename, mode) as file_obj:
-                file_obj.write(body)
+            self.put(filename, body)
+
+    def put(self, filename, body):
+        """Write a file into the managed directory, returning its local path."""
+
+        local_filename = os.path.join(self._local, os.path.basename(filename))
+        if isinstance(body, DataFile):
+            body.link_to(local_filename)
+            return local_filename
+
+        mode = 'wb' if type(body) == bytes else 'w'
+        with open(local_filename, mode) as file_obj:
+            file_obj.write(body)
+
+        return local_filename
 
     def get(self, filename):
         local_filename = os.path.join(self._local, os.path.basename(filename))
@@ -0,0 +1,165 @@
+"""Fingerprints of fetched resources, to avoid re-checking data that has not changed."""
+
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import requests
+from .seen_store import resource_hash
+from .file import DOWNLOAD_CHUNK_SIZE
+
+class ResourceFingerprintCache:
+    """The ETag, Last-Modified, size and sha256 of each resource URL as last fetched.
+
+    `fetch` makes a conditional request, and returns None, rather than the
+    response, if the server answers 304 Not Modified or sends a body
+    identical to the one fingerprinted. Where the catalogue metadata itself
+    vouches for the content (a resource with a content hash, or any
+    resource if `trust_metadata` is set), an unchanged resource is skipped
+    without a request at all. A changed resource's new fingerprint is only
+    kept once the caller has dealt with the resource and `commit`s it, so
+    one whose check failed is fetched afresh next time. Fingerprints are
+    kept in SQLite at `path`, or only for the life of the process without
+    one.
+    """
+
+    def __init__(self, path=None, trust_metadata=False):
+        self.path = path
+        self.trust_metadata = trust_metadata
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints ('
+            ' url TEXT PRIMARY KEY,'
+            ' etag TEXT,'
+            ' last_modified TEXT,'
+            ' size INTEGER,'
+            ' sha256 TEXT,'
+            ' metadata TEXT,'
+            ' checked_at REAL NOT NULL'
+            ')'
+        )
+        self._db.commit()
+        self.counts = {
+            'hits': 0,
+            'misses': 0,
+            'metadata-unchanged': 0,
+            'not-modified': 0,
+            'same-content': 0
+        }
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag, last_modified, size, sha256, metadata FROM fingerprints WHERE url = ?',
+                (url,)
+            ).fetchone()
+
+        if not row:
+            return None
+
+        return dict(zip(('etag', 'last_modified', 'size', 'sha256', 'metadata'), row))
+
+    def _put(self, url, entry):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, entry['etag'], entry['last_modified'], entry['size'], entry['sha256'], entry['metadata'], time.time())
+            )
+            self._db.commit()
+
+    def _count(self, reason):
+        with self._lock:
+            if reason:
+                self.counts['hits'] += 1
+                self.counts[reason] += 1
+            else:
+                self.counts['misses'] += 1
+
+    def commit(self, url, fingerprint):
+        """Keep a fingerprint returned by `fetch`, once its resource has been dealt with."""
+
+        self._put(url, fingerprint)
+
+    def fetch(self, url, resource=None, get=requests.get, keep_body=True):
+        """Fetch url, unless it is known to be unchanged.
+
+        Returns the response and the fingerprint to `commit` for it, or
+        (None, None) if unchanged. The body is streamed through the hash;
+        only with keep_body is it also held, as the response's content, for
+        the caller to use.
+        """
+
+        entry = self.get(url)
+        metadata = resource_hash(resource) if resource else None
+
+        if entry and metadata and entry['metadata'] == metadata and (self.trust_metadata or resource.get('hash')):
+            self._count('metadata-unchanged')
+            return None, None
+
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        r = get(url, headers=headers, stream=True)
+
+        if entry and r.status_code == 304:
+            r.close()
+            self._put(url, dict(entry, metadata=metadata))
+            self._count('not-modified')
+            return None, None
+
+        if r.status_code != 200:
+            # Not fingerprinted, so it is tried afresh next time
+            self._count(None)
+            return r, None
+
+        if keep_body:
+            chunks = [r.content]
+        else:
+            chunks = r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+
+        sha256 = hashlib.sha256()
+        size = 0
+        for chunk in chunks:
+            sha256.update(chunk)
+            size += len(chunk)
+        if not keep_body:
+            r.close()
+
+        digest = sha256.hexdigest()
+        fingerprint = {
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'size': size,
+            'sha256': digest,
+            'metadata': metadata
+        }
+        if entry and entry['sha256'] == digest:
+            # Only the headers can have changed, and the content was dealt with before
+            self._put(url, fingerprint)
+            self._count('same-content')
+            return None, None
+
+        self._count(None)
+        return r, fingerprint
+
+    def log_counts(self):
+        logging.info(_("Resource fingerprints: %d unchanged (%s), %d changed or new"),
+            self.counts['hits'],
+            ', '.join('%s %d' % (reason, self.counts[reason]) for reason in ('metadata-unchanged', 'not-modified', 'same-content')),
+            self.counts['misses']
+        )
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctyp, excval, exctbk):
+        self.close()
@@ -2,7 +2,7 @@ import json
 import logging
 
 class DoorstepContext:
-    def __init__(self, lang=None, tag=None, module=None, docker_image=None, docker_revision=None, context_package=None, settings={}, configuration={}, supplementary=None, context_format=None, context_resource=None):
+    def __init__(self, lang=None, tag=None, module=None, docker_image=None, docker_revision=None, context_package=None, settings={}, configuration={}, supplementary=None, context_format=None, context_resource=None, context_encoding=None):
         self.lang = lang
         self.docker = {
             'image': docker_image,
@@ -16,6 +16,7 @@ class DoorstepContext:
         self.configuration = configuration
         self.supplementary = supplementary
         self.context_format = context_format
+        self.context_encoding = context_encoding
 
     def __repr__(self):
         return "<DoorstepContext: {}>".format(self.to_dict())
@@ -82,6 +83,8 @@ class DoorstepContext:
                 kwargs['context_resource'] = dct['context']['resource']
             if 'format' in dct['context'] and dct['context']['format']:
                 kwargs['context_format'] = dct['context']['format']
+            if 'encoding' in dct['context'] and dct['context']['encoding']:
+                kwargs['context_encoding'] = dct['context']['encoding']
 
         if 'settings' in dct:
             kwargs['settings'] = dct['settings']
@@ -114,7 +117,8 @@ class DoorstepContext:
             'context': {
                 'package': package,
                 'resource': resource,
-                'format': self.context_format
+                'format': self.context_format,
+                'encoding': self.context_encoding
             },
             'settings': dict(self.settings),
             'configuration': dict(self.configuration),
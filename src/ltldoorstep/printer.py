@@ -1,11 +1,13 @@
 import colorama
 import re
 import os
+import sys
 import logging
 import json
 import tabulate
 import gettext
 from .processor import Report
+from .reports import binary
 
 
 LEVEL_MAPPING = [
@@ -125,6 +127,23 @@ class JsonPrinter(Printer):
     def build_report(self, result_sets):
         self._output = json.dumps(result_sets)
 
+class MsgpackPrinter(JsonPrinter):
+    """Writes the report in the compact binary encoding, e.g. for an engine to pick up."""
+
+    def build_report(self, result_sets):
+        if isinstance(result_sets, Report):
+            result_sets = result_sets.compile()
+        self._output = binary.encode_report(result_sets)
+
+    def print_output(self):
+        output = self.get_output()
+
+        if self._target is None:
+            sys.stdout.buffer.write(output)
+        else:
+            with open(self._target, 'wb') as target_file:
+                target_file.write(output)
+
 class HtmlPrinter(Printer):
     def print_status_output(self, status):
         output = status
@@ -224,6 +243,9 @@ _printers = {
     'html': HtmlPrinter
 }
 
+if binary.msgpack:
+    _printers[binary.BINARY_FORMAT] = MsgpackPrinter
+
 def get_printer_types():
     global _printers
 
@@ -0,0 +1,41 @@
+"""Per-host rate limiting for crawling remote portals politely."""
+
+import asyncio
+from urllib.parse import urlparse
+
+class HostRateLimiter:
+    """Allow up to `rate` requests per second to each host, in bursts of up to `burst`.
+
+    Each host has its own token bucket, so a slow or strict host does not
+    hold up requests to others. A rate of None (or 0) means no limit.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._buckets = {}
+
+    @staticmethod
+    def host_from_url(url):
+        return urlparse(url).netloc.lower()
+
+    async def acquire(self, url):
+        """Wait until a request to url's host is allowed."""
+
+        if not self.rate:
+            return
+
+        loop = asyncio.get_event_loop()
+        host = self.host_from_url(url)
+
+        while True:
+            now = loop.time()
+            tokens, updated = self._buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens >= 1:
+                self._buckets[host] = (tokens - 1, now)
+                return
+
+            self._buckets[host] = (tokens, now)
+            await asyncio.sleep((1 - tokens) / self.rate)
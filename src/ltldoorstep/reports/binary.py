@@ -0,0 +1,156 @@
+"""Compact binary encoding of compiled reports, for passing them between engines and servers.
+
+Reports are msgpack-encoded, with each issue packed into an array and its
+processor, code, message and item type replaced by indexes into a table of
+strings, as these repeat across most of a large report. JSON remains the
+default, and is always understood; msgpack is optional.
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MAGIC = b'\x00LTLR\x01'
+BINARY_FORMAT = 'msgpack'
+MEDIA_TYPE = 'application/x-ltldoorstep-report+msgpack'
+
+_ISSUE_KEYS = ('errors', 'warnings', 'informations')
+
+def get_report_formats():
+    """Formats this installation can read and write, most preferred first."""
+
+    if msgpack:
+        return [BINARY_FORMAT, 'json']
+    return ['json']
+
+def choose_report_format(offered):
+    """Pick the first of our formats that the other side also offers."""
+
+    for report_format in get_report_formats():
+        if report_format in offered:
+            return report_format
+    return 'json'
+
+def is_binary(data):
+    return isinstance(data, (bytes, bytearray)) and data[:len(MAGIC)] == MAGIC
+
+class _StringTable:
+    def __init__(self):
+        self.strings = []
+        self._indexes = {}
+
+    def index(self, string):
+        if string not in self._indexes:
+            self._indexes[string] = len(self.strings)
+            self.strings.append(string)
+        return self._indexes[string]
+
+def _pack_item(item, strings):
+    if (
+        isinstance(item, dict) and len(item) == 2 and 'properties' in item and
+        isinstance(item.get('entity'), dict) and len(item['entity']) == 3 and
+        isinstance(item['entity'].get('type'), str) and
+        'location' in item['entity'] and 'definition' in item['entity']
+    ):
+        entity = item['entity']
+        return [strings.index(entity['type']), entity['location'], entity['definition'], item['properties']]
+
+    # Anything laid out otherwise (e.g. a literal item) is kept as it is
+    return {'item': item}
+
+def _unpack_item(packed, strings):
+    if isinstance(packed, dict):
+        return packed['item']
+
+    return {
+        'entity': {
+            'type': strings[packed[0]],
+            'location': packed[1],
+            'definition': packed[2]
+        },
+        'properties': packed[3]
+    }
+
+def _pack_issue(issue, strings):
+    if (
+        isinstance(issue, dict) and
+        isinstance(issue.get('processor'), str) and
+        isinstance(issue.get('code'), str) and
+        isinstance(issue.get('message'), str) and
+        'item' in issue and 'context' in issue
+    ):
+        context = issue['context']
+        return [
+            strings.index(issue['processor']),
+            strings.index(issue['code']),
+            strings.index(issue['message']),
+            _pack_item(issue['item'], strings),
+            [_pack_item(c, strings) for c in context] if context else context,
+            issue.get('error-data', {})
+        ]
+
+    return {'issue': issue}
+
+def _unpack_issue(packed, strings):
+    if isinstance(packed, dict):
+        return packed['issue']
+
+    context = packed[4]
+    return {
+        'processor': strings[packed[0]],
+        'code': strings[packed[1]],
+        'message': strings[packed[2]],
+        'item': _unpack_item(packed[3], strings),
+        'context': [_unpack_item(c, strings) for c in context] if context else context,
+        'error-data': packed[5]
+    }
+
+def encode_report(compiled):
+    """Encode a compiled report (as from Report.compile) to bytes."""
+
+    if not msgpack:
+        raise RuntimeError(_("Binary reports need the msgpack package to be installed"))
+
+    strings = _StringTable()
+    tables = []
+    for table in compiled['tables']:
+        table = dict(table)
+        for key in _ISSUE_KEYS:
+            table[key] = [_pack_issue(issue, strings) for issue in table[key]]
+        tables.append(table)
+
+    body = dict(compiled)
+    body['tables'] = tables
+
+    return MAGIC + msgpack.packb({
+        'strings': strings.strings,
+        'report': body
+    }, use_bin_type=True)
+
+def decode_report(data):
+    """Decode bytes from encode_report back into a compiled report."""
+
+    if not msgpack:
+        raise RuntimeError(_("Binary reports need the msgpack package to be installed"))
+    if not is_binary(data):
+        raise RuntimeError(_("Not a binary report"))
+
+    envelope = msgpack.unpackb(bytes(data[len(MAGIC):]), raw=False, strict_map_key=False)
+    strings = envelope['strings']
+    compiled = envelope['report']
+
+    for table in compiled['tables']:
+        for key in _ISSUE_KEYS:
+            table[key] = [_unpack_issue(issue, strings) for issue in table[key]]
+
+    return compiled
+
+def loads_report(data):
+    """Load a compiled report from JSON text or bytes, or from the binary encoding."""
+
+    if is_binary(data):
+        return decode_report(data)
+    return json.loads(data)
@@ -0,0 +1,110 @@
+"""Size budgets for reports, keeping huge reports bounded but still informative."""
+
+import random
+from .report import ReportIssue, ReportItem
+
+TRUNCATION_CODE = 'report-truncated'
+
+class TruncationSummary(ReportIssue):
+    """Stands in for the issues of one level and code that a budget left out.
+
+    Its error-data gives exact counts and, if the budget samples, a
+    uniform random sample of the left-out issues, rendered.
+    """
+
+    __slots__ = ('summarized_code', 'kept', 'omitted', 'sample', '_random')
+
+    def __init__(self, first_omitted, kept, rng):
+        location = getattr(first_omitted.item, 'location', None)
+        if isinstance(location, dict):
+            location = {k: v for k, v in location.items() if k in ('sheet', 'table')}
+        else:
+            location = {}
+
+        self.level = first_omitted.level
+        self.processor = first_omitted.processor
+        self.code = TRUNCATION_CODE
+        self.item = ReportItem('Global', location, None, None)
+        self.context = None
+        self._error_data = None
+
+        self.summarized_code = first_omitted.code
+        self.kept = kept
+        self.omitted = 0
+        self.sample = []
+        self._random = rng
+
+    @property
+    def message(self):
+        return _("%d further issues with code '%s' were left out of this report") % (self.omitted, self.summarized_code)
+
+    @property
+    def error_data(self):
+        error_data = {
+            'code': self.summarized_code,
+            'kept': self.kept,
+            'omitted': self.omitted,
+            'total': self.kept + self.omitted
+        }
+        if self.sample:
+            error_data['sample'] = [issue.render() for issue in self.sample]
+        return error_data
+
+    def add_omitted(self, issue, sample_size):
+        self.omitted += 1
+
+        # Reservoir sampling, so the sample is uniform however many are left out
+        if len(self.sample) < sample_size:
+            self.sample.append(issue)
+        elif sample_size:
+            slot = self._random.randrange(self.omitted)
+            if slot < sample_size:
+                self.sample[slot] = issue
+
+    def render(self):
+        rendered = ReportIssue.render(self)
+        rendered['error-data'] = self.error_data
+        return rendered
+
+class IssueBudget:
+    """Keep the first `max_per_code` issues of each level and code.
+
+    Beyond that, issues are only counted (and optionally reservoir-sampled,
+    up to `sample_size` per code), with a TruncationSummary taking the
+    place of the first one left out.
+    """
+
+    def __init__(self, max_per_code, sample_size=0, seed=None):
+        self.max_per_code = max_per_code
+        self.sample_size = sample_size
+        self._random = random.Random(seed)
+        self._kept = {}
+        self._summaries = {}
+
+    def admit(self, issue):
+        """Return the issue to store in place of this one, or None if there is nothing more to store."""
+
+        if issue.code == TRUNCATION_CODE:
+            return issue
+
+        key = (issue.level, issue.code)
+        kept = self._kept.get(key, 0)
+        if kept < self.max_per_code:
+            self._kept[key] = kept + 1
+            return issue
+
+        summary = self._summaries.get(key)
+        if summary:
+            summary.add_omitted(issue, self.sample_size)
+            return None
+
+        summary = TruncationSummary(issue, kept, self._random)
+        summary.add_omitted(issue, self.sample_size)
+        self._summaries[key] = summary
+        return summary
+
+    def get_summaries(self):
+        return list(self._summaries.values())
+
+    def omitted_count(self):
+        return sum(summary.omitted for summary in self._summaries.values())
@@ -0,0 +1,205 @@
+"""Storage for a report's issues, indexed for the common queries."""
+
+import json
+import logging
+import itertools
+from collections.abc import Mapping
+
+LEVELS = (logging.ERROR, logging.WARNING, logging.INFO)
+
+def is_raw(entry):
+    return isinstance(entry, dict)
+
+def issue_key(level, entry):
+    """A key identifying an issue by its content, for spotting duplicates."""
+
+    return (level, json.dumps(render_entry(entry), sort_keys=True))
+
+def render_entry(entry):
+    """Render a stored issue, or pass on a raw (parsed JSON) one as it would render."""
+
+    if not is_raw(entry):
+        return entry.render()
+    if 'error-data' in entry:
+        return entry
+    return dict(entry, **{'error-data': {}})
+
+class IssueStore(Mapping):
+    """Issues, kept in order per log-level, and indexed by code and by processor.
+
+    Reads like the old level-to-list dict (`store[logging.ERROR]`, `items()`,
+    `level in store`), but the lists it returns must not be modified
+    directly - use `append` or `extend`, so the indexes stay in step.
+
+    Issues parsed from JSON may be added raw, with `extend_raw`. They are
+    only turned into ReportIssue objects, and indexed, once something asks
+    for them; until then they can be merged, compiled and dumped as they are.
+    """
+
+    def __init__(self, issues=None):
+        self._levels = {level: [] for level in LEVELS}
+        self._by_code = {}
+        self._by_processor = {}
+        self._raw_count = 0
+        self._stale = False
+
+        if issues:
+            for level, level_issues in issues.items():
+                self._levels.setdefault(level, [])
+                self.extend(level_issues)
+
+    def __getitem__(self, level):
+        self._materialize()
+        return self._levels[level]
+
+    def __iter__(self):
+        return iter(self._levels)
+
+    def __len__(self):
+        return len(self._levels)
+
+    def __repr__(self):
+        return '(|IssueStore: %s|)' % ', '.join(
+            '%s: %d' % (logging.getLevelName(level), len(issues))
+            for level, issues in self._levels.items()
+        )
+
+    @property
+    def is_materialized(self):
+        return not self._raw_count
+
+    def _materialize(self):
+        if self._raw_count:
+            from .report import ReportIssue
+
+            for level, entries in self._levels.items():
+                self._levels[level] = [
+                    ReportIssue.parse(level, entry) if is_raw(entry) else entry
+                    for entry in entries
+                ]
+            self._raw_count = 0
+
+        if self._stale:
+            self._by_code.clear()
+            self._by_processor.clear()
+            for issue in itertools.chain.from_iterable(self._levels.values()):
+                self._index(self._by_code, issue.code, issue, False)
+                self._index(self._by_processor, issue.processor, issue, False)
+            self._stale = False
+
+    @staticmethod
+    def _index(index, key, issue, prepend):
+        if key not in index:
+            index[key] = {}
+        level_issues = index[key].setdefault(issue.level, [])
+
+        if prepend:
+            level_issues.insert(0, issue)
+        else:
+            level_issues.append(issue)
+
+    def _select(self, index, key, level):
+        self._materialize()
+
+        if key not in index:
+            return []
+
+        by_level = index[key]
+        if level:
+            return list(by_level.get(level, []))
+        return list(itertools.chain.from_iterable(
+            by_level[lvl] for lvl in self._levels if lvl in by_level
+        ))
+
+    def append(self, issue, prepend=False):
+        if issue.level not in self._levels:
+            raise RuntimeError(_('Log-level must be one of logging.INFO, logging.WARNING or logging.ERROR'))
+
+        if prepend:
+            self._levels[issue.level].insert(0, issue)
+        else:
+            self._levels[issue.level].append(issue)
+
+        # While there are raw issues, indexing waits until they are parsed
+        if not self._stale:
+            self._index(self._by_code, issue.code, issue, prepend)
+            self._index(self._by_processor, issue.processor, issue, prepend)
+
+    def extend(self, issues):
+        for issue in issues:
+            self.append(issue)
+
+    def extend_raw(self, level, raw_issues):
+        """Add issue dicts, as found in a compiled report, without parsing them."""
+
+        self._extend_entries(level, list(raw_issues))
+
+    def update(self, other, seen=None):
+        """Add every issue from another store, or level-to-list mapping, level by level.
+
+        If a set is given as `seen`, issues whose keys are already in it are
+        skipped, and the keys of those added are put into it.
+        """
+
+        if isinstance(other, IssueStore):
+            levels = other.iter_levels()
+            raw = bool(other._raw_count)
+        else:
+            levels = other.items()
+            raw = False
+
+        for level, entries in levels:
+            if seen is not None:
+                entries = [entry for entry in entries if not self._check_seen(seen, level, entry)]
+
+            if raw:
+                self._extend_entries(level, entries)
+            else:
+                self._levels.setdefault(level, [])
+                self.extend(entries)
+
+    def _extend_entries(self, level, entries):
+        # Raw issues are kept as they are, and indexing left until they are parsed
+        self._levels.setdefault(level, []).extend(entries)
+        self._raw_count += sum(1 for entry in entries if is_raw(entry))
+        if entries:
+            self._stale = True
+
+    @staticmethod
+    def _check_seen(seen, level, entry):
+        key = issue_key(level, entry)
+        if key in seen:
+            return True
+        seen.add(key)
+        return False
+
+    def seen_keys(self):
+        """Keys of every stored issue, as used to skip duplicates in `update`."""
+
+        return {issue_key(level, entry) for level, entries in self._levels.items() for entry in entries}
+
+    def iter_levels(self):
+        """Yield each level and its stored issues, which may include raw dicts, without parsing."""
+
+        return iter(self._levels.items())
+
+    def get_issues(self, level=None):
+        self._materialize()
+        if level:
+            return self._levels[level]
+        return list(itertools.chain.from_iterable(self._levels.values()))
+
+    def get_issues_by_code(self, code, level=None):
+        return self._select(self._by_code, code, level)
+
+    def get_issues_by_processor(self, processor, level=None):
+        return self._select(self._by_processor, processor, level)
+
+    def get_processors(self):
+        self._materialize()
+        return list(self._by_processor)
+
+    def count(self, level=None):
+        if level:
+            return len(self._levels[level])
+        return sum(len(issues) for issues in self._levels.values())
@@ -2,11 +2,22 @@
 The Report superclass can be inherited for different forms of reporting i.e. tabular, GeoJSON etc."""
 
 
+import io
 import logging
 import json
 import os
+import sys
 from ..metadata import DoorstepContext
 from ..encoders import Serializable
+from .issue_store import IssueStore, is_raw, render_entry, issue_key
+from .binary import loads_report, encode_report, BINARY_FORMAT
+
+ISSUE_LIST_KEYS = ('errors', 'warnings', 'informations')
+
+class ReportTooLong(RuntimeError):
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        super().__init__(_("Report is too long: more than %d characters") % max_chars)
 
 def get_report_class_from_preset(preset):
     if preset not in _report_class_from_preset:
@@ -15,7 +26,13 @@ def get_report_class_from_preset(preset):
         ))
     return _report_class_from_preset[preset]
 
+def _intern(value):
+    # Codes and processor names repeat across every issue of a large report
+    return sys.intern(value) if type(value) is str else value
+
 class ReportItem:
+    __slots__ = ('type', 'location', 'definition', 'properties')
+
     def __init__(self, typ, location, definition, properties):
         self.type = typ
         self.location = location
@@ -51,6 +68,8 @@ class ReportItem:
         }
 
 class ReportItemLiteral(ReportItem):
+    __slots__ = ('literal',)
+
     def __init__(self, literal):
         self.literal = literal
 
@@ -58,17 +77,27 @@ class ReportItemLiteral(ReportItem):
         return self.literal
 
 class ReportIssue:
+    __slots__ = ('level', 'item', 'context', 'processor', 'code', 'message', '_error_data')
+
     def __init__(self, level, item, context, processor, code, message, error_data=None):
         self.level = level
-        self.processor = processor
-        self.code = code
+        self.processor = _intern(processor)
+        self.code = _intern(code)
         self.message = message
         self.item = item
         self.context = context
+        self._error_data = error_data
+
+    @property
+    def error_data(self):
+        # Most issues have none, so the empty dict is only made when asked for
+        if self._error_data is None:
+            self._error_data = {}
+        return self._error_data
 
-        if error_data is None:
-            error_data = {}
-        self.error_data = error_data
+    @error_data.setter
+    def error_data(self, error_data):
+        self._error_data = error_data
 
     def __str__(self):
         return json.dumps(self.render())
@@ -98,13 +127,17 @@ class ReportIssue:
             'message' : self.message,
             'item': self.item.render(),
             'context': [c.render() for c in self.context] if self.context else None,
-            'error-data': self.error_data
+            'error-data': self._error_data if self._error_data is not None else {}
         }
 
 class ReportIssueLiteral(ReportIssue):
+    __slots__ = ('literal',)
+
     def __init__(self, level, literal, literal_item):
         self.level = level
         self.literal = literal
+        self.processor = _intern(literal.get('processor'))
+        self.code = _intern(literal.get('code'))
         self.item = ReportItemLiteral(literal_item)
 
     def render(self):
@@ -131,14 +164,10 @@ class Report(Serializable):
         else:
             comp = lambda p: p.split(':')[0] == processor
 
-        return any([comp(p) for p in group])
+        return any(comp(p) for p in group)
 
     def get_subprocessors(self):
-        subprocessors = set()
-        for level in self.issues.values():
-            for issue in level:
-                subprocessors.add(issue.processor)
-        return list(subprocessors)
+        return self.issues.get_processors()
 
     def __serialize__(self):
         return self.compile()
@@ -150,14 +179,10 @@ class Report(Serializable):
         return '(|Report: %s|)' % str(self)
 
     def __init__(self, processor, info, filename='', metadata=None, headers=None, encoding='utf-8', time=0., row_count=None, supplementary=None, issues=None):
-        if issues is None:
-            self.issues = {
-                logging.ERROR: [],
-                logging.WARNING: [],
-                logging.INFO: []
-            }
-        else:
+        if isinstance(issues, IssueStore):
             self.issues = issues
+        else:
+            self.issues = IssueStore(issues)
 
         if metadata is None:
             metadata = {}
@@ -166,6 +191,7 @@ class Report(Serializable):
 
         self.processor = processor
         self.info = info
+        self.budget = None
         self.supplementary = supplementary
         self.filename = filename
         self.metadata = metadata
@@ -179,31 +205,48 @@ class Report(Serializable):
         }
 
     def get_issues(self, level=None):
-        if level:
-            return self.issues[level]
-        return sum(list(self.issues.values()), [])
+        return self.issues.get_issues(level)
 
     def get_issues_by_code(self, code, level=None):
-        issues = self.get_issues(level)
-        return [issue for issue in issues if issue.code == code]
+        return self.issues.get_issues_by_code(code, level)
+
+    def get_issues_by_processor(self, processor, level=None):
+        return self.issues.get_issues_by_processor(processor, level)
 
     def append_issue(self, issue, prepend=False):
-        if prepend:
-            self.issues[issue.level].insert(0, issue)
-        else:
-            self.issues[issue.level].append(issue)
+        if self.budget:
+            issue = self.budget.admit(issue)
+            if issue is None:
+                return
+
+        self.issues.append(issue, prepend=prepend)
+
+    def set_budget(self, budget):
+        """Cap the issues kept from now on, e.g. with an IssueBudget."""
+
+        self.budget = budget
+
+    def with_budget(self, budget):
+        """Return a copy of this report, with its issues passed through a budget."""
+
+        bounded = self.__class__(self.processor, self.info, filename=self.filename, metadata=self.metadata)
+        bounded.properties = dict(self.properties)
+        bounded.set_budget(budget)
+        bounded.update(self)
+        return bounded
 
     @classmethod
     def load(cls, file_obj):
-        return cls.parse(json.load(file_obj))
+        """Load a compiled report from a file, in JSON or the binary encoding."""
+
+        return cls.parse(loads_report(file_obj.read()))
 
     @classmethod
     def parse(cls, dictionary):
-        issues = {
-            logging.INFO: [],
-            logging.WARNING: [],
-            logging.ERROR: []
-        }
+        if isinstance(dictionary, (str, bytes, bytearray)):
+            dictionary = loads_report(dictionary)
+
+        issues = IssueStore()
         # table = {}
         filename = dictionary['filename']
 
@@ -222,23 +265,10 @@ class Report(Serializable):
         for table in dictionary['tables']:
             # print("*****type check**** %s" % type(dictionary))
 
-            issues[logging.ERROR] += [
-                ReportIssue.parse(logging.ERROR, issue)
-                for issue in
-                    table['errors']
-            ]
-
-            issues[logging.WARNING] += [
-                ReportIssue.parse(logging.WARNING, issue)
-                for issue in
-                    table['warnings']
-            ]
-
-            issues[logging.INFO] += [
-                ReportIssue.parse(logging.INFO, issue)
-                for issue in
-                    table['informations']
-            ]
+            # Issues are only parsed into objects if they are asked for
+            issues.extend_raw(logging.ERROR, table['errors'])
+            issues.extend_raw(logging.WARNING, table['warnings'])
+            issues.extend_raw(logging.INFO, table['informations'])
 
             if metadata is None:
                 metadata = DoorstepContext(context_format=table['format'])
@@ -264,9 +294,22 @@ class Report(Serializable):
             issues=issues
         )
 
-    def update(self, additional):
-        for level, issues in additional.issues.items():
-            self.issues[level] += issues
+    def update(self, additional, seen=None):
+        """Add another report's issues and supplementary data to this one.
+
+        If a set is given as `seen`, issues already in it (by content) are skipped.
+        """
+
+        if self.budget:
+            for issue in additional.get_issues():
+                if seen is not None:
+                    key = issue_key(issue.level, issue)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                self.append_issue(issue)
+        else:
+            self.issues.update(additional.issues, seen=seen)
 
         self.supplementary += additional.supplementary
 
@@ -278,7 +321,21 @@ class Report(Serializable):
     def table_string_from_issue(issue):
         return ''
 
-    def compile(self, filename=None, metadata=None):
+    @staticmethod
+    def table_string_from_raw(raw_issue):
+        return ''
+
+    def table_string_from_entry(self, entry):
+        if is_raw(entry):
+            return self.table_string_from_raw(entry)
+        return self.table_string_from_issue(entry)
+
+    def _compile(self, filename=None, metadata=None):
+        """Lay out the report as compile() does, but with issue lists left unrendered.
+
+        Issues still raw from parsing are laid out without being parsed.
+        """
+
         supplementary = self.supplementary
 
         if filename is None:
@@ -297,19 +354,19 @@ class Report(Serializable):
             if frmt and frmt[0] == '.':
                 frmt = frmt[1:]
 
-        table_strings = {self.table_string_from_issue(issue) for issues in self.issues.values() for issue in issues}
-        table_strings = sorted(list(table_strings))
-        issues_by_table = {ts: {logging.ERROR: [], logging.WARNING: [], logging.INFO: []} for ts in table_strings}
-        for level, issue_list in self.issues.items():
+        issues_by_table = {}
+        for level, issue_list in self.issues.iter_levels():
             for issue in issue_list:
-                issues_by_table[self.table_string_from_issue(issue)][level].append(issue)
+                table_string = self.table_string_from_entry(issue)
+                if table_string not in issues_by_table:
+                    issues_by_table[table_string] = {logging.ERROR: [], logging.WARNING: [], logging.INFO: []}
+                issues_by_table[table_string][level].append(issue)
 
         tables = []
         total_errors = 0
         total_valid = True
-        for table_string in table_strings:
-            table = issues_by_table[table_string]
-            report = {k: [item.render() for item in v] for k, v in table.items()}
+        for table_string in sorted(issues_by_table):
+            report = issues_by_table[table_string]
             error_count = sum([len(r) for r in report.values()])
             total_errors += error_count
             valid = not bool(report[logging.ERROR])
@@ -347,6 +404,90 @@ class Report(Serializable):
 
         return results
 
+    def compile(self, filename=None, metadata=None):
+        results = self._compile(filename, metadata)
+
+        for table in results['tables']:
+            for key in ISSUE_LIST_KEYS:
+                table[key] = [render_entry(issue) for issue in table[key]]
+
+        return results
+
+    def dumps(self, report_format='json', max_chars=None):
+        """Serialize the compiled report, as a JSON string or, for 'msgpack', binary-encoded bytes.
+
+        Either way, ReportTooLong is raised beyond `max_chars` characters (or bytes).
+        """
+
+        if report_format == 'json':
+            result_file = io.StringIO()
+            self.dump(result_file, max_chars=max_chars)
+            return result_file.getvalue()
+
+        if report_format != BINARY_FORMAT:
+            raise RuntimeError(_("Unknown report format: %s") % report_format)
+
+        result = encode_report(self.compile())
+        if max_chars is not None and len(result) > max_chars:
+            raise ReportTooLong(max_chars)
+        return result
+
+    def dump(self, file_obj, filename=None, metadata=None, max_chars=None):
+        """Write the compiled report to a file object as JSON, an issue at a time.
+
+        The output matches `json.dumps(report.compile())`, but neither the
+        compiled dict nor the whole string is held in memory. If `max_chars`
+        is given, ReportTooLong is raised as soon as more would be written.
+        """
+
+        results = self._compile(filename, metadata)
+
+        if max_chars is None:
+            write = file_obj.write
+        else:
+            written = 0
+
+            def write(chunk):
+                nonlocal written
+                written += len(chunk)
+                if written > max_chars:
+                    raise ReportTooLong(max_chars)
+                file_obj.write(chunk)
+
+        def write_list(values, write_value):
+            write('[')
+            for i, value in enumerate(values):
+                if i:
+                    write(', ')
+                write_value(value)
+            write(']')
+
+        def write_object(obj, write_value):
+            write('{')
+            for i, (key, value) in enumerate(obj.items()):
+                if i:
+                    write(', ')
+                write(json.dumps(key) + ': ')
+                write_value(key, value)
+            write('}')
+
+        def write_issue(issue):
+            write(json.dumps(render_entry(issue)))
+
+        def write_table_value(key, value):
+            if key in ISSUE_LIST_KEYS:
+                write_list(value, write_issue)
+            else:
+                write(json.dumps(value))
+
+        def write_results_value(key, value):
+            if key == 'tables':
+                write_list(value, lambda table: write_object(table, write_table_value))
+            else:
+                write(json.dumps(value))
+
+        write_object(results, write_results_value)
+
     def add_supplementary(self, typ, source, name):
         logging.warning('Adding supplementary')
         logging.warning((typ, source, name))
@@ -387,23 +528,54 @@ def properties_from_report(report):
         'headers': table['headers']
     }
 
-def combine_reports(*reports, base=None):
-    if base is None:
-        presets = {report.preset for report in reports if report.preset}
+def merge_reports(reports, base=None, dedupe=False):
+    """Merge reports into one, taking them one at a time from an iterable.
 
-        if len(presets) != 1:
-            raise RuntimeError(
-                _("Report combining can only be performed on reports with the same 'preset' property")
-            )
-        preset = list(presets)[0]
-        rcls = get_report_class_from_preset(preset)
-        base = rcls(None, None)
+    Each may be a Report, or a compiled report as a path or open file, which
+    is only loaded when its turn comes - so only one input need be in memory
+    alongside the output. All must share a preset. With `dedupe`, an issue
+    identical to one already merged, at the same level, is dropped.
+    """
+
+    seen = None
+    if dedupe:
+        seen = base.issues.seen_keys() if base is not None else set()
 
+    preset = base.preset if base is not None else None
     for report in reports:
-        base.update(report)
+        if isinstance(report, str):
+            with open(report, 'rb') as report_file:
+                report = Report.load(report_file)
+        elif not isinstance(report, Report):
+            report = Report.load(report)
+
+        if report.preset:
+            if preset is None:
+                preset = report.preset
+            elif report.preset != preset:
+                raise RuntimeError(
+                    _("Report combining can only be performed on reports with the same 'preset' property")
+                )
+
+        if base is None:
+            if not preset:
+                raise RuntimeError(
+                    _("Report combining can only be performed on reports with the same 'preset' property")
+                )
+            base = get_report_class_from_preset(preset)(None, None)
+
+        base.update(report, seen=seen)
+
+    if base is None:
+        raise RuntimeError(
+            _("Report combining can only be performed on reports with the same 'preset' property")
+        )
 
     return base
 
+def combine_reports(*reports, base=None):
+    return merge_reports(reports, base=base)
+
 
 from .geojson import GeoJSONReport
 from .tabular import TabularReport
@@ -5,12 +5,22 @@ class TabularReport(Report):
 
     preset = 'tabular'
 
+    # Validators usually report several cells of a row in turn, so the row's
+    # context item is kept and shared until a different row is reported
+    _last_context = None
+
     @staticmethod
     def table_string_from_issue(issue):
         sheet = issue.item.location['sheet'] if 'sheet' in issue.item.location else None
         table = issue.item.location['table'] if 'table' in issue.item.location else None
         return TabularReport.table_string_from_sheet_table(sheet, table)
 
+    @staticmethod
+    def table_string_from_raw(raw_issue):
+        entity = raw_issue['item']['entity'] if raw_issue['item'] else None
+        location = entity['location'] if entity and entity['location'] else {}
+        return TabularReport.table_string_from_sheet_table(location.get('sheet'), location.get('table'))
+
     @staticmethod
     def table_string_from_sheet_table(sheet, table):
         table_string = ':'
@@ -25,6 +35,18 @@ class TabularReport(Report):
 
         return table_string
 
+    def _get_row_context(self, location, row):
+        context_location = dict(location)
+        context_location['column'] = None
+
+        last = self._last_context
+        if last and last[0] == context_location and last[1][0].properties == row:
+            return last[1]
+
+        context = [ReportItem('Row', context_location, None, row)]
+        self._last_context = (context_location, context)
+        return context
+
     def add_issue(self, log_level, code, message, row_number=None, column_number=None, row=None, error_data=None, at_top=False, sheet=None, table=None):
         """This function will add an issue to the report and takes as parameters the processor, the log level, code, message"""
 
@@ -61,9 +83,7 @@ class TabularReport(Report):
             if column_number:
                 typ = 'Cell'
                 if row:
-                    context_location = dict(location)
-                    context_location['column'] = None
-                    context = [ReportItem('Row', context_location, None, row)]
+                    context = self._get_row_context(location, row)
             else:
                 typ = 'Row'
                 properties = row
@@ -0,0 +1,131 @@
+"""Bounded, prioritized running of session jobs within a server."""
+
+import asyncio
+import itertools
+import logging
+from .errors import LintolDoorstepBusyException
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUED = 16
+
+# Lower runs first; anything unrecognised is treated as interactive
+PRIORITIES = {
+    'interactive': 0,
+    'crawler': 1
+}
+DEFAULT_PRIORITY = 'interactive'
+
+class JobScheduler:
+    """Run at most `workers` jobs at once, interactive jobs ahead of crawler ones.
+
+    Once `max_queued` jobs are waiting, further jobs are refused with a
+    LintolDoorstepBusyException, so that a client can try another server
+    rather than queue behind a crawl.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._loop = None
+        self._queue = None
+        self._workers = []
+        self._sequence = itertools.count()
+        self._queued = {priority: 0 for priority in PRIORITIES}
+        self._running = 0
+        self._counts = {
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0
+        }
+
+    @staticmethod
+    def get_priorities():
+        return list(PRIORITIES)
+
+    def _ensure_workers(self):
+        # Workers belong to a loop, and the server makes a new one on reconnecting
+        loop = asyncio.get_event_loop()
+        if self._loop is loop:
+            return
+
+        self._loop = loop
+        self._queue = asyncio.PriorityQueue()
+        self._queued = {priority: 0 for priority in PRIORITIES}
+        self._running = 0
+        self._workers = [asyncio.ensure_future(self._work()) for _i in range(self.workers)]
+
+    async def _work(self):
+        while True:
+            __, __, priority, job, future = await self._queue.get()
+            self._queued[priority] -= 1
+
+            if future.done():
+                continue
+
+            self._running += 1
+            try:
+                result = await job()
+            except Exception as error:
+                self._counts['failed'] += 1
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                self._counts['completed'] += 1
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._running -= 1
+
+    def queued(self):
+        return sum(self._queued.values())
+
+    def saturated(self):
+        return bool(self.max_queued) and self.queued() >= self.max_queued
+
+    def check_capacity(self):
+        """Raise if a new job would be refused, so it can be turned away early."""
+
+        if self.saturated():
+            self._counts['rejected'] += 1
+            raise LintolDoorstepBusyException(
+                RuntimeError(_("Server has %d jobs queued") % self.queued()),
+                status_code=503
+            )
+
+    async def submit(self, job, priority=None):
+        """Queue job, a coroutine function taking no arguments, and return its result once run."""
+
+        if priority not in PRIORITIES:
+            priority = DEFAULT_PRIORITY
+
+        self._ensure_workers()
+        self.check_capacity()
+
+        future = self._loop.create_future()
+        self._queued[priority] += 1
+        self._queue.put_nowait((PRIORITIES[priority], next(self._sequence), priority, job, future))
+
+        if self._running >= self.workers:
+            logging.info(_("Job queued behind %d others"), self.queued() - 1)
+
+        return await future
+
+    def metrics(self):
+        """Queue depth and worker use, for status reporting."""
+
+        metrics = {
+            'workers': self.workers,
+            'running': self._running,
+            'queued': self.queued(),
+            'queued-by-priority': dict(self._queued),
+            'max-queued': self.max_queued
+        }
+        metrics.update(self._counts)
+
+        return metrics
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        self._loop = None
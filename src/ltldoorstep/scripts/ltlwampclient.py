@@ -18,7 +18,8 @@ from ltldoorstep.wamp_client import launch_wamp, announce_wamp
 from ltldoorstep.data_store import CkanDataStore, DummyDataStore
 from ltldoorstep.crawler import execute_workflow, do_crawl
 from ltldoorstep.wamp_client import launch_wamp
-from ltldoorstep.watch import monitor_for_changes, watch_gather, crawl_gather, search_gather
+from ltldoorstep.fingerprint_cache import ResourceFingerprintCache
+from ltldoorstep.watch import monitor_for_changes, watch_gather, crawl_gather, search_gather, sync_gather
 
 LOGGING_FORMAT = '%(asctime)-15s %(message)s'
 
@@ -54,8 +55,12 @@ def status(ctx):
     bucket = ctx.obj['bucket']
     router_url = ctx.obj['router_url']
 
-    async def status_observe(server_id, status):
+    async def status_observe(server_id, status, sessions=None, jobs=None):
         print(server_id, status)
+        if sessions:
+            print(server_id, sessions)
+        if jobs:
+            print(server_id, jobs)
 
     async def _exec(cmpt):
         try:
@@ -115,8 +120,17 @@ def process(ctx, filename, workflow, metadata):
 @click.option('--force-update/--no-force-update', default=False)
 @click.option('--time-delay', default=5, help='How long between repeated calls')
 @click.option('--skip', default=0, help='How many entries to skip')
+@click.option('--concurrency', default=4, help='How many packages to fetch from CKAN at once')
+@click.option('--request-rate', default=10.0, help='Most requests per second to make to the CKAN target (0 for no limit)')
+@click.option('--seen-store', default=None, help='SQLite file recording what has been announced, kept across restarts')
+@click.option('--seen-ttl', default=30, help='Days before a package or resource may be announced again')
+@click.option('--sync/--no-sync', default=False, help='Follow only packages modified since the last one seen, by metadata_modified')
+@click.option('--cursor-file', default=None, help='File keeping the --sync position across restarts')
+@click.option('--fingerprints/--no-fingerprints', default=False, help='Only announce resources whose data has changed, checked with conditional requests')
+@click.option('--fingerprint-store', default=None, help='SQLite file keeping resource fingerprints across restarts')
+@click.option('--trust-resource-metadata/--no-trust-resource-metadata', default=False, help='Treat resources with unchanged CKAN metadata as unchanged, without a request')
 @click.pass_context
-def crawl(ctx, workflow, url, search, watch, watch_refresh_delay, publish, dummy_ckan, force_update, time_delay, skip):
+def crawl(ctx, workflow, url, search, watch, watch_refresh_delay, publish, dummy_ckan, force_update, time_delay, skip, concurrency, request_rate, seen_store, seen_ttl, sync, cursor_file, fingerprints, fingerprint_store, trust_resource_metadata):
     """
     Crawl function gets the URL of all packages in the CKAN instance.
     Adding the 'watch' option only gets it to look for datasets added/altered since crawl started to run.
@@ -141,10 +155,19 @@ def crawl(ctx, workflow, url, search, watch, watch_refresh_delay, publish, dummy
         search_settings = json.loads(search)
         gather_fn = lambda c, w, td, sk, cw: search_gather(c, w, search_settings, td, sk, cw)
 
+    if sync:
+        if watch or search:
+            raise RuntimeError("Can only use one of sync, watch or search")
+        gather_fn = sync_gather
+
     if dummy_ckan:
         client = DummyDataStore()
     else:
-        client = CkanDataStore(url)
+        client = CkanDataStore(url, cursor_path=cursor_file)
+
+    fingerprint_cache = None
+    if fingerprints or fingerprint_store:
+        fingerprint_cache = ResourceFingerprintCache(fingerprint_store, trust_metadata=trust_resource_metadata)
 
     async def _run():
         async def cmpt_wrap(fn, *args):
@@ -171,7 +194,12 @@ def crawl(ctx, workflow, url, search, watch, watch_refresh_delay, publish, dummy
                 gather_fn,
                 force_update,
                 time_delay,
-                skip
+                skip,
+                concurrency=concurrency,
+                request_rate=request_rate,
+                seen_path=seen_store,
+                seen_ttl=seen_ttl * 24 * 3600,
+                fingerprints=fingerprint_cache
             )
         finally:
             loop = asyncio.get_event_loop()
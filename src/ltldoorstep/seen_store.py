@@ -0,0 +1,99 @@
+"""Record of which packages and resources a watcher has already dealt with."""
+
+import time
+import sqlite3
+import hashlib
+import json
+
+DEFAULT_TTL = 30 * 24 * 3600
+
+# Resource fields that, between them, change whenever the resource does
+RESOURCE_FINGERPRINT_FIELDS = ('id', 'url', 'hash', 'size', 'last_modified', 'revision_id', 'format')
+
+def resource_hash(resource):
+    """A digest of the resource fields that identify its current version."""
+
+    fingerprint = {field: resource.get(field) for field in RESOURCE_FINGERPRINT_FIELDS}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+
+class SeenStore:
+    """A set of (data store, package id, revision id, resource hash) keys, kept in SQLite.
+
+    Membership is checked against an in-memory set, loaded when the store
+    is opened, so it is O(1); additions are written through to disk, so a
+    restarted watcher carries on where it left off. Keys older than `ttl`
+    seconds are pruned, so the store does not grow forever. Without a path,
+    nothing outlives the process.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._db = sqlite3.connect(path or ':memory:')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS seen ('
+            ' store TEXT NOT NULL,'
+            ' package TEXT NOT NULL,'
+            ' revision TEXT NOT NULL,'
+            ' resource_hash TEXT NOT NULL,'
+            ' seen_at REAL NOT NULL,'
+            ' PRIMARY KEY (store, package, revision, resource_hash)'
+            ')'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS seen_at ON seen (seen_at)')
+        self._db.commit()
+
+        self._keys = set()
+        self.prune()
+        self._load()
+
+    def _load(self):
+        self._keys = set(self._db.execute('SELECT store, package, revision, resource_hash FROM seen'))
+
+    @staticmethod
+    def make_key(store, package, revision, resource_hash=''):
+        return (str(store), str(package), str(revision), resource_hash)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, *keys):
+        """Record keys as seen, now."""
+
+        keys = [key for key in keys if key not in self._keys]
+        if not keys:
+            return
+
+        now = time.time()
+        self._db.executemany(
+            'INSERT OR REPLACE INTO seen VALUES (?, ?, ?, ?, ?)',
+            [key + (now,) for key in keys]
+        )
+        self._db.commit()
+        self._keys.update(keys)
+
+    def prune(self):
+        """Forget keys seen longer than the TTL ago, returning how many were dropped."""
+
+        if not self.ttl:
+            return 0
+
+        cursor = self._db.execute('DELETE FROM seen WHERE seen_at < ?', (time.time() - self.ttl,))
+        self._db.commit()
+
+        if cursor.rowcount:
+            self._load()
+
+        return cursor.rowcount
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctyp, excval, exctbk):
+        self.close()
@@ -0,0 +1,193 @@
+"""On-disk cache of supplementary data, shared by all processors and sessions."""
+
+import os
+import json
+import shutil
+import time
+import stat
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+from .file import DOWNLOAD_CHUNK_SIZE
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+def default_cache_directory():
+    """Find, creating if need be, this user's cache directory, refusing one anyone else could have planted."""
+
+    # Kept with other temporary files, as it can always be downloaded again
+    directory = os.path.join(tempfile.gettempdir(), 'ltldoorstep-supplementary-%d' % os.getuid())
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    status = os.lstat(directory)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise RuntimeError(_("Supplementary cache directory %s must be a directory private to this user") % directory)
+
+    return directory
+
+def download_supplementary(url, target, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Fetch supplementary data straight to target, without caching."""
+
+    r = requests.get(url, stream=True)
+    if r.status_code != 200:
+        raise RuntimeError(_("Could not retrieve supplementary data: %d") % r.status_code)
+
+    with open(target, 'wb') as target_file:
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            target_file.write(chunk)
+
+class SupplementaryCache:
+    """Supplementary downloads, stored by content hash and indexed by URL.
+
+    A cached URL is revalidated with its ETag or Last-Modified date on each
+    use, so unchanged reference data is not downloaded again. Once the cache
+    holds more than `max_size` bytes, the least recently used entries are
+    dropped. Each job is given its own copy, as anything placed in a job
+    directory can be altered by the processor running there.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_CACHE_SIZE):
+        if not directory:
+            directory = default_cache_directory()
+
+        self.directory = directory
+        self.max_size = max_size
+        self._objects = os.path.join(directory, 'objects')
+        self._index_path = os.path.join(directory, 'index.json')
+        self._lock = threading.Lock()
+        self._url_locks = {}
+
+        os.makedirs(self._objects, exist_ok=True)
+        self._index = self._load_index()
+
+    @staticmethod
+    def key_from_url(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, 'r') as index_file:
+                index = json.load(index_file)
+        except (IOError, ValueError):
+            index = {}
+
+        index = {
+            key: entry for key, entry in index.items()
+            if os.path.exists(self._object_path(entry['digest']))
+        }
+
+        # Objects left by an interrupted update would otherwise never be evicted
+        referenced = {entry['digest'] for entry in index.values()}
+        for digest in os.listdir(self._objects):
+            if digest not in referenced:
+                self._unlink_object(digest)
+
+        return index
+
+    def _save_index(self):
+        handle, path = tempfile.mkstemp(dir=self.directory, prefix='index-')
+        with os.fdopen(handle, 'w') as index_file:
+            json.dump(self._index, index_file)
+        os.replace(path, self._index_path)
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects, digest)
+
+    def _unlink_object(self, digest):
+        try:
+            os.unlink(self._object_path(digest))
+        except OSError:
+            pass
+
+    def _unlink_unreferenced(self, digest):
+        # Jobs have their own copies, so are unaffected
+        if not any(entry['digest'] == digest for entry in self._index.values()):
+            self._unlink_object(digest)
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self._index.values())
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]['used']):
+            if total <= self.max_size:
+                break
+
+            del self._index[key]
+            total -= entry['size']
+            self._unlink_unreferenced(entry['digest'])
+
+    def _download(self, url, entry):
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            r = requests.get(url, stream=True, headers=headers)
+        except requests.exceptions.RequestException as e:
+            if not entry:
+                raise
+            logging.warning(_("Could not revalidate %s, using cached copy: %s"), url, e)
+            return entry
+
+        if entry and r.status_code == 304:
+            return entry
+
+        if r.status_code != 200:
+            raise RuntimeError(_("Could not retrieve supplementary data: %d") % r.status_code)
+
+        logging.info(_("Downloading %s"), url)
+        digest = hashlib.sha256()
+        size = 0
+        handle, partial = tempfile.mkstemp(dir=self.directory, prefix='partial-')
+        try:
+            with os.fdopen(handle, 'wb') as partial_file:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    partial_file.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            os.chmod(partial, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(partial, self._object_path(digest.hexdigest()))
+        except BaseException:
+            if os.path.exists(partial):
+                os.unlink(partial)
+            raise
+
+        return {
+            'url': url,
+            'digest': digest.hexdigest(),
+            'size': size,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified')
+        }
+
+    def fetch(self, url, target):
+        """Place the data at url at target, downloading it only if it is not cached or has changed."""
+
+        key = self.key_from_url(url)
+
+        with self._lock:
+            url_lock = self._url_locks.setdefault(key, threading.Lock())
+
+        with url_lock:
+            with self._lock:
+                previous = self._index.get(key)
+
+            entry = dict(self._download(url, previous))
+            entry['used'] = time.time()
+
+            with self._lock:
+                self._index[key] = entry
+                # Held open, the object survives eviction until it is copied
+                source = open(self._object_path(entry['digest']), 'rb')
+                if previous and previous['digest'] != entry['digest']:
+                    self._unlink_unreferenced(previous['digest'])
+                self._evict()
+                self._save_index()
+
+            with source, open(target, 'wb') as target_file:
+                shutil.copyfileobj(source, target_file, DOWNLOAD_CHUNK_SIZE)
+
+        return target
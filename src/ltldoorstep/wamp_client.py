@@ -12,30 +12,117 @@ from .wamp_server import DoorstepComponent, SessionSet
 from .ini import DoorstepIni
 from .metadata import DoorstepContext
 from . import errors
+from .reports.binary import choose_report_format, loads_report
+from . import compression
 
+ENGAGE_ATTEMPTS = 5
+ENGAGE_RETRY_DELAY = 2
 
-class WampClientComponent(ApplicationSession):
-    """Connector to join and execute a WAMP session."""
 
-    _server = None
-    _session = None
+class ServerSession:
+    """A session engaged on one server, with what has been negotiated with that server.
 
-    def __init__(self, on_join, on_join_fut, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.on_join = on_join
-        self.on_join_fut = on_join_fut
+    Several may be open on one WampClientComponent at once, each running
+    its own workflow.
+    """
 
-    async def onJoin(self, details):
-        logging.error("Joined")
-        result = await self.on_join(self)
-        self.on_join_fut.set_result(result)
-        return result
+    def __init__(self, component):
+        self._component = component
+        self._server = None
+        self._session = None
+        self._capabilities = None
+        self._report_format = None
+        self._compression = None
+
+    async def engage(self, attempts=ENGAGE_ATTEMPTS):
+        """Take a session on whichever server picks up the engagement.
+
+        A server that is too busy turns the engagement away, and the
+        router's round-robin passes the next attempt to another server.
+        """
+
+        for attempt in range(attempts):
+            try:
+                self._server, self._session = await self._component.call('com.ltldoorstep.engage')
+                break
+            except ApplicationError as e:
+                if e.error != 'LintolDoorstepBusyException' or attempt == attempts - 1:
+                    raise
+                logging.warning(_("Server busy, retrying engagement"))
+                await asyncio.sleep(ENGAGE_RETRY_DELAY * (attempt + 1))
+
+        return self._server, self._session
+
+    async def get_capabilities(self):
+        """Find out what the current server supports, asking it only once."""
+
+        if self._capabilities is None:
+            try:
+                self._capabilities = await self._component.call(
+                    'com.ltldoorstep.{server}.capabilities'.format(server=self._server)
+                )
+            except ApplicationError:
+                # Servers predating negotiation only send JSON, uncompressed
+                self._capabilities = {}
+
+        return self._capabilities
+
+    async def get_report_format(self):
+        """Agree the best report format that both we and the current server support."""
+
+        if not self._report_format:
+            capabilities = await self.get_capabilities()
+            self._report_format = choose_report_format(capabilities.get('report-formats', []))
+
+        return self._report_format
+
+    async def post_data(self, filename, content, redirect, priority=None):
+        """Send the data to process, with a job priority if the server takes one."""
+
+        capabilities = await self.get_capabilities()
+        if priority and priority in capabilities.get('job-priorities', []):
+            return await self.call_server('data.post', filename, content, redirect, priority=priority)
+        return await self.call_server('data.post', filename, content, redirect)
+
+    async def get_compression(self):
+        """Agree a codec for large payloads with the current server, or False if it takes none."""
+
+        if self._compression is None:
+            capabilities = await self.get_capabilities()
+            self._compression = compression.choose_codec(capabilities.get('compression', [])) or False
+
+        return self._compression
+
+    async def get_report(self):
+        """Fetch the session's report, in the agreed format, as a compiled report dict."""
+
+        report_format = await self.get_report_format()
+        if report_format == 'json':
+            result = await self.call_server('report.get')
+        else:
+            result = await self.call_server('report.get', report_format=report_format)
+
+        return loads_report(result)
 
     async def call_server(self, endpoint, *args, **kwargs):
-        """Generate the correct endpoint for the known server."""
+        """Generate the correct endpoint for the known server.
+
+        Large arguments are compressed if the server can take them so,
+        and the server is told it may compress its result in turn.
+        """
+
+        codec = await self.get_compression()
+        if codec:
+            threshold = (await self.get_capabilities()).get(
+                'compression-threshold',
+                compression.DEFAULT_THRESHOLD
+            )
+            args = compression.pack(args, codec, threshold)
+            kwargs = compression.pack(kwargs, codec, threshold)
+            kwargs['accept_compression'] = compression.get_codecs()
 
         try:
-            return await self.call(
+            result = await self._component.call(
                 'com.ltldoorstep.{server}.{endpoint}'.format(
                     server=self._server, endpoint=endpoint),
                 self._session,
@@ -49,6 +136,56 @@ class WampClientComponent(ApplicationSession):
                           status_code=e.kwargs['code'], message=e.kwargs['message'])
             raise e
 
+        return compression.unpack(result)
+
+
+class WampClientComponent(ApplicationSession):
+    """Connector to join and execute a WAMP session."""
+
+    _current = None
+
+    def __init__(self, on_join, on_join_fut, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_join = on_join
+        self.on_join_fut = on_join_fut
+
+    async def onJoin(self, details):
+        logging.error("Joined")
+        result = await self.on_join(self)
+        self.on_join_fut.set_result(result)
+        return result
+
+    async def open_session(self):
+        """Engage a new session, independent of any others open on this connection."""
+
+        session = ServerSession(self)
+        await session.engage()
+        return session
+
+    async def engage(self, attempts=ENGAGE_ATTEMPTS):
+        """Engage a session, and make it the one this component's own calls go to."""
+
+        self._current = ServerSession(self)
+        return await self._current.engage(attempts)
+
+    async def get_capabilities(self):
+        return await self._current.get_capabilities()
+
+    async def get_report_format(self):
+        return await self._current.get_report_format()
+
+    async def post_data(self, filename, content, redirect, priority=None):
+        return await self._current.post_data(filename, content, redirect, priority=priority)
+
+    async def get_compression(self):
+        return await self._current.get_compression()
+
+    async def get_report(self):
+        return await self._current.get_report()
+
+    async def call_server(self, endpoint, *args, **kwargs):
+        return await self._current.call_server(endpoint, *args, **kwargs)
+
 
 async def launch_wamp_real(on_join, router_url):
     """
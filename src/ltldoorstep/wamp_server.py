@@ -3,7 +3,6 @@ from autobahn.wamp.types import PublishOptions
 import sys
 import traceback
 import time
-import requests
 import docker
 from urllib.parse import urlparse
 import asyncio
@@ -14,26 +13,172 @@ from collections import OrderedDict
 from contextlib import contextmanager
 import os
 import uuid
-import chardet
 from .ini import DoorstepIni
-from .errors import LintolDoorstepException
+from .reports.report import Report, ReportTooLong
+from .reports.budget import IssueBudget
+from .reports.binary import get_report_formats
+from . import compression
+from .scheduler import JobScheduler, DEFAULT_WORKERS, DEFAULT_MAX_QUEUED
+from .errors import LintolDoorstepException, LintolDoorstepBusyException
+from .file import DataFile, download_to_file
 
 RECONNECT_DELAY = 6
+DEFAULT_SESSION_TTL = 3600
+DEFAULT_ENGAGE_TIMEOUT = 30
+DEFAULT_MAX_ISSUES_PER_CODE = 1000
 
 class SessionSet(OrderedDict):
-    def __init__(self, engine):
+    """Live sessions, by name, least recently used first.
+
+    A session is released once its report has been retrieved, or once it
+    has been idle (with no call in progress) for `idle_ttl` seconds. While
+    `max_sessions` are live, `add_when_free` waits for one to be released.
+    """
+
+    def __init__(self, engine, max_sessions=None, idle_ttl=None):
         self._engine = engine
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._waiters = []
+        self._counts = {
+            'released': 0,
+            'expired': 0,
+            'rejected': 0
+        }
 
     def add(self):
+        self.expire()
+        if self.max_sessions and len(self) >= self.max_sessions:
+            self._counts['rejected'] += 1
+            raise LintolDoorstepBusyException(
+                RuntimeError(_("Server already has %d live sessions") % len(self)),
+                status_code=503
+            )
+
         session = self._engine.make_session()
 
         ssn = session.__enter__()
         ssn['__context__'] = session
+        ssn['__used__'] = time.monotonic()
+        ssn['__busy__'] = 0
 
         self[ssn['name']] = ssn
 
         return ssn
 
+    async def add_when_free(self, timeout=None):
+        """Add a session, first waiting up to timeout seconds for a free slot, if needs be."""
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout if timeout else None
+
+        while self.max_sessions and len(self) >= self.max_sessions:
+            self.expire()
+            remaining = deadline - loop.time() if deadline else None
+            if len(self) < self.max_sessions or (remaining is not None and remaining <= 0):
+                break
+
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                # Wake periodically, as idle sessions expire without telling us
+                wait = remaining
+                if self.idle_ttl:
+                    wait = self.idle_ttl if wait is None else min(wait, self.idle_ttl)
+                await asyncio.wait_for(waiter, wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+        return self.add()
+
+    @contextmanager
+    def use(self, name):
+        """Mark a session as in use for the duration of a call."""
+
+        if name not in self:
+            raise LintolDoorstepException(
+                KeyError(_("Session %s has finished or expired") % name),
+                status_code=404
+            )
+
+        session = self[name]
+        session['__busy__'] += 1
+        self.move_to_end(name)
+        try:
+            yield session
+        finally:
+            session['__busy__'] -= 1
+            session['__used__'] = time.monotonic()
+
+    def release(self, name, expired=False):
+        """Close a session, so what it holds can be freed once any running pipeline finishes."""
+
+        session = self.pop(name, None)
+        if session is None:
+            return
+
+        self._counts['expired' if expired else 'released'] += 1
+
+        # Unblock a pipeline still waiting for data, which treats 0 as the end
+        if 'queue' in session and session['queue'].empty():
+            session['queue'].put_nowait(0)
+        monitor_output = session.get('monitor_output')
+        if isinstance(monitor_output, asyncio.Future) and not monitor_output.done():
+            monitor_output.cancel()
+
+        session['__context__'].__exit__(None, None, None)
+
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def expire(self):
+        """Release every session that has been idle for longer than the TTL."""
+
+        if not self.idle_ttl:
+            return []
+
+        cutoff = time.monotonic() - self.idle_ttl
+        expired = [
+            name for name, session in self.items()
+            if not session['__busy__'] and session['__used__'] < cutoff
+        ]
+        for name in expired:
+            logging.warning(_("Session %s expired"), name)
+            self.release(name, expired=True)
+
+        return expired
+
+    def metrics(self):
+        """Counts of live sessions, and of what they hold, for status reporting."""
+
+        held_bytes = 0
+        held_issues = 0
+        for session in self.values():
+            for processor in session.get('processors', []):
+                if processor.get('content'):
+                    held_bytes += len(processor['content'])
+            result = session.get('result')
+            if isinstance(result, Report):
+                held_issues += result.issues.count()
+
+        metrics = {
+            'live': len(self),
+            'busy': sum(1 for session in self.values() if session['__busy__']),
+            'max-sessions': self.max_sessions,
+            'idle-ttl': self.idle_ttl,
+            'held-processor-bytes': held_bytes,
+            'held-issues': held_issues
+        }
+        metrics.update(self._counts)
+
+        return metrics
+
     def __enter__(self):
         return self
 
@@ -75,33 +220,21 @@ class DataResource():
         self._engine = engine
         self._config = config
 
-    async def post(self, filename, content, redirect, session=None):
+    async def post(self, filename, content, redirect, session=None, priority=None):
         logging.warn(_("Data posted"))
+
+        # Turn the job away now, rather than once the client is waiting on its report
+        if self._engine.scheduler:
+            self._engine.scheduler.check_capacity()
+        session['priority'] = priority
+
         if redirect and self._engine.download():
             if content.startswith('file://'):
-                with open(content[len('file://'):], 'r') as file_obj:
-                    content = file_obj.read()
+                content = DataFile(content[len('file://'):])
             else:
-                r = requests.get(content, stream=True)
                 logging.warn(_("Downloading %s") % content)
-
-                if r.status_code != 200:
-                    raise RuntimeError(_("Could not retrieve data from redirected URL: %d") % r.status_code)
-
-                content = b''
-                for chunk in r.iter_content(chunk_size=1024):
-                    content += chunk
-
-                if r.encoding:
-                    encoding = r.encoding
-                else:
-                    encoding = chardet.detect(content)['encoding']
-
-                try:
-                    content = content.decode(encoding).encode('utf-8')
-                except: # Get correct encoding error
-                    logging.warn(_("Could not recode content from {} to UTF-8").format(encoding))
-                    pass
+                loop = asyncio.get_event_loop()
+                content = await loop.run_in_executor(None, download_to_file, content)
 
         return self._engine.add_data(filename, content, redirect, session)
 
@@ -110,16 +243,45 @@ class ReportResource():
         self._engine = engine
         self._config = config
 
-    async def get(self, session):
+    async def get(self, session, report_format='json'):
+        """Return the session's report, as JSON or, if the client asked for it, binary-encoded."""
+
         results = await self._engine.get_output(session)
+        max_chars = self._config['report']['max-length-chars']
+
+        if report_format not in get_report_formats():
+            report_format = 'json'
+
+        if isinstance(results, Report):
+            return self._dump_within_limit(results, max_chars, report_format)
+
         results = results.__serialize__()
         result_string = json.dumps(results)
 
-        if len(result_string) > self._config['report']['max-length-chars']:
+        if len(result_string) > max_chars:
             raise RuntimeError(_("Report is too long: %d characters") % len(result_string))
 
         return result_string
 
+    def _dump_within_limit(self, report, max_chars, report_format='json'):
+        """Serialize a report, cutting down issues per code until it fits, if it must."""
+
+        report_config = self._config['report']
+        max_per_code = report_config.get('max-issues-per-code', DEFAULT_MAX_ISSUES_PER_CODE)
+        sample_size = report_config.get('issue-sample-size', 0)
+        bounded = report
+
+        while True:
+            try:
+                return bounded.dumps(report_format, max_chars=max_chars)
+            except ReportTooLong:
+                if max_per_code is None:
+                    raise
+
+            logging.warning(_("Report is too long, keeping up to %d issues per code"), max_per_code)
+            bounded = report.with_budget(IssueBudget(max_per_code, sample_size if max_per_code else 0))
+            max_per_code = max_per_code // 2 if max_per_code else None
+
 class DoorstepComponent(ApplicationSession):
     def __init__(self, engine, sessions, config, debug, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -129,6 +291,11 @@ class DoorstepComponent(ApplicationSession):
         self._sessions = sessions
         self._config = config
         self._debug = debug
+        self._expiry = None
+        self._compression_threshold = config.get('wamp', {}).get(
+            'compression-threshold',
+            compression.DEFAULT_THRESHOLD
+        )
 
         self._resource_processor = ProcessorResource(self._engine, self._config)
         self._resource_data = DataResource(self._engine, self._config)
@@ -137,20 +304,42 @@ class DoorstepComponent(ApplicationSession):
     def get_session(self, name):
         return self._sessions[name]
 
-    def make_session(self):
-        return self._sessions.add()
+    async def make_session(self):
+        timeout = self._config.get('wamp', {}).get('engage-timeout', DEFAULT_ENGAGE_TIMEOUT)
+        return await self._sessions.add_when_free(timeout)
+
+    async def wrap_register(self, endpoint, callback, release=False):
+        """Register a session endpoint, releasing the session after the call if `release` is set."""
 
-    async def wrap_register(self, endpoint, callback):
         uri = 'com.ltldoorstep.{server}.{endpoint}'.format(server=self._id, endpoint=endpoint)
 
-        async def _routine(session, *args, **kwargs):
+        async def _routine(session, *args, accept_compression=None, **kwargs):
+            args = compression.unpack(list(args))
+            kwargs = compression.unpack(kwargs)
+
             try:
-                result = await callback(*args, session=self.get_session(session), **kwargs)
+                with self._sessions.use(session) as ssn:
+                    result = await callback(*args, session=ssn, **kwargs)
+            except LintolDoorstepBusyException:
+                # A turned-away job should not hold its slot until the session expires
+                self._sessions.release(session)
+                raise
             except LintolDoorstepException as e:
                 if self._debug:
                     exc_type, exc_value, exc_traceback = sys.exc_info()
                     traceback.print_tb(exc_traceback)
                 raise e
+            finally:
+                if release:
+                    self._sessions.release(session)
+
+            # Only compress for clients that said they could take it
+            if accept_compression:
+                result = compression.pack(
+                    result,
+                    compression.choose_codec(accept_compression),
+                    self._compression_threshold
+                )
 
             return result
 
@@ -159,7 +348,11 @@ class DoorstepComponent(ApplicationSession):
     async def onJoin(self, details):
         print("Joining")
         async def get_session_pair():
-            session = self.make_session()
+            # Refusing here lets the round-robin pass the client to another server
+            if self._engine.scheduler:
+                self._engine.scheduler.check_capacity()
+
+            session = await self.make_session()
             print(_("Engaging for session %s") % session['name'])
 
             # Kick off observer coro
@@ -170,6 +363,9 @@ class DoorstepComponent(ApplicationSession):
                 session['monitor_output'] = asyncio.sleep(1.0)
                 return (self._id, session['name'])
             def output_results(output):
+                if output.cancelled():
+                    return
+
                 logging.warn('outputting')
                 return self.publish(
                     'com.ltldoorstep.event_result',
@@ -191,22 +387,56 @@ class DoorstepComponent(ApplicationSession):
         )
         await self.wrap_register('processor.post', self._resource_processor.post)
         await self.wrap_register('data.post', self._resource_data.post)
-        await self.wrap_register('report.get', self._resource_report.get)
+        await self.wrap_register('report.get', self._resource_report.get, release=True)
+
+        def capabilities():
+            capabilities = {
+                'report-formats': get_report_formats(),
+                'compression': compression.get_codecs(),
+                'compression-threshold': self._compression_threshold
+            }
+            if self._engine.scheduler:
+                capabilities['job-priorities'] = self._engine.scheduler.get_priorities()
+            return capabilities
+
+        await self.register(
+            capabilities,
+            'com.ltldoorstep.{server}.capabilities'.format(server=self._id)
+        )
 
         async def status_retrieve():
-            results = await self._engine.check_processor_statuses()
+            try:
+                results = await self._engine.check_processor_statuses()
+            except NotImplementedError:
+                results = None
+
+            self._sessions.expire()
+
+            metrics = {'sessions': self._sessions.metrics()}
+            if self._engine.scheduler:
+                metrics['jobs'] = self._engine.scheduler.metrics()
 
             return self.publish(
                 'com.ltldoorstep.status',
                 self._id,
                 results,
-                options=PublishOptions(acknowledge=True)
+                options=PublishOptions(acknowledge=True),
+                **metrics
             )
 
         self.subscribe(status_retrieve, 'com.ltldoorstep.status-retrieve')
 
+        async def expire_sessions():
+            while self._sessions.idle_ttl:
+                await asyncio.sleep(self._sessions.idle_ttl / 2)
+                self._sessions.expire()
+
+        self._expiry = asyncio.ensure_future(expire_sessions())
+
     def onDisconnect(self):
         logging.error(_("Disconnected from WAMP router"))
+        if self._expiry:
+            self._expiry.cancel()
         asyncio.get_event_loop().stop()
 
 
@@ -214,7 +444,18 @@ def launch_wamp_real(engine, router='localhost:8080', config={}, debug=False):
     if not router.startswith('ws'):
         router = 'ws://%s/ws' % router
 
-    with SessionSet(engine) as sessions:
+    wamp_config = config.get('wamp', {})
+    sessions = SessionSet(
+        engine,
+        max_sessions=wamp_config.get('max-sessions'),
+        idle_ttl=wamp_config.get('session-ttl', DEFAULT_SESSION_TTL)
+    )
+    engine.scheduler = JobScheduler(
+        workers=wamp_config.get('workers', DEFAULT_WORKERS),
+        max_queued=wamp_config.get('max-queued-jobs', DEFAULT_MAX_QUEUED)
+    )
+
+    with sessions:
         exit = False
         while not exit:
             loop = asyncio.get_event_loop()
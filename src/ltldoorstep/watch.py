@@ -1,16 +1,59 @@
 import requests
 import logging
 import asyncio
+import functools
+import random
 import json
 import ltldoorstep.printer as printer
-import time
 from ltldoorstep.file import make_file_manager
 from ltldoorstep.ini import DoorstepIni
 from ltldoorstep.crawler import announce_resource
+from ltldoorstep.rate_limit import HostRateLimiter
+from ltldoorstep.seen_store import SeenStore, resource_hash, DEFAULT_TTL
 
 # time delay could be user defined
 TIME_DELAY = 5
 RETRIES = 10
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 60
+DEFAULT_REQUEST_RATE = 10
+DEFAULT_CONCURRENCY = 4
+
+# Requests budget for each data store (by host), shared by every gatherer and monitor
+store_limiter = HostRateLimiter(DEFAULT_REQUEST_RATE, burst=DEFAULT_CONCURRENCY)
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Exponential backoff with full jitter, so retrying clients spread out."""
+
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+async def poll_wait(time_delay):
+    """Wait between polls without holding up the event loop, jittered by up to a tenth."""
+
+    logging.info("Waiting - %d", time_delay)
+    await asyncio.sleep(time_delay * random.uniform(0.9, 1.1))
+
+async def call_store(client, fn, *args, description='', retries=RETRIES, **kwargs):
+    """Call a (blocking) data store method within the store's request budget.
+
+    The call runs in the default executor, so WAMP keepalives and
+    announcements carry on meanwhile, and is retried with backoff on the
+    store's own exceptions.
+    """
+
+    loop = asyncio.get_event_loop()
+    for attempt in range(retries):
+        await store_limiter.acquire(client.get_identifier())
+        try:
+            return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+        except client.exception as exp:
+            logging.error(exp)
+            if attempt == retries - 1:
+                raise exp
+
+            # catches connection errors only
+            logging.error('Error retrieving from client API [%s], trying again...', description)
+            await asyncio.sleep(backoff_delay(attempt))
 
 async def search_gather(client, watch_changed_packages, settings, time_delay, skip, cmpt_wrap):
     cursor = skip
@@ -21,42 +64,28 @@ async def search_gather(client, watch_changed_packages, settings, time_delay, sk
         async def iteration(cmpt, cursor, complete):
             settings['start'] = cursor
 
-            retry = 1
-            while retry:
-                try:
-                    packages = client.package_search(**settings)
-                    # package search start = 25
-                    # gives an argument to that search
-                    # args don't hvae to be hard coded
-                    # loops through each page and starts the search again with 'cursor' moved
-                    # brings in a limited number of results & cursor increases based on the results returned
-                    retry = False
-                except client.exception as exp:
-                    logging.error(exp)
-                    if retry > RETRIES:
-                        raise exp
-
-                    # catches connection errors only
-                    logging.error('Error retrieving from client API [revision-list], trying again...')
-                    time.sleep(1)
-                    retry += 1
-                else:
-                    cursor += len(packages['results'])
-                    complete = cursor >= packages['count']
-
-            list_checked_packages = []
+            # package search start = 25
+            # gives an argument to that search
+            # args don't hvae to be hard coded
+            # loops through each page and starts the search again with 'cursor' moved
+            # brings in a limited number of results & cursor increases based on the results returned
+            packages = await call_store(client, client.package_search, description='package-search', **settings)
+            cursor += len(packages['results'])
+            complete = cursor >= packages['count']
 
             recent_revisions = []
             results = packages['results']
             for package in results:
-                recent_revisions.append({'revision_id': package['id'], 'data': {'package': package}})
+                # The last modification time stands in for a revision, so a changed package is seen afresh
+                revision_id = package.get('revision_id') or package.get('metadata_modified')
+                # package_search gives full packages, so they need not be shown again
+                recent_revisions.append({'revision_id': revision_id, 'data': {'package': package}, 'package_info': package})
 
             logging.info(f"Total packages: {len(recent_revisions)}")
 
             # calls another async fucntion using the vars set above
             await watch_changed_packages(
                 recent_revisions, # list of dicts returned from client
-                list_checked_packages, # list that is added to as program runs
                 client.package_show, # data sent to get_resources
                 cmpt
             )
@@ -66,28 +95,19 @@ async def search_gather(client, watch_changed_packages, settings, time_delay, sk
         cursor, complete = await cmpt_wrap(iteration, cursor, complete)
 
         if not complete:
-            logging.info("Waiting - %d", time_delay)
-            time.sleep(time_delay)
+            await poll_wait(time_delay)
 
 async def crawl_gather(client, watch_changed_packages, time_delay, skip, cmpt_wrap):
-    try:
-        packages = client.package_list()
-    except client.exception as exp:
-        logging.info(exp)
-        # catches connection errors only
-        logging.info('Error retrieving from client API [revision-list], trying again...')
-        time.sleep(1)
-
-    list_checked_packages = []
+    packages = await call_store(client, client.package_list, description='package-list')
 
-    recent_revisions = [{'revision_id': package, 'data': {'package': {'id': package}}} for package in packages['results']]
+    # The package list carries no revisions, so these are only known once each package is shown
+    recent_revisions = [{'revision_id': None, 'data': {'package': {'id': package}}} for package in packages['results']]
     logging.info(f"Total packages: {len(recent_revisions)}")
 
     async def iteration(cmpt):
         # calls another async fucntion using the vars set above
         await watch_changed_packages(
             recent_revisions, # list of dicts returned from client
-            list_checked_packages, # list that is added to as program runs
             client.package_show, # data sent to get_resources
             cmpt
         )
@@ -95,17 +115,25 @@ async def crawl_gather(client, watch_changed_packages, time_delay, skip, cmpt_wr
 
 async def watch_gather(client, watch_changed_packages, time_delay, skip, cmpt_wrap):
     # runs code from old commit that uses the client to get the list of changed packages
-    list_checked_packages = []
+    failures = 0
 
     while True:
         async def iteration(cmpt):
+            nonlocal failures
+
             recently_changed = []
             try:
-                recently_changed = client.recently_changed_packages_activity_list()
+                recently_changed = await call_store(
+                    client,
+                    client.recently_changed_packages_activity_list,
+                    description='recently-changed-packages-activity-list',
+                    retries=1
+                )
+                failures = 0
             except client.exception:
-                # catches connection errors only
+                # catches connection errors only, and tries again next poll
                 logging.warning('Error retrieving from client API [recently-changed-packages-activity-list], trying again...')
-                time.sleep(1)
+                failures += 1
 
             desirable = []
             for recent in recently_changed:
@@ -117,20 +145,73 @@ async def watch_gather(client, watch_changed_packages, time_delay, skip, cmpt_wr
             # calls another async fucntion using the vars set above
             await watch_changed_packages(
                 desirable, # list of dicts returned from client
-                list_checked_packages, # list that is added to as program runs
                 client.package_show, # data sent to get_resources
                 cmpt
             )
 
         await cmpt_wrap(iteration)
-        logging.info("Waiting - %d", time_delay)
-        time.sleep(time_delay)
+
+        # Back off further from a store that keeps failing
+        if failures:
+            await asyncio.sleep(backoff_delay(failures))
+        await poll_wait(time_delay)
+
+async def sync_gather(client, watch_changed_packages, time_delay, skip, cmpt_wrap):
+    """Follow packages as they change, from the data store's metadata_modified cursor.
+
+    Only packages modified since the cursor are requested, oldest first,
+    and the cursor is moved on after each page, so nothing already dealt
+    with is fetched again, even after a restart if the store persists it.
+    """
+    start = skip
+
+    while True:
+        async def iteration(cmpt, start):
+            since = client.cursor
+            logging.info("Gathering changes since %s", since)
+
+            page = await call_store(
+                client,
+                client.packages_changed_since,
+                description='package-search',
+                since=since,
+                start=start
+            )
+            results = page['results']
+
+            recent_revisions = [
+                {'revision_id': package['metadata_modified'], 'data': {'package': package}, 'package_info': package}
+                for package in results
+            ]
+
+            await watch_changed_packages(
+                recent_revisions, # list of dicts returned from client
+                client.package_show, # only used for packages that lack their metadata
+                cmpt
+            )
+
+            more = page['count'] > start + len(results)
+            if results:
+                latest = max(package['metadata_modified'] for package in results)
+                if latest != since:
+                    client.set_cursor(latest)
+                    start = 0
+                else:
+                    # A page of packages all modified at the same moment
+                    start += len(results)
+
+            return start, more
+
+        start, more = await cmpt_wrap(iteration, start)
+
+        if not more:
+            await poll_wait(time_delay)
 
 class Monitor:
     """ Monitor class acts as the interface for WAMP
     handles functionality that checks for new packages & retrives resources from the client
     """
-    def __init__(self, cmpt, client, printer, gather_fn, announce_fn, update=False, time_delay=None, skip=0):
+    def __init__(self, cmpt, client, printer, gather_fn, announce_fn, update=False, time_delay=None, skip=0, concurrency=DEFAULT_CONCURRENCY, seen=None, fingerprints=None):
         self.cmpt = cmpt # create the component
         self.client = client # creates the client from data_store. could be either dummy or ckan obj
         self.printer = printer
@@ -138,6 +219,11 @@ class Monitor:
         self.announce_fn = announce_fn
         self.update = update
         self.skip = skip
+        self.concurrency = concurrency
+        # packages and resources already announced, so they are not duplicated
+        self.seen = seen if seen is not None else SeenStore()
+        # if given, resources whose data is unchanged are not announced again
+        self.fingerprints = fingerprints
         if time_delay is None:
             self.time_delay = TIME_DELAY
         else:
@@ -147,50 +233,74 @@ class Monitor:
         await self.gather_fn(self.client, self.watch_changed_packages, self.time_delay, self.skip, self.cmpt)
         logging.info("Completed gathering")
 
-    async def watch_changed_packages(self, recently_changed, list_checked_packages, package_show, cmpt):
+    def package_key(self, package_id, revision_id):
+        return SeenStore.make_key(self.client.get_identifier(), package_id, revision_id)
+
+    async def watch_changed_packages(self, recently_changed, package_show, cmpt):
         """
         Will run as long as the watch option is used in ltlwampclient.py
         Note 'dataset' & 'package' are interchangable terms
         """
-        # iterates through recently changed packages obtained from ckanapi
-        for changed in recently_changed:
-            changed_package_revision_id = changed['revision_id']
-            # checks if the id is in the list
-            if changed_package_revision_id not in list_checked_packages:
-                # var set to false so the while loop runs until package_show() works
+        self.seen.prune()
+
+        # Package metadata is fetched a few at a time, but announced in order
+        pending = [
+            changed for changed in recently_changed
+            if changed.get('revision_id') is None or
+            self.package_key(changed['data']['package']['id'], changed['revision_id']) not in self.seen
+        ]
+        fetch_pool = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(changed):
+            if changed.get('package_info'):
+                return changed['package_info']
+
+            async with fetch_pool:
+                try:
+                    return await call_store(
+                        self.client,
+                        package_show,
+                        description='package-show',
+                        id=changed['data']['package']['id']
+                    )
+                except self.client.exception:
+                    return None
+
+        fetches = [asyncio.ensure_future(fetch(changed)) for changed in pending]
+        try:
+            for changed, fetched in zip(pending, fetches):
+                package_info = await fetched
+
                 # to prevent any issues with retrieving a dataset & the code overlooking it during the next cycle
-                retrieved = False
-
-                retry = 1
-                while not retrieved and retry < RETRIES:
-                    try:
-                        package_info = package_show(id=changed['data']['package']['id'])
-                        retrieved = True
-                    except self.client.exception as exp:
-                        logging.error(exp)
-                        # catches connection errors only
-                        logging.error('Error retrieving from client API [package-show], trying again...')
-                        time.sleep(0.7)
-                        retry += 1
-
-                    time.sleep(0.3)
-                if not retrieved:
-                    logging.error("Package - %s: NOT RETRIEVED (%s)", package_info['name'], changed['data']['package']['id'])
+                # it is left unchecked, so it is tried again
+                if package_info is None:
+                    logging.error("Package - %s: NOT RETRIEVED", changed['data']['package']['id'])
                     continue
 
-                logging.info("Package - %s", package_info['name'])
+                logging.info("Package - %s", package_info.get('name'))
+
+                package_id = changed['data']['package']['id']
+                revision_id = changed.get('revision_id') or package_info.get('revision_id') or package_info.get('metadata_modified', '')
 
                 ini = DoorstepIni(context_package=package_info) # classes = studley case
                 # calls async function from Monitor class to get the dataset's resource using the package info
-                await self.get_resource(ini, requests.get, cmpt)
+                await self.get_resource(ini, requests.get, cmpt, package_key=self.package_key(package_id, revision_id))
 
                 # when the code runs succesfully and the resource is retreived,
-                # it adds it to the list so it's not duplicated
-                list_checked_packages.append(changed_package_revision_id)  # list of names
+                # it is recorded so it's not duplicated, even after a restart
+                self.seen.add(self.package_key(package_id, revision_id))
+        finally:
+            for fetched in fetches:
+                fetched.cancel()
+
+        if self.fingerprints:
+            self.fingerprints.log_counts()
 
-    async def get_resource(self, ini, rg_func, cmpt):
+    async def get_resource(self, ini, rg_func, cmpt, package_key=None):
         """
         Get the URL from the dataset resources & create a local file with the results
+
+        With a package key, resources already announced for that revision are skipped.
         """
         # uses the Monitor class, ini obj & request.get function
 
@@ -199,15 +309,62 @@ class Monitor:
         for resource in ini.package['resources']:
             # loops through resources in the package
             source = self.client.get_identifier()
+
+            if package_key:
+                resource_key = package_key[:3] + (resource_hash(resource),)
+                if resource_key in self.seen:
+                    logging.info(f'Already announced resource: {resource["url"]} from {source}')
+                    continue
+
+            fingerprint = None
+            if self.fingerprints and not self.update:
+                changed, fingerprint = await self.resource_changed(resource, rg_func)
+                if not changed:
+                    logging.info(f'Unchanged resource: {resource["url"]} from {source}')
+                    if package_key:
+                        self.seen.add(resource_key)
+                    continue
+
             # finds where the resource is coming from, ie ckan or dummy
             logging.info(f'Announcing resource: {resource["url"]} from {source}')
             # calls async function that doesn't create a report, but gets the data???
             await self.announce_fn(cmpt, resource, ini, source, self.update)
 
+            if fingerprint:
+                self.fingerprints.commit(resource['url'], fingerprint)
+            if package_key:
+                self.seen.add(resource_key)
+
+    async def resource_changed(self, resource, rg_func):
+        """Check the resource's data against its fingerprint, with a conditional request if needs be.
 
-async def monitor_for_changes(cmpt, client, printer, gather_fn, update=False, time_delay=None, skip=0):
+        Returns whether it has changed, and any new fingerprint to commit once it is announced.
+        """
+
+        loop = asyncio.get_event_loop()
+        await store_limiter.acquire(resource['url'])
+        try:
+            response, fingerprint = await loop.run_in_executor(
+                None,
+                functools.partial(self.fingerprints.fetch, resource['url'], resource, get=rg_func, keep_body=False)
+            )
+        except requests.exceptions.RequestException as exp:
+            # Whoever picks up the announcement can report on it
+            logging.warning(exp)
+            return True, None
+
+        return response is not None, fingerprint
+
+
+async def monitor_for_changes(cmpt, client, printer, gather_fn, update=False, time_delay=None, skip=0,
+                              concurrency=DEFAULT_CONCURRENCY, request_rate=None, seen_path=None, seen_ttl=DEFAULT_TTL,
+                              fingerprints=None):
     """
     creates Monitor object
     """
-    monitor = Monitor(cmpt, client, printer, gather_fn, announce_resource, update=update, time_delay=time_delay, skip=skip)
-    await monitor.run()
+    if request_rate is not None:
+        store_limiter.rate = request_rate
+
+    with SeenStore(seen_path, ttl=seen_ttl) as seen:
+        monitor = Monitor(cmpt, client, printer, gather_fn, announce_resource, update=update, time_delay=time_delay, skip=skip, concurrency=concurrency, seen=seen, fingerprints=fingerprints)
+        await monitor.run()
@@ -4,7 +4,10 @@ from unittest.mock import Mock, patch, mock_open
 import pytest
 import asyncio
 from ltldoorstep.engines.dask_threaded import DaskThreadedEngine
+from ltldoorstep.engines import dask_common, dask_threaded
 from ltldoorstep.processor import DoorstepProcessor
+from ltldoorstep.metadata import DoorstepContext
+from ltldoorstep.file import DataFile
 
 import logging
 
@@ -48,3 +51,119 @@ def test_can_run_workflow(engine):
         result = loop.run_until_complete(engine.run(filename, module, metadata))
 
     assert result['tables'][0]['errors'][0]['message'] == filename.upper()
+
+PARALLEL_TEST_MODULE = '''
+import os
+import time
+import logging
+from ltldoorstep.processor import DoorstepProcessor
+from ltldoorstep.metadata import DoorstepContext
+from ltldoorstep.file import DataFile
+
+class TestProcessor(DoorstepProcessor):
+    preset = 'tabular'
+    code = 'testing-processor-{index}'
+
+    def ret(self, r, filename, metadata):
+        time.sleep({delay})
+        r.add_issue(logging.ERROR, 'foo-bar-{index}', os.path.basename(filename))
+        return r
+
+    def get_workflow(self, filename, metadata):
+        return {{'output': (self.ret, self._report, filename, metadata)}}
+
+processor = TestProcessor.make
+'''
+
+def test_parallel_processors_match_serial():
+    """Check running a session's processors at once gives the same report as running them in turn."""
+
+    processors = [
+        {
+            'name': 'processor-%d' % index,
+            'filename': 'processor_%d.py' % index,
+            'content': PARALLEL_TEST_MODULE.format(index=index, delay=0.05 * (4 - index)).encode('utf-8'),
+            'metadata': DoorstepContext()
+        }
+        for index in range(4)
+    ]
+
+    serial_engine = DaskThreadedEngine()
+    parallel_engine = DaskThreadedEngine(config={'engine': {'processor-workers': '4'}})
+
+    loop = asyncio.get_event_loop()
+    serial = loop.run_until_complete(serial_engine.run_with_content('data.csv', b'a,b\n1,2\n', processors))
+    parallel = loop.run_until_complete(parallel_engine.run_with_content('data.csv', b'a,b\n1,2\n', processors))
+
+    assert [issue['code'] for issue in parallel.compile()['tables'][0]['errors']] == [
+        'foo-bar-%d' % index for index in range(4)
+    ]
+    assert parallel.compile() == serial.compile()
+
+@pytest.mark.parametrize('scheduler', ['synchronous', 'threaded'])
+def test_can_choose_scheduler(scheduler):
+    """Check workflows still run when the scheduler is set through engine options."""
+
+    engine = DaskThreadedEngine(config={'engine': {'scheduler': scheduler, 'scheduler-workers': '4'}})
+    processors = [{
+        'name': 'processor',
+        'filename': 'processor.py',
+        'content': PARALLEL_TEST_MODULE.format(index=0, delay=0),
+        'metadata': DoorstepContext()
+    }]
+
+    loop = asyncio.get_event_loop()
+    try:
+        report = loop.run_until_complete(engine.run_with_content('data.csv', b'a,b\n', processors))
+    finally:
+        dask_common.configure(scheduler='threaded', num_workers=2)
+
+    assert report.compile()['tables'][0]['errors'][0]['code'] == 'foo-bar-0'
+
+def test_data_encoding_reaches_report(tmpdir):
+    """Check an encoding detected on download is passed to processors and the report."""
+
+    data = tmpdir.join('data.csv')
+    data.write_binary('a,b\n\xe9,1\n'.encode('latin-1'))
+
+    engine = DaskThreadedEngine()
+    processors = [{
+        'name': 'processor',
+        'filename': 'processor.py',
+        'content': PARALLEL_TEST_MODULE.format(index=0, delay=0),
+        'metadata': DoorstepContext()
+    }]
+
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(engine.run_with_content(
+        'data.csv',
+        DataFile(str(data), encoding='iso-8859-1'),
+        processors
+    ))
+
+    assert report.compile()['tables'][0]['encoding'] == 'iso-8859-1'
+    assert processors[0]['metadata'].to_dict()['context']['encoding'] == 'iso-8859-1'
+
+def test_processor_modules_are_cached():
+    """Check a processor seen before is not loaded again, and least-recently-used ones are evicted."""
+
+    engine = DaskThreadedEngine(config={'engine': {'module-cache-size': '1', 'processor-workers': '4'}})
+
+    def make_processors(index, count):
+        return [{
+            'name': 'processor-%d' % n,
+            'filename': 'processor.py',
+            'content': PARALLEL_TEST_MODULE.format(index=index, delay=0.01),
+            'metadata': DoorstepContext()
+        } for n in range(count)]
+
+    loader = Mock(wraps=dask_threaded.load_processor_module)
+    loop = asyncio.get_event_loop()
+    try:
+        with patch('ltldoorstep.engines.dask_threaded.load_processor_module', loader):
+            for index in (10, 10, 11, 10):
+                loop.run_until_complete(engine.run_with_content('data.csv', b'a,b\n', make_processors(index, 3)))
+    finally:
+        dask_threaded.module_cache.resize(dask_threaded.MODULE_CACHE_SIZE)
+
+    assert loader.call_count == 3
@@ -1,16 +1,18 @@
 """Check dask threaded engine is correctly functioning."""
 
+import os
 import json
 import logging
 from unittest.mock import Mock, patch, mock_open
 import pytest
 import asyncio
 from ltldoorstep.engines.docker import DockerEngine
+from ltldoorstep.engines.docker_pool import DockerWarmPool, WarmContainer
+from ltldoorstep.errors import LintolDoorstepContainerException
+from ltldoorstep.file import DataFile
 from ltldoorstep.processor import DoorstepProcessor
 from ltldoorstep.reports.tabular import TabularReport
 
-import logging
-
 @pytest.fixture
 def engine():
     """Create a threaded dask engine."""
@@ -76,3 +78,256 @@ def test_can_run_workflow(engine):
         result = loop.run_until_complete(engine.run(filename, module, metadata))
 
     assert result['tables'][0]['errors'][0]['processor'] == 'testing-processor'
+
+
+def make_pool_client(exit_code=0):
+    """Mock docker client whose containers write a report when their command is exec'd."""
+
+    client = Mock()
+    client.images.get.return_value.attrs = {'Config': {'Entrypoint': ['/doorstep/run.sh'], 'Cmd': None}}
+
+    def run(image, mounts, **kwargs):
+        workspace = mounts[0]['Source']
+        container = Mock()
+        container.status = 'running'
+
+        def exec_run(command, environment, user):
+            output_file = environment['LINTOL_OUTPUT_FILE'].replace('/pfs', workspace, 1)
+            with open(output_file, 'w') as output_f:
+                output_f.write('{}')
+            return exit_code, b'output'
+
+        container.exec_run.side_effect = exec_run
+        return container
+
+    client.containers.run.side_effect = run
+    return client
+
+
+def make_job(root, name):
+    os.makedirs(os.path.join(root, 'data'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'out', 'raw'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'processors', name))
+    with open(os.path.join(root, 'data', 'data.csv'), 'w') as data_f:
+        data_f.write('a,b\n')
+    with open(os.path.join(root, 'processors', name, 'processor.py'), 'w') as processor_f:
+        processor_f.write('')
+
+    return {
+        'LINTOL_OUTPUT_FILE': '/pfs/out/raw/%s.json' % name
+    }
+
+
+def test_warm_pool_reuses_and_recycles_containers(tmpdir):
+    """Check warm containers are reused for jobs, and replaced after their job limit."""
+
+    client = make_pool_client()
+    pool = DockerWarmPool(client, size=1, max_jobs=2)
+    root = str(tmpdir)
+
+    async def run_jobs():
+        for n in range(3):
+            envs = make_job(root, 'processor-%d' % n)
+            await pool.execute('lintol/doorstep:latest', envs, root, 'processor-%d' % n, 'data.csv')
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(run_jobs())
+    finally:
+        pool.close()
+
+    assert client.containers.run.call_count == 2
+    assert client.containers.run.call_args[1]['network_mode'] == 'none'
+    assert client.containers.run.call_args[1]['cap_drop'] == ['ALL']
+    assert all(os.path.exists(os.path.join(root, 'out', 'raw', 'processor-%d.json' % n)) for n in range(3))
+
+
+def test_warm_pool_reports_failed_jobs(tmpdir):
+    """Check a failing job raises a container exception, and the container is kept."""
+
+    client = make_pool_client(exit_code=1)
+    pool = DockerWarmPool(client, size=1)
+    root = str(tmpdir)
+    envs = make_job(root, 'processor')
+
+    loop = asyncio.get_event_loop()
+    try:
+        with pytest.raises(LintolDoorstepContainerException):
+            loop.run_until_complete(pool.execute('lintol/doorstep:latest', envs, root, 'processor', 'data.csv'))
+    finally:
+        pool.close()
+
+    assert client.containers.run.call_count == 1
+
+
+def test_warm_pool_mounts_data_read_only(tmpdir):
+    """Check warm containers see the job data through a read-only mount, kept across jobs."""
+
+    client = make_pool_client()
+    pool = DockerWarmPool(client, size=1)
+    root = str(tmpdir)
+
+    async def run_jobs():
+        for n in range(2):
+            envs = make_job(root, 'processor-%d' % n)
+            await pool.execute('lintol/doorstep:latest', envs, root, 'processor-%d' % n, 'data.csv')
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(run_jobs())
+
+        mounts = {mount['Target']: mount for mount in client.containers.run.call_args[1]['mounts']}
+        assert mounts['/pfs/data']['ReadOnly']
+        assert mounts['/pfs/data']['Source'] == os.path.join(mounts['/pfs']['Source'], 'data')
+        assert os.path.isdir(mounts['/pfs/data']['Source'])
+    finally:
+        pool.close()
+
+    assert client.containers.run.call_count == 1
+
+
+def test_warm_pool_separates_processor_sources(tmpdir):
+    """Check warm containers are only reused for the same processor code, whatever its metadata."""
+
+    client = make_pool_client()
+    pool = DockerWarmPool(client, size=1)
+    root = str(tmpdir)
+
+    async def run_jobs():
+        for n, source in enumerate(('first = 1', 'second = 2', 'first = 1', 'first = 1')):
+            processor_root = os.path.join(root, 'processors', 'processor-%d' % n)
+            envs = make_job(root, 'processor-%d' % n)
+            with open(os.path.join(processor_root, 'processor.py'), 'w') as processor_f:
+                processor_f.write(source)
+            with open(os.path.join(processor_root, 'metadata.json'), 'w') as metadata_f:
+                json.dump({'job': n}, metadata_f)
+            await pool.execute('lintol/doorstep:latest', envs, root, 'processor-%d' % n, 'data.csv', 'processor.py')
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(run_jobs())
+    finally:
+        pool.close()
+
+    assert client.containers.run.call_count == 2
+
+
+def test_warm_pool_caps_and_expires_containers(tmpdir, monkeypatch):
+    """Check the longest idle container makes way once the pool is full, and idle ones expire."""
+
+    client = make_pool_client()
+    pool = DockerWarmPool(client, size=1, max_containers=2, idle_timeout=60)
+    root = str(tmpdir)
+    removed = []
+    monkeypatch.setattr(WarmContainer, 'remove', lambda warm: removed.append(warm))
+
+    async def run_jobs():
+        for n in range(3):
+            envs = make_job(root, 'processor-%d' % n)
+            await pool.execute('lintol/doorstep-%d:latest' % n, envs, root, 'processor-%d' % n, 'data.csv')
+
+        first, second = [warm for containers in pool._idle.values() for warm in containers]
+        first.idle_since -= 120
+        await pool._expire_idle()
+
+        return first, second
+
+    loop = asyncio.get_event_loop()
+    try:
+        first, second = loop.run_until_complete(run_jobs())
+
+        assert client.containers.run.call_count == 3
+        assert pool.live() == 1
+        assert len(removed) == 2
+        assert removed[1] is first
+        assert removed[0] not in (first, second)
+    finally:
+        pool.close()
+
+
+def test_processor_containers_run_concurrently(tmpdir):
+    """Check a session's containers run at once, up to the limit, and all exit before a failure is raised."""
+
+    engine = DockerEngine({'engine': {'concurrency': '2'}})
+    engine.client = Mock()
+    engine.client.containers.run.side_effect = lambda image, **kwargs: Mock(name=image)
+
+    running = []
+    peak = []
+    deleted = []
+
+    def make_container(name):
+        container = Mock()
+
+        async def wait():
+            running.append(name)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(name)
+            return {'StatusCode': 1 if name.endswith('bad') else 0}
+
+        async def log(stderr):
+            return ['failed\n']
+
+        async def delete(force):
+            deleted.append(name)
+
+        container.wait = wait
+        container.log = log
+        container.delete = delete
+        return container
+
+    adkr = Mock()
+
+    async def get(name):
+        return make_container(name)
+
+    async def close():
+        pass
+
+    adkr.containers.get = get
+    adkr.close = close
+
+    jobs = [('processor-%d' % n, 'image-%d' % n, {}, None) for n in range(4)]
+    jobs[0] = ('processor-bad', 'image-bad', {}, None)
+
+    loop = asyncio.get_event_loop()
+    with patch('ltldoorstep.engines.docker.aiodocker.Docker', return_value=adkr):
+        with pytest.raises(LintolDoorstepContainerException) as exc_info:
+            loop.run_until_complete(engine._run_jobs(jobs, str(tmpdir), 'data.csv'))
+
+    assert exc_info.value.processor == 'processor-bad'
+    assert max(peak) == 2
+    assert len(deleted) == 4
+
+
+def test_data_is_shared_not_copied(engine, tmpdir):
+    """Check the data is linked into the job directory once, rather than copied per processor."""
+
+    source = tmpdir.join('source.csv')
+    source.write_binary(b'a,b\n\xff,1\n')
+
+    metadata = Mock()
+    metadata.supplementary = None
+    metadata.docker = {'image': None, 'revision': None}
+    metadata.lang = None
+    metadata.to_dict.return_value = {}
+    processors = [
+        {'name': 'processor-%d' % n, 'filename': None, 'content': None, 'metadata': metadata}
+        for n in range(2)
+    ]
+
+    seen = []
+
+    async def run_jobs(jobs, mounted_dir, data_basename):
+        data_path = os.path.join(mounted_dir, 'data', data_basename)
+        seen.append((os.listdir(os.path.join(mounted_dir, 'data')), os.stat(data_path).st_ino))
+        for processor_name, image, envs, processor_filename in jobs:
+            with open(os.path.join(mounted_dir, 'out', 'raw', '%s.json' % processor_name), 'w') as report_f:
+                report_f.write(json.dumps(TabularReport(processor_name, 'blank').compile()))
+
+    engine._run_jobs = run_jobs
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(engine._run('data.csv', DataFile(str(source)), processors))
+
+    assert seen == [(['data.csv'], os.stat(str(source)).st_ino)]
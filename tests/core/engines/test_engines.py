@@ -13,3 +13,35 @@ def test_can_instantiate(engine):
     assert asyncio.iscoroutinefunction(eng.run)
     assert (engine.config_help() is None or isinstance(engine.config_help(), dict))
     assert isinstance(engine.description(), str)
+
+
+@pytest.mark.parametrize('engine', [engines[name] for name in ('dask.threaded', 'docker', 'openfaas')])
+def test_released_session_schedules_nothing(engine):
+    """Check a session released before any data arrives completes without scheduling a job."""
+
+    eng = engine()
+    scheduled = []
+
+    async def schedule(session, job):
+        scheduled.append(job)
+
+    eng.schedule = schedule
+
+    async def release_idle_session():
+        session = {'queue': asyncio.Queue()}
+        __, completion = await eng.monitor_pipeline(session)
+        # As SessionSet.release does, for a session with no data
+        session['queue'].put_nowait(0)
+        await asyncio.wait_for(completion, 1)
+        await asyncio.sleep(0)
+        return session
+
+    loop = asyncio.new_event_loop()
+    try:
+        session = loop.run_until_complete(release_idle_session())
+    finally:
+        loop.close()
+
+    assert session['completion'].is_set()
+    assert 'result' not in session
+    assert scheduled == []
@@ -1,10 +1,17 @@
 """Check dask threaded engine is correctly functioning."""
 
 from unittest.mock import Mock, patch, mock_open
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import threading
+import time
 import pytest
 import asyncio
 from ltldoorstep.engines.dask_threaded import DaskThreadedEngine
+from ltldoorstep.engines.openfaas import OpenFaaSEngine
+from ltldoorstep.metadata import DoorstepContext
 from ltldoorstep.processor import DoorstepProcessor
+from ltldoorstep.reports.tabular import TabularReport
 
 import logging
 
@@ -48,3 +55,113 @@ def test_can_run_workflow(engine):
         result = loop.run_until_complete(engine.run(filename, module, metadata))
 
     assert result['tables'][0]['errors'][0]['message'] == filename.upper()
+
+
+class StandInGateway(ThreadingHTTPServer):
+    """Local stand-in for an OpenFaaS gateway, recording how many calls overlap."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInGatewayHandler)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.paths = []
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+
+class StandInGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, body):
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers['Content-Length'] or 0))
+        self.respond([
+            {'name': 'ltl-test-a', 'availableReplicas': 1, 'replicas': 1},
+            {'name': 'not-allowed', 'availableReplicas': 1, 'replicas': 1}
+        ])
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.paths.append(self.path)
+
+        time.sleep(0.2)
+
+        report = TabularReport(request['workflow'], 'stand-in')
+        report.add_issue(logging.ERROR, 'stand-in-error', request['filename'])
+
+        with server.lock:
+            server.active -= 1
+        self.respond(report.compile())
+
+
+@pytest.fixture
+def gateway():
+    server = StandInGateway()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_processors_run_concurrently_on_gateway(gateway):
+    """Check a session's functions are invoked together and merged in processor order."""
+
+    engine = OpenFaaSEngine(config={'engine': {'openfaas': {
+        'host': gateway.url,
+        'allowed-functions': {
+            'test/a:1': 'ltl-test-a',
+            'test/b:1': 'ltl-test-b'
+        }
+    }}})
+    processors = [
+        {'name': name, 'metadata': DoorstepContext(tag=tag), 'filename': None, 'content': None}
+        for name, tag in (('a', 'test/a:1'), ('b', 'test/b:1'))
+    ]
+
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(engine._run(
+        'data.csv',
+        'http://example.org/data.csv',
+        processors,
+        engine.get_gateway(),
+        engine.allowed_functions
+    ))
+    engine.get_gateway().close()
+
+    errors = report.compile()['tables'][0]['errors']
+    assert [error['processor'] for error in errors] == ['test/a:1', 'test/b:1']
+    assert all(error['message'] == 'http://example.org/data.csv' for error in errors)
+    assert sorted(gateway.paths) == ['/function/ltl-test-a', '/function/ltl-test-b']
+    assert gateway.max_active == 2
+
+
+def test_can_check_statuses_on_gateway(gateway):
+    """Check function statuses are fetched and filtered to allowed functions."""
+
+    engine = OpenFaaSEngine(config={'engine': {'openfaas': {
+        'host': gateway.url,
+        'allowed-functions': {'test/a:1': 'ltl-test-a'}
+    }}})
+
+    loop = asyncio.get_event_loop()
+    statuses = loop.run_until_complete(engine.check_processor_statuses())
+
+    assert list(statuses) == ['test/a:1']
@@ -0,0 +1,62 @@
+"""Testing for the binary report encoding"""
+
+import io
+import json
+import logging
+import pytest
+from ltldoorstep.reports import report
+from ltldoorstep.reports import binary
+from ltldoorstep.reports.tabular import TabularReport
+from ltldoorstep.reports.geojson import GeoJSONReport
+from ltldoorstep.wamp_server import ReportResource
+
+pytestmark = pytest.mark.skipif(not binary.msgpack, reason="msgpack is not installed")
+
+
+def make_report():
+    r = TabularReport("test:1", "test", headers=["a", "b"])
+    for n in range(20):
+        r.add_issue(logging.ERROR, "bad-cell", "Bad cell", row_number=n + 1, column_number=1, row=[str(n), "x"], error_data={"n": n})
+    r.add_issue(logging.INFO, "note", "A note", sheet="first")
+    return r
+
+
+def test_binary_round_trip_matches_json():
+    """check a binary-encoded report decodes to the same compiled report, and is smaller"""
+    compiled = make_report().compile()
+
+    encoded = binary.encode_report(compiled)
+
+    assert binary.is_binary(encoded)
+    assert binary.decode_report(encoded) == compiled
+    assert len(encoded) < len(json.dumps(compiled))
+
+
+def test_literal_items_survive_encoding():
+    """check issues not laid out as usual are passed through as they are"""
+    r = GeoJSONReport("test:1", "test")
+    r.add_issue(logging.WARNING, "odd", "Literal item", "just a string")
+    compiled = r.compile()
+
+    assert binary.decode_report(binary.encode_report(compiled)) == compiled
+
+
+def test_reports_load_from_either_format():
+    """check Report.load and Report.parse read JSON and binary alike"""
+    compiled = make_report().compile()
+
+    from_binary = report.Report.load(io.BytesIO(binary.encode_report(compiled)))
+    from_json = report.Report.parse(json.dumps(compiled))
+
+    assert from_binary.compile() == from_json.compile() == compiled
+
+
+def test_report_resource_sends_requested_format():
+    """check the report is only binary-encoded when the client asks for it"""
+    r = make_report()
+    resource = ReportResource(None, {'report': {'max-length-chars': 100000}})
+
+    assert binary.choose_report_format(['json']) == 'json'
+    assert binary.choose_report_format(['json', 'msgpack']) == 'msgpack'
+    assert json.loads(resource._dump_within_limit(r, 100000)) == r.compile()
+    assert binary.loads_report(resource._dump_within_limit(r, 100000, 'msgpack')) == r.compile()
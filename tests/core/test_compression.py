@@ -0,0 +1,71 @@
+"""Testing for compression of large WAMP payloads"""
+
+import os
+import asyncio
+from ltldoorstep import compression
+from contextlib import contextmanager
+from ltldoorstep.wamp_server import DoorstepComponent, SessionSet
+
+
+class StubEngine:
+    @contextmanager
+    def make_session(self):
+        yield {"name": "s1"}
+
+
+def test_large_values_are_compressed_and_restored():
+    """check large strings and bytes, including inside dicts, survive a round trip"""
+    text = "name,value\n" + "somewhere,1\n" * 10000
+    modules = {"processor.py": text, "small.py": "import os"}
+    args = [modules, text.encode("utf-8"), 3]
+
+    packed = compression.pack(args, "zlib", threshold=1024)
+
+    assert compression.is_envelope(packed[0]["processor.py"])
+    assert packed[0]["small.py"] == "import os"
+    assert compression.is_envelope(packed[1])
+    assert len(packed[1]["data"]) < len(text)
+    assert compression.unpack(packed) == [modules, text.encode("utf-8"), 3]
+
+
+def test_small_or_incompressible_values_are_left_alone():
+    """check payloads below the threshold, or that would not shrink, are sent as they are"""
+    noise = os.urandom(4096)
+
+    assert compression.pack("short", "zlib", threshold=1024) == "short"
+    assert compression.pack("x" * 2048, None, threshold=1024) == "x" * 2048
+    assert compression.pack(noise, "zlib", threshold=1024) == noise
+    assert compression.choose_codec(["gzip"]) is None
+    assert compression.choose_codec(["zlib"]) == "zlib"
+
+
+def test_server_compresses_only_for_clients_that_accept_it():
+    """check the server unpacks compressed arguments, and compresses results only on request"""
+    sessions = SessionSet(StubEngine())
+    session = sessions.add()
+    component = DoorstepComponent(None, sessions, {"wamp": {"compression-threshold": 100}}, False)
+    registered = {}
+
+    async def register(routine, uri):
+        registered[uri] = routine
+    component.register = register
+
+    async def echo(content, session=None):
+        return content + "!"
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(component.wrap_register("data.post", echo))
+        routine = registered["com.ltldoorstep.{}.data.post".format(component._id)]
+
+        content = "a,b\n" * 100
+        packed = compression.pack(content, "zlib", threshold=100)
+
+        plain = loop.run_until_complete(routine(session["name"], packed))
+        compressed = loop.run_until_complete(routine(session["name"], packed, accept_compression=["zlib"]))
+    finally:
+        loop.close()
+
+    assert plain == content + "!"
+    assert compression.is_envelope(compressed)
+    assert compression.unpack(compressed) == content + "!"
@@ -0,0 +1,234 @@
+"""Testing for concurrent crawling"""
+
+import random
+import asyncio
+import ckanapi
+from ltldoorstep import crawler
+from ltldoorstep.errors import LintolDoorstepBusyException
+from ltldoorstep.rate_limit import HostRateLimiter
+
+
+class FakeCKAN:
+    def __init__(self, url, user_agent=None):
+        self.action = self
+
+    def package_list(self):
+        return ['package-%d' % n for n in range(12)]
+
+    def package_show(self, id):
+        return {
+            'name': id,
+            'resources': [
+                {'id': '%s-%d' % (id, n), 'format': fmt, 'url': 'http://data.example/%s/%d' % (id, n)}
+                for n, fmt in enumerate(('CSV', 'PDF', 'GeoJSON'))
+            ]
+        }
+
+
+class FakeResponse:
+    def __init__(self, url):
+        self.text = url
+
+
+class FakePrinter:
+    def __init__(self):
+        self.reports = []
+
+    def build_report(self, result):
+        self.reports.append(result)
+
+    def print_output(self):
+        pass
+
+
+def test_crawl_is_concurrent_but_keeps_report_order(monkeypatch):
+    """check workflows run concurrently, within their pool, while reports print in order"""
+    running = []
+    peak = []
+
+    async def execute_workflow(component, filename, workflow, ini, priority=None):
+        with open(filename, 'r') as data_file:
+            url = data_file.read()
+        running.append(url)
+        peak.append(len(running))
+        await asyncio.sleep(random.random() / 100)
+        running.remove(url)
+        return url
+
+    monkeypatch.setattr(ckanapi, 'RemoteCKAN', FakeCKAN)
+    monkeypatch.setattr(crawler.requests, 'get', FakeResponse)
+    monkeypatch.setattr(crawler, 'execute_workflow', execute_workflow)
+
+    printer = FakePrinter()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(crawler.do_crawl(
+            None, 'http://ckan.example', 'workflow.py', printer, False,
+            workflow_workers=3
+        ))
+    finally:
+        loop.close()
+
+    assert printer.reports == [
+        'http://data.example/package-%d/%d' % (p, n)
+        for p in range(12) for n in (0, 2)
+    ]
+    assert 1 < max(peak) <= 3
+
+
+def test_publish_only_crawl_skips_unchanged_resources(monkeypatch):
+    """check resources unchanged since the last crawl are not announced again"""
+    announced = []
+
+    async def announce_resource(component, resource, ini, source, update=False):
+        announced.append(resource['url'])
+
+    class Fingerprints:
+        def fetch(self, url, resource=None, keep_body=True):
+            assert not keep_body
+            # Only the first resource of each package has changed
+            if url.endswith('/2'):
+                return None, None
+            return FakeResponse(url), {'url': url}
+
+        def commit(self, url, fingerprint):
+            pass
+
+        def log_counts(self):
+            pass
+
+    monkeypatch.setattr(ckanapi, 'RemoteCKAN', FakeCKAN)
+    monkeypatch.setattr(crawler, 'announce_resource', announce_resource)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(crawler.do_crawl(
+            None, 'http://ckan.example', None, FakePrinter(), True,
+            fingerprints=Fingerprints()
+        ))
+    finally:
+        loop.close()
+
+    assert sorted(announced) == sorted('http://data.example/package-%d/0' % p for p in range(12))
+
+
+def test_failed_workflows_are_not_fingerprinted(monkeypatch):
+    """check a resource whose workflow failed is not committed as checked, so is tried again"""
+    committed = []
+
+    async def execute_workflow(component, filename, workflow, ini, priority=None):
+        with open(filename, 'r') as data_file:
+            url = data_file.read()
+        # The workflows for every package's first resource fail
+        return None if url.endswith('/0') else url
+
+    class Fingerprints:
+        def fetch(self, url, resource=None, keep_body=True):
+            assert keep_body
+            return FakeResponse(url), {'url': url}
+
+        def commit(self, url, fingerprint):
+            committed.append(url)
+
+        def log_counts(self):
+            pass
+
+    monkeypatch.setattr(ckanapi, 'RemoteCKAN', FakeCKAN)
+    monkeypatch.setattr(crawler, 'execute_workflow', execute_workflow)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(crawler.do_crawl(
+            None, 'http://ckan.example', 'workflow.py', FakePrinter(), False,
+            fingerprints=Fingerprints()
+        ))
+    finally:
+        loop.close()
+
+    assert sorted(committed) == sorted('http://data.example/package-%d/2' % p for p in range(12))
+
+
+def test_rate_limit_is_per_host():
+    """check requests to one host are spaced out, without holding up another host"""
+    limiter = HostRateLimiter(rate=100, burst=2)
+    loop = asyncio.new_event_loop()
+
+    async def timed(urls):
+        start = loop.time()
+        for url in urls:
+            await limiter.acquire(url)
+        return loop.time() - start
+
+    try:
+        busy = loop.run_until_complete(timed(['http://a.example/%d' % n for n in range(5)]))
+        other = loop.run_until_complete(timed(['http://b.example/', 'http://b.example/x']))
+    finally:
+        loop.close()
+
+    assert busy >= 0.025
+    assert other < 0.01
+
+
+class BusyServerSession:
+    def __init__(self, busy):
+        self.busy = busy
+        self.calls = []
+
+    async def call_server(self, endpoint, *args, **kwargs):
+        self.calls.append(endpoint)
+
+    async def post_data(self, filename, content, redirect, priority=None):
+        self.calls.append('data.post')
+        if self.busy:
+            raise LintolDoorstepBusyException(RuntimeError("Server has 1 jobs queued"), status_code=503)
+
+    async def get_report(self):
+        return 'report'
+
+
+class BusyComponent:
+    def __init__(self, busy_sessions):
+        self.busy_sessions = busy_sessions
+        self.sessions = []
+
+    async def open_session(self):
+        session = BusyServerSession(len(self.sessions) < self.busy_sessions)
+        self.sessions.append(session)
+        return session
+
+
+def run_workflow(component, tmpdir):
+    workflow = tmpdir.join('workflow.py')
+    workflow.write('')
+    data = tmpdir.join('data.csv')
+    data.write('a,b\n')
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(crawler.execute_workflow(
+            component, str(data), str(workflow), None, priority='crawler'
+        ))
+    finally:
+        loop.close()
+
+
+def test_workflow_retries_saturated_server(monkeypatch, tmpdir):
+    """check a busy server is backed off from and a fresh session engaged"""
+    monkeypatch.setattr(crawler, 'ENGAGE_RETRY_DELAY', 0)
+    component = BusyComponent(busy_sessions=2)
+
+    assert run_workflow(component, tmpdir) == 'report'
+    assert len(component.sessions) == 3
+    assert component.sessions[-1].calls == ['processor.post', 'data.post']
+
+
+def test_workflow_gives_up_on_saturated_servers(monkeypatch, tmpdir):
+    """check servers that stay busy fail the one workflow, not the crawl"""
+    monkeypatch.setattr(crawler, 'ENGAGE_RETRY_DELAY', 0)
+    component = BusyComponent(busy_sessions=crawler.ENGAGE_ATTEMPTS)
+
+    assert run_workflow(component, tmpdir) is None
+    assert len(component.sessions) == crawler.ENGAGE_ATTEMPTS
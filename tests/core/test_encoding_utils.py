@@ -0,0 +1,65 @@
+"""Testing for encoding detection"""
+
+import io
+import codecs
+import pytest
+from ltldoorstep import encoding_utils
+from ltldoorstep.encoding_utils import detect_encoding
+
+
+@pytest.mark.parametrize('body,encoding', [
+    (codecs.BOM_UTF8 + 'a,b\n'.encode('utf-8'), 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE + 'a,b\n'.encode('utf-16-le'), 'utf-16'),
+    (codecs.BOM_UTF32_LE + 'a,b\n'.encode('utf-32-le'), 'utf-32'),
+    ('name,place\nSeán,Dún Laoghaire\n'.encode('utf-8'), 'utf-8'),
+    (b'a,b\n1,2\n', 'utf-8')
+])
+def test_detect_fast_paths(body, encoding):
+    """check BOMs and UTF-8 are recognised without falling back to chardet"""
+
+    assert detect_encoding(io.BytesIO(body)) == encoding
+
+
+def test_detect_tolerates_split_multibyte_sample():
+    """check a UTF-8 character split by the sample boundary is not held against it"""
+
+    body = 'aé'.encode('utf-8') * 10
+    assert detect_encoding(io.BytesIO(body), sample_size=4) == 'utf-8'
+
+
+def test_detect_reads_bounded_amount():
+    """check detection stops once it has seen its limit"""
+
+    body = io.BytesIO('Ceci est un texte en français, très simple. '.encode('latin-1') * 100000)
+    encoding = detect_encoding(body, sample_size=1024, limit=16 * 1024)
+
+    assert codecs.lookup(encoding).name in ('iso8859-1', 'cp1252')
+    assert body.tell() <= 17 * 1024
+
+
+def test_detect_checks_beyond_ascii_sample():
+    """check an ASCII opening does not pass off a Latin-1 tail as UTF-8"""
+
+    body = b'a,b\n' * 40 * 1024 + 'Seán,Dún Laoghaire\n'.encode('latin-1')
+    encoding = detect_encoding(io.BytesIO(body))
+
+    assert codecs.lookup(encoding).name != 'utf-8'
+    assert body.decode(encoding).endswith('Seán,Dún Laoghaire\n')
+
+
+def test_detect_falls_back_when_chardet_gives_up(monkeypatch):
+    """check an encoding chardet cannot name falls back to one that decodes any bytes"""
+
+    class Detector:
+        done = False
+        result = {'encoding': None}
+
+        def feed(self, sample):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(encoding_utils.chardet, 'UniversalDetector', Detector)
+
+    assert detect_encoding(io.BytesIO(b'a,b\n\xff\xfe\x00,1\n')) == encoding_utils.FALLBACK_ENCODING
@@ -0,0 +1,93 @@
+"""Testing for local file handling"""
+
+import os
+import codecs
+from unittest.mock import Mock, patch
+import pytest
+from ltldoorstep.file import DataFile, download_to_file, make_file_manager
+
+
+@pytest.fixture
+def requests():
+    requests = Mock()
+    request = Mock()
+    request.status_code = 200
+    requests.get.return_value = request
+    return requests
+
+
+def test_download_recodes_in_chunks(requests):
+    """check a download is written to disk and recoded to UTF-8"""
+
+    body = 'name,place\nSeán,Dún Laoghaire\n'.encode('latin-1') * 1000
+    request = requests.get.return_value
+    request.encoding = 'ISO-8859-1'
+    request.iter_content.return_value = [body[i:i + 7] for i in range(0, len(body), 7)]
+
+    with patch('ltldoorstep.file.requests', requests):
+        data_file = download_to_file('http://example.org/data.csv')
+
+    with open(data_file.path, 'rb') as file_obj:
+        assert file_obj.read() == body.decode('latin-1').encode('utf-8')
+    assert data_file.encoding == 'utf-8'
+
+
+def test_download_keeps_undecodable_content(requests):
+    """check content that cannot be recoded is passed on as-is"""
+
+    body = b'a,b\n\xff\xfe\xfa,1\n'
+    request = requests.get.return_value
+    request.encoding = 'shift_jis'
+    request.iter_content.return_value = [body]
+
+    with patch('ltldoorstep.file.requests', requests):
+        data_file = download_to_file('http://example.org/data.csv')
+
+    with open(data_file.path, 'rb') as file_obj:
+        assert file_obj.read() == body
+
+
+def test_data_file_is_linked_not_loaded(tmpdir):
+    """check file managers place a DataFile without reading it"""
+
+    source = tmpdir.join('source.csv')
+    source.write('a,b\n1,2\n')
+
+    with make_file_manager(content={'data.csv': DataFile(str(source))}) as file_manager:
+        local_file = file_manager.get('data.csv')
+        with open(local_file, 'r') as file_obj:
+            assert file_obj.read() == 'a,b\n1,2\n'
+
+    assert os.path.exists(str(source))
+
+
+def test_download_detects_missing_encoding(requests):
+    """check the encoding is detected when the server does not give one"""
+
+    body = codecs.BOM_UTF8 + 'a,b\n1,2\n'.encode('utf-8')
+    request = requests.get.return_value
+    request.encoding = None
+    request.iter_content.return_value = [body]
+
+    with patch('ltldoorstep.file.requests', requests):
+        data_file = download_to_file('http://example.org/data.csv')
+
+    with open(data_file.path, 'rb') as file_obj:
+        assert file_obj.read() == b'a,b\n1,2\n'
+    assert data_file.encoding == 'utf-8'
+
+
+def test_download_validates_whole_file(requests):
+    """check a Latin-1 tail after a long ASCII opening is still recoded"""
+
+    body = b'a,b\n' * 40 * 1024 + 'Seán,Dún Laoghaire\n'.encode('latin-1')
+    request = requests.get.return_value
+    request.encoding = None
+    request.iter_content.return_value = [body[i:i + 64 * 1024] for i in range(0, len(body), 64 * 1024)]
+
+    with patch('ltldoorstep.file.requests', requests):
+        data_file = download_to_file('http://example.org/data.csv')
+
+    with open(data_file.path, 'rb') as file_obj:
+        assert file_obj.read() == body.decode('latin-1').encode('utf-8')
+    assert data_file.encoding == 'utf-8'
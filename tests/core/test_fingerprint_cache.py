@@ -0,0 +1,121 @@
+"""Testing for the resource fingerprint cache"""
+
+from ltldoorstep.fingerprint_cache import ResourceFingerprintCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.consumed = False
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        self.consumed = True
+        for start in range(0, len(self.content), 4):
+            yield self.content[start:start + 4]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServer:
+    ''' serves a body with an ETag, honouring If-None-Match '''
+
+    def __init__(self, content, etag):
+        self.content = content
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False):
+        assert stream
+        self.requests.append(headers)
+        if headers.get('If-None-Match') == self.etag:
+            self.response = FakeResponse(304)
+        else:
+            self.response = FakeResponse(200, self.content, {'ETag': self.etag})
+        return self.response
+
+
+def fetch_and_commit(cache, url, resource=None, **kwargs):
+    response, fingerprint = cache.fetch(url, resource, **kwargs)
+    if fingerprint:
+        cache.commit(url, fingerprint)
+    return response
+
+
+def test_unchanged_resources_are_not_fetched_again(tmpdir):
+    """check a 304, or an identical body, counts as unchanged and only new data is returned"""
+    server = FakeServer(b'a,b\n1,2\n', '"v1"')
+    url = 'http://data.example/1.csv'
+    path = str(tmpdir.join('fingerprints.sqlite'))
+
+    with ResourceFingerprintCache(path) as cache:
+        assert fetch_and_commit(cache, url, get=server.get).content == b'a,b\n1,2\n'
+        assert fetch_and_commit(cache, url, get=server.get) is None
+        assert server.requests[-1] == {'If-None-Match': '"v1"'}
+
+        # A new ETag for the same body is still unchanged
+        server.etag = '"v2"'
+        assert fetch_and_commit(cache, url, get=server.get) is None
+
+        server.content, server.etag = b'a,b\n3,4\n', '"v3"'
+        assert fetch_and_commit(cache, url, get=server.get).content == b'a,b\n3,4\n'
+
+        assert cache.counts == {'hits': 2, 'misses': 2, 'metadata-unchanged': 0, 'not-modified': 1, 'same-content': 1}
+
+    with ResourceFingerprintCache(path) as cache:
+        assert fetch_and_commit(cache, url, get=server.get) is None
+        assert cache.get(url)['size'] == len(b'a,b\n3,4\n')
+
+
+def test_uncommitted_fingerprints_are_not_kept():
+    """check a resource whose check failed, so was never committed, is fetched afresh"""
+    server = FakeServer(b'a,b\n1,2\n', '"v1"')
+    url = 'http://data.example/1.csv'
+    cache = ResourceFingerprintCache()
+
+    response, fingerprint = cache.fetch(url, get=server.get)
+    assert response.content == b'a,b\n1,2\n'
+    assert cache.get(url) is None
+
+    # Announcing or checking failed, so the fingerprint was dropped
+    response, fingerprint = cache.fetch(url, get=server.get)
+    assert server.requests[-1] == {}
+    assert response.content == b'a,b\n1,2\n'
+
+    cache.commit(url, fingerprint)
+    assert cache.fetch(url, get=server.get) == (None, None)
+    assert cache.counts['not-modified'] == 1
+
+
+def test_resource_metadata_can_vouch_for_content():
+    """check resources with a content hash in unchanged metadata are skipped without a request"""
+    server = FakeServer(b'x', '"v1"')
+    hashed = {'id': '1', 'url': 'http://data.example/1.csv', 'hash': 'abc'}
+    unhashed = {'id': '2', 'url': 'http://data.example/2.csv'}
+    cache = ResourceFingerprintCache()
+
+    for resource in (hashed, unhashed, hashed, unhashed):
+        fetch_and_commit(cache, resource['url'], resource, get=server.get)
+
+    assert len(server.requests) == 3
+    assert cache.counts['metadata-unchanged'] == 1
+    assert cache.counts['not-modified'] == 1
+
+    trusting = ResourceFingerprintCache(trust_metadata=True)
+    fetch_and_commit(trusting, unhashed['url'], unhashed, get=server.get)
+    assert fetch_and_commit(trusting, unhashed['url'], unhashed, get=server.get) is None
+    assert trusting.counts['metadata-unchanged'] == 1
+
+
+def test_body_only_kept_if_wanted():
+    """check a fingerprint-only fetch streams the body through the hash and closes the response"""
+    server = FakeServer(b'a,b\n1,2\n', '"v1"')
+    cache = ResourceFingerprintCache()
+
+    response, fingerprint = cache.fetch('http://data.example/1.csv', get=server.get, keep_body=False)
+    assert response is server.response
+    assert server.response.consumed and server.response.closed
+    assert fingerprint['size'] == len(b'a,b\n1,2\n')
@@ -3,6 +3,10 @@ import pytest
 from ltldoorstep.reports import report
 from ltldoorstep.reports.tabular import TabularReport
 from ltldoorstep.reports.geojson import GeoJSONReport
+from ltldoorstep.reports.budget import IssueBudget, TRUNCATION_CODE
+from ltldoorstep.wamp_server import ReportResource
+import io
+import json
 import logging
 
 
@@ -55,3 +59,158 @@ def assert_issues_dict(rcls):
     assert issue is not None
     assert type(issue) is dict
     assert len(issue) == 1
+
+def test_issue_queries_follow_levels_and_indexes():
+    """testing issues can be fetched by level, code and processor, in report order"""
+    r = TabularReport("test:1", "test")
+    r.add_issue(logging.WARNING, "code-a", "first warning")
+    r.add_issue(logging.ERROR, "code-a", "first error")
+    r.add_issue(logging.ERROR, "code-b", "second error")
+    r.add_issue(logging.ERROR, "code-a", "top error", at_top=True)
+
+    other = TabularReport("other:2", "test")
+    other.add_issue(logging.INFO, "code-a", "information")
+    r.update(other)
+
+    assert [i.message for i in r.get_issues()] == ["top error", "first error", "second error", "first warning", "information"]
+    assert [i.message for i in r.get_issues_by_code("code-a")] == ["top error", "first error", "first warning", "information"]
+    assert [i.message for i in r.get_issues_by_code("code-a", logging.ERROR)] == ["top error", "first error"]
+    assert r.get_issues_by_code("code-c") == []
+    assert [i.message for i in r.get_issues_by_processor("other:2")] == ["information"]
+    assert sorted(r.get_subprocessors()) == ["other:2", "test:1"]
+    assert r.has_processor("other", include_subprocessors=True)
+    assert not r.has_processor("other", include_subprocessors=False)
+
+    parsed = report.Report.parse(r.compile())
+    assert [i.message for i in parsed.get_issues_by_code("code-a", logging.ERROR)] == ["top error", "first error"]
+
+def test_cell_issues_share_row_context():
+    """testing cell issues on one row share its context, and render as before"""
+    r = TabularReport("test", "test", headers=["a", "b"])
+    r.add_issue(logging.ERROR, "bad-cell", "first", row_number=1, column_number=1, row=["1", "2"])
+    r.add_issue(logging.ERROR, "bad-cell", "second", row_number=1, column_number=2, row=["1", "2"])
+    r.add_issue(logging.ERROR, "bad-cell", "third", row_number=2, column_number=1, row=["3", "4"])
+
+    first, second, third = r.get_issues(logging.ERROR)
+    assert first.context is second.context
+    assert third.context is not first.context
+    assert not hasattr(first, '__dict__')
+
+    assert second.render() == {
+        'processor': 'test',
+        'code': 'bad-cell',
+        'message': 'second',
+        'item': {
+            'entity': {'type': 'Cell', 'location': {'row': 1, 'column': 2}, 'definition': None},
+            'properties': None
+        },
+        'context': [{
+            'entity': {'type': 'Row', 'location': {'row': 1, 'column': None}, 'definition': None},
+            'properties': {'a': '1', 'b': '2'}
+        }],
+        'error-data': {}
+    }
+
+@pytest.mark.parametrize('rcls', rcls)
+def test_dump_matches_compile(rcls):
+    """testing the streamed report is the same JSON as the compiled one"""
+    r = rcls("test", "test")
+    r.add_issue(logging.ERROR, "code-a", "an error", "item")
+    r.add_issue(logging.WARNING, "code-b", "a warning – with non-ASCII")
+    r.add_supplementary('csv', 'http://example.org/register.csv', 'register')
+
+    dumped = io.StringIO()
+    r.dump(dumped)
+
+    assert dumped.getvalue() == json.dumps(r.compile())
+
+def test_dump_stops_at_character_limit():
+    """testing an over-long report is abandoned once the limit is reached"""
+    r = TabularReport("test", "test")
+    for n in range(1000):
+        r.add_issue(logging.ERROR, "code-a", "error %d" % n, row_number=n + 1)
+
+    dumped = io.StringIO()
+    with pytest.raises(report.ReportTooLong):
+        r.dump(dumped, max_chars=2000)
+
+    assert 0 < len(dumped.getvalue()) <= 2000
+
+def test_budget_keeps_first_issues_and_counts_the_rest():
+    """testing a budgeted report stays bounded, with exact counts of what was left out"""
+    r = TabularReport("test", "test")
+    r.set_budget(IssueBudget(max_per_code=3, sample_size=2, seed=1))
+    for n in range(100):
+        r.add_issue(logging.ERROR, "bad-cell", "error %d" % n, row_number=n + 1, column_number=1)
+    r.add_issue(logging.WARNING, "odd-cell", "warning", row_number=1, column_number=2)
+
+    errors = r.get_issues(logging.ERROR)
+    assert [i.message for i in errors[:3]] == ["error 0", "error 1", "error 2"]
+    assert len(errors) == 4
+
+    summary = errors[3].render()
+    assert summary['code'] == TRUNCATION_CODE
+    assert summary['error-data']['omitted'] == 97
+    assert summary['error-data']['total'] == 100
+    assert len(summary['error-data']['sample']) == 2
+    assert len(r.get_issues(logging.WARNING)) == 1
+
+    compiled = r.compile()
+    assert compiled['error-count'] == 5
+    assert not compiled['valid']
+
+def test_report_resource_bounds_long_reports():
+    """testing an over-long report is cut down to fit, rather than failing"""
+    r = TabularReport("test", "test")
+    for n in range(1000):
+        r.add_issue(logging.ERROR, "bad-row", "error %d" % n, row_number=n + 1)
+
+    resource = ReportResource(None, {'report': {'max-length-chars': 20000}})
+    result = json.loads(resource._dump_within_limit(r, 20000))
+
+    errors = result['tables'][0]['errors']
+    assert errors[-1]['code'] == TRUNCATION_CODE
+    assert errors[-1]['error-data']['total'] == 1000
+    assert len(errors) < 1000
+
+def test_parsed_issues_stay_raw_until_asked_for():
+    """testing parsed reports can be combined and compiled without building issue objects"""
+    compiled = []
+    for sheet in ("first", "second"):
+        r = TabularReport("test:%s" % sheet, "test")
+        r.add_issue(logging.ERROR, "bad-cell", "in %s" % sheet, row_number=1, column_number=1, sheet=sheet)
+        r.add_issue(logging.INFO, "note", "about %s" % sheet)
+        compiled.append(r.compile())
+
+    combined = report.combine_reports(*[report.Report.parse(c) for c in compiled])
+    assert not combined.issues.is_materialized
+
+    result = combined.compile()
+    assert [t['source'] for t in result['tables']] == ['unknown.csv', 'unknown.csv:first', 'unknown.csv:second']
+    assert result['error-count'] == 4
+    assert not combined.issues.is_materialized
+
+    assert [i.message for i in combined.get_issues_by_code("bad-cell")] == ["in first", "in second"]
+    assert combined.issues.is_materialized
+    assert combined.compile() == result
+
+def test_merge_reports_from_files(tmpdir):
+    """testing reports can be merged straight from files, optionally dropping duplicate issues"""
+    paths = []
+    for n in range(3):
+        r = TabularReport("test", "test")
+        r.add_issue(logging.ERROR, "shared", "found in every report")
+        r.add_issue(logging.WARNING, "own", "report %d" % n)
+        path = tmpdir.join('report-%d.json' % n)
+        path.write(json.dumps(r.compile()))
+        paths.append(str(path))
+
+    merged = report.merge_reports(iter(paths))
+    assert merged.issues.count() == 6
+
+    deduped = report.merge_reports(paths, dedupe=True)
+    assert [i.message for i in deduped.get_issues_by_code("shared")] == ["found in every report"]
+    assert len(deduped.get_issues_by_code("own")) == 3
+
+    with pytest.raises(RuntimeError):
+        report.merge_reports([TabularReport("test", "test"), GeoJSONReport("test", "test")])
@@ -0,0 +1,115 @@
+"""Testing for the server's job scheduler"""
+
+import asyncio
+import pytest
+from ltldoorstep.errors import LintolDoorstepBusyException
+from ltldoorstep.engines.engine import Engine
+from ltldoorstep.scheduler import JobScheduler
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_jobs_are_bounded_and_prioritized():
+    """check no more than the worker count run at once, with interactive jobs first"""
+    scheduler = JobScheduler(workers=2, max_queued=None)
+    gate = asyncio.Event()
+    running = []
+    order = []
+    peak = []
+
+    def make_job(name, blocking=False):
+        async def job():
+            running.append(name)
+            peak.append(len(running))
+            if blocking:
+                await gate.wait()
+            order.append(name)
+            running.remove(name)
+            return name
+        return job
+
+    async def scenario():
+        blockers = [asyncio.ensure_future(scheduler.submit(make_job('block%d' % n, True))) for n in range(2)]
+        await asyncio.sleep(0)
+        queued = [
+            asyncio.ensure_future(scheduler.submit(make_job('crawl'), 'crawler')),
+            asyncio.ensure_future(scheduler.submit(make_job('user'), 'interactive'))
+        ]
+        await asyncio.sleep(0.01)
+        metrics = scheduler.metrics()
+
+        gate.set()
+        results = await asyncio.gather(*(blockers + queued))
+        scheduler.shutdown()
+        return metrics, results
+
+    metrics, results = run(scenario())
+
+    assert metrics['running'] == 2
+    assert metrics['queued-by-priority'] == {'interactive': 1, 'crawler': 1}
+    assert max(peak) == 2
+    assert order.index('user') < order.index('crawl')
+    assert results == ['block0', 'block1', 'crawl', 'user']
+
+
+def test_saturated_scheduler_rejects_jobs():
+    """check jobs are refused once the queue is full, and failures reach the caller"""
+    scheduler = JobScheduler(workers=1, max_queued=1)
+    gate = asyncio.Event()
+
+    async def blocked():
+        await gate.wait()
+
+    async def failing():
+        raise ValueError('broken')
+
+    async def scenario():
+        first = asyncio.ensure_future(scheduler.submit(blocked))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(scheduler.submit(failing))
+        await asyncio.sleep(0)
+
+        with pytest.raises(LintolDoorstepBusyException):
+            await scheduler.submit(blocked)
+
+        gate.set()
+        await first
+        with pytest.raises(ValueError):
+            await second
+
+        metrics = scheduler.metrics()
+        scheduler.shutdown()
+        return metrics
+
+    metrics = run(scenario())
+
+    assert metrics['rejected'] == 1
+    assert metrics['completed'] == 1
+    assert metrics['failed'] == 1
+
+
+def test_engine_schedules_session_jobs():
+    """check engines pass session jobs, with their priority, through a scheduler if set"""
+    engine = Engine()
+    submitted = []
+
+    class RecordingScheduler:
+        async def submit(self, job, priority=None):
+            submitted.append(priority)
+            return await job()
+
+    async def job():
+        return 'done'
+
+    assert run(engine.schedule({}, job)) == 'done'
+
+    engine.scheduler = RecordingScheduler()
+    assert run(engine.schedule({'priority': 'crawler'}, job)) == 'done'
+    assert submitted == ['crawler']
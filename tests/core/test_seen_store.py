@@ -0,0 +1,48 @@
+"""Testing for the watcher's persistent seen-store"""
+
+import time
+from ltldoorstep.seen_store import SeenStore, resource_hash
+
+
+def test_seen_keys_survive_a_restart(tmpdir):
+    """check keys added before reopening the store are still seen"""
+    path = str(tmpdir.join('seen.sqlite'))
+    key = SeenStore.make_key('http://ckan.example', 'package-1', 'revision-1')
+
+    with SeenStore(path) as seen:
+        assert key not in seen
+        seen.add(key, key)
+        assert key in seen
+
+    with SeenStore(path) as seen:
+        assert key in seen
+        assert len(seen) == 1
+        assert SeenStore.make_key('http://ckan.example', 'package-1', 'revision-2') not in seen
+
+
+def test_old_keys_are_pruned(tmpdir):
+    """check keys older than the TTL are forgotten, in memory and on disk"""
+    path = str(tmpdir.join('seen.sqlite'))
+    old = SeenStore.make_key('store', 'package-1', 'revision-1')
+    new = SeenStore.make_key('store', 'package-2', 'revision-1')
+
+    with SeenStore(path, ttl=60) as seen:
+        seen.add(old)
+        seen._db.execute('UPDATE seen SET seen_at = ?', (time.time() - 120,))
+        seen._db.commit()
+        seen.add(new)
+
+        assert seen.prune() == 1
+        assert old not in seen
+        assert new in seen
+
+    with SeenStore(path, ttl=60) as seen:
+        assert list(seen._keys) == [new]
+
+
+def test_resource_hash_follows_resource_changes():
+    """check a resource's hash changes with its content fields, but not with others"""
+    resource = {'id': '1', 'url': 'http://data.example/1.csv', 'hash': 'abc', 'name': 'Data'}
+
+    assert resource_hash(resource) == resource_hash(dict(resource, name='Renamed'))
+    assert resource_hash(resource) != resource_hash(dict(resource, hash='def'))
@@ -0,0 +1,127 @@
+"""Testing for the WAMP server's session lifecycle"""
+
+import time
+import uuid
+import asyncio
+import pytest
+from contextlib import contextmanager
+from ltldoorstep.errors import LintolDoorstepBusyException
+from ltldoorstep.wamp_server import DoorstepComponent, SessionSet
+
+
+class StubEngine:
+    @contextmanager
+    def make_session(self):
+        yield {"name": "doorstep-%s" % uuid.uuid4(), "queue": asyncio.Queue()}
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_session_released_once_report_retrieved():
+    """check the report endpoint releases its session, but other endpoints do not"""
+    sessions = SessionSet(StubEngine())
+    component = DoorstepComponent(None, sessions, {}, False)
+    registered = {}
+
+    async def register(routine, uri):
+        registered[uri.split('.', 3)[-1]] = routine
+    component.register = register
+
+    async def post(session=None):
+        session["processors"] = [{"content": b"x" * 10}]
+
+    async def get(session=None):
+        return "report"
+
+    async def scenario():
+        await component.wrap_register("processor.post", post)
+        await component.wrap_register("report.get", get, release=True)
+        session = await component.make_session()
+
+        await registered["processor.post"](session["name"])
+        assert sessions.metrics()["held-processor-bytes"] == 10
+
+        result = await registered["report.get"](session["name"])
+        return session, result
+
+    session, result = run(scenario())
+
+    assert result == "report"
+    assert session["name"] not in sessions
+    assert sessions.metrics()["live"] == 0
+    assert sessions.metrics()["released"] == 1
+
+
+def test_idle_sessions_expire_unless_busy():
+    """check sessions idle past the TTL are released, but not ones mid-call"""
+    sessions = SessionSet(StubEngine(), idle_ttl=10)
+    idle = sessions.add()
+    busy = sessions.add()
+    fresh = sessions.add()
+    idle["__used__"] = busy["__used__"] = time.monotonic() - 60
+
+    with sessions.use(busy["name"]):
+        assert sessions.expire() == [idle["name"]]
+
+    assert list(sessions) == [fresh["name"], busy["name"]]
+    assert idle["queue"].get_nowait() == 0
+    assert sessions.metrics()["expired"] == 1
+
+
+def test_engage_waits_for_a_free_session():
+    """check a full server rejects new sessions, or waits for one to be released"""
+    sessions = SessionSet(StubEngine(), max_sessions=1)
+    first = sessions.add()
+
+    with pytest.raises(LintolDoorstepBusyException):
+        sessions.add()
+    with pytest.raises(LintolDoorstepBusyException):
+        run(sessions.add_when_free(timeout=0.01))
+
+    async def release_soon():
+        await asyncio.sleep(0.01)
+        sessions.release(first["name"])
+
+    async def scenario():
+        waiting = asyncio.ensure_future(sessions.add_when_free(timeout=5))
+        await release_soon()
+        return await waiting
+
+    second = run(scenario())
+
+    assert list(sessions) == [second["name"]]
+    assert sessions.metrics()["rejected"] == 2
+
+
+def test_session_released_when_server_saturated():
+    """check a job turned away by a saturated server releases its session slot"""
+    sessions = SessionSet(StubEngine(), max_sessions=1)
+    component = DoorstepComponent(None, sessions, {}, False)
+    registered = {}
+
+    async def register(routine, uri):
+        registered[uri.split('.', 3)[-1]] = routine
+    component.register = register
+
+    async def post(*args, session=None, **kwargs):
+        raise LintolDoorstepBusyException(RuntimeError("Server has 1 jobs queued"), status_code=503)
+
+    async def scenario():
+        await component.wrap_register("data.post", post)
+        session = await component.make_session()
+
+        with pytest.raises(LintolDoorstepBusyException):
+            await registered["data.post"](session["name"], "data.csv", "file:///data.csv", True)
+
+        return session, await component.make_session()
+
+    session, replacement = run(scenario())
+
+    assert list(sessions) == [replacement["name"]]
+    assert sessions.metrics()["released"] == 1
@@ -0,0 +1,128 @@
+"""Testing for the supplementary data cache"""
+
+import os
+from unittest.mock import Mock, patch
+import pytest
+from ltldoorstep import supplementary_cache
+from ltldoorstep.supplementary_cache import SupplementaryCache
+
+
+class StandInServer:
+    """Serves fixed bodies, answering conditional requests as a well-behaved server would."""
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.requests = []
+
+    def get(self, url, stream=False, headers=None):
+        self.requests.append((url, headers))
+        body, etag = self.bodies[url]
+
+        response = Mock()
+        if headers and headers.get('If-None-Match') == etag:
+            response.status_code = 304
+        else:
+            response.status_code = 200
+            response.headers = {'ETag': etag}
+            response.iter_content.return_value = [body[i:i + 4] for i in range(0, len(body), 4)]
+        return response
+
+
+def test_cached_data_is_revalidated_not_downloaded(tmpdir):
+    """check an unchanged URL is served from the cache, and a changed one is fetched again"""
+
+    server = StandInServer({'http://example.org/register.csv': (b'a,b\n1,2\n', '"v1"')})
+    cache = SupplementaryCache(str(tmpdir.join('cache')))
+
+    with patch('ltldoorstep.supplementary_cache.requests', server):
+        first = cache.fetch('http://example.org/register.csv', str(tmpdir.join('first.csv')))
+        second = cache.fetch('http://example.org/register.csv', str(tmpdir.join('second.csv')))
+
+        server.bodies['http://example.org/register.csv'] = (b'a,b\n3,4\n', '"v2"')
+        third = cache.fetch('http://example.org/register.csv', str(tmpdir.join('third.csv')))
+
+    assert server.requests[1][1] == {'If-None-Match': '"v1"'}
+    assert len(server.requests) == 3
+    with open(second, 'rb') as second_file:
+        assert second_file.read() == b'a,b\n1,2\n'
+    with open(third, 'rb') as third_file:
+        assert third_file.read() == b'a,b\n3,4\n'
+    with open(first, 'rb') as first_file:
+        assert first_file.read() == b'a,b\n1,2\n'
+
+
+def test_least_recently_used_data_is_evicted(tmpdir):
+    """check the cache is kept within its size limit, and its index survives a restart"""
+
+    server = StandInServer({
+        'http://example.org/%d.csv' % n: (b'%d' % n * 10, '"%d"' % n) for n in range(3)
+    })
+    cache = SupplementaryCache(str(tmpdir.join('cache')), max_size=25)
+
+    with patch('ltldoorstep.supplementary_cache.requests', server):
+        for n in range(3):
+            cache.fetch('http://example.org/%d.csv' % n, str(tmpdir.join('%d.csv' % n)))
+
+        restarted = SupplementaryCache(str(tmpdir.join('cache')), max_size=25)
+        restarted.fetch('http://example.org/2.csv', str(tmpdir.join('again.csv')))
+        restarted.fetch('http://example.org/0.csv', str(tmpdir.join('again-0.csv')))
+
+    assert len(os.listdir(str(tmpdir.join('cache', 'objects')))) == 2
+    assert server.requests[3][1] == {'If-None-Match': '"2"'}
+    assert server.requests[4][1] == {}
+
+
+def test_superseded_and_orphaned_objects_are_removed(tmpdir):
+    """check a changed URL's old copy is dropped, as are objects no index entry refers to"""
+
+    server = StandInServer({'http://example.org/register.csv': (b'a,b\n1,2\n', '"v1"')})
+    cache = SupplementaryCache(str(tmpdir.join('cache')))
+    objects = tmpdir.join('cache', 'objects')
+
+    with patch('ltldoorstep.supplementary_cache.requests', server):
+        cache.fetch('http://example.org/register.csv', str(tmpdir.join('first.csv')))
+        server.bodies['http://example.org/register.csv'] = (b'a,b\n3,4\n', '"v2"')
+        cache.fetch('http://example.org/register.csv', str(tmpdir.join('second.csv')))
+
+    assert objects.listdir() == [objects.join(cache._index[cache.key_from_url('http://example.org/register.csv')]['digest'])]
+
+    objects.join('orphan').write('left by an interrupted update')
+    SupplementaryCache(str(tmpdir.join('cache')))
+
+    assert len(objects.listdir()) == 1
+    assert not objects.join('orphan').exists()
+
+
+def test_default_directory_is_private(tmpdir, monkeypatch):
+    """check the default cache directory is per-user, and refused if others could write to it"""
+
+    monkeypatch.setattr(supplementary_cache.tempfile, 'gettempdir', lambda: str(tmpdir))
+
+    directory = supplementary_cache.default_cache_directory()
+    assert directory.endswith('-%d' % os.getuid())
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+
+    os.chmod(directory, 0o777)
+    with pytest.raises(RuntimeError):
+        supplementary_cache.default_cache_directory()
+
+
+def test_job_copies_cannot_alter_the_cache(tmpdir):
+    """check a processor changing its copy of supplementary data leaves the cached object intact"""
+
+    server = StandInServer({'http://example.org/register.csv': (b'a,b\n1,2\n', '"v1"')})
+    cache = SupplementaryCache(str(tmpdir.join('cache')))
+
+    with patch('ltldoorstep.supplementary_cache.requests', server):
+        first = cache.fetch('http://example.org/register.csv', str(tmpdir.join('first.csv')))
+
+        os.chmod(first, 0o644)
+        with open(first, 'wb') as first_file:
+            first_file.write(b'tampered')
+
+        second = cache.fetch('http://example.org/register.csv', str(tmpdir.join('second.csv')))
+
+    objects = tmpdir.join('cache', 'objects')
+    assert [obj.read_binary() for obj in objects.listdir()] == [b'a,b\n1,2\n']
+    with open(second, 'rb') as second_file:
+        assert second_file.read() == b'a,b\n1,2\n'
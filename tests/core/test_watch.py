@@ -1,6 +1,10 @@
+import time
+import asyncio
+from ltldoorstep import watch
 from ltldoorstep.watch import Monitor
 from ltldoorstep.ini import DoorstepIni
-from ltldoorstep.data_store import DummyDataStore
+from ltldoorstep.data_store import DummyDataStore, CkanDataStore
+from ltldoorstep.fingerprint_cache import ResourceFingerprintCache
 from ltldoorstep.reports.tabular import TabularReport
 import pytest
 
@@ -119,3 +123,159 @@ async def test_get_resources(printer, router, package_info, monitor):
 
 def test_check_empty_resources():
     pass
+
+
+class FlakyDataStore(DummyDataStore):
+    ''' dummy data store whose package_show is slow, and fails for some packages '''
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.attempts = {}
+
+    def package_show(self, id):
+        self.attempts[id] = self.attempts.get(id, 0) + 1
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        time.sleep(0.01 * (5 - int(id)))
+        self.running -= 1
+        if id == '2':
+            raise self.exception('unavailable')
+        return {'name': id, 'resources': [{'url': 'https://url.com/%s' % id}]}
+
+
+def test_changed_packages_fetched_concurrently_and_announced_in_order(monkeypatch):
+    monkeypatch.setattr(watch, 'backoff_delay', lambda attempt: 0)
+    monkeypatch.setattr(watch.store_limiter, 'rate', None)
+    store = FlakyDataStore()
+    announced = []
+
+    async def announce_fn(cmpt, resource, ini, source, update):
+        announced.append(resource['url'])
+
+    monitor = Monitor(None, store, FakePrinter(), None, announce_fn, concurrency=3)
+    recently_changed = [
+        {'revision_id': 'r%d' % n, 'data': {'package': {'id': str(n)}}}
+        for n in range(5)
+    ]
+    monitor.seen.add(monitor.package_key('4', 'r4'))
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(monitor.watch_changed_packages(recently_changed, store.package_show, None))
+    finally:
+        loop.close()
+
+    assert announced == ['https://url.com/0', 'https://url.com/1', 'https://url.com/3']
+    assert monitor.package_key('3', 'r3') in monitor.seen
+    assert monitor.package_key('2', 'r2') not in monitor.seen
+    assert store.attempts['2'] == watch.RETRIES
+    assert 1 < store.peak <= 3
+
+
+def test_backoff_is_jittered_and_capped():
+    delays = [watch.backoff_delay(attempt, base=1, cap=8) for attempt in range(10) for _ in range(20)]
+
+    assert all(0 <= delay <= 8 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+class FakeSearchAction:
+    ''' package_search over fixed packages, honouring the metadata_modified range, two to a page '''
+
+    def __init__(self, packages):
+        self.packages = packages
+        self.searches = []
+
+    def package_search(self, sort, start, rows, fq=None):
+        self.searches.append(fq)
+        rows = min(rows, 2)
+        since = fq[len('metadata_modified:['):-len('Z TO *]')] if fq else ''
+        matches = sorted(
+            (p for p in self.packages if p['metadata_modified'] >= since),
+            key=lambda p: p['metadata_modified']
+        )
+        return {'count': len(matches), 'results': matches[start:start + rows]}
+
+    def package_show(self, id):
+        raise AssertionError('package_search results should be reused')
+
+
+class StopGathering(Exception):
+    pass
+
+
+def test_sync_follows_metadata_modified_cursor(tmpdir, monkeypatch):
+    monkeypatch.setattr(watch.store_limiter, 'rate', None)
+    packages = [
+        {'id': 'p%d' % n, 'metadata_modified': '2020-01-0%dT00:00:00.000000' % (n + 1), 'resources': []}
+        for n in range(3)
+    ]
+    action = FakeSearchAction(packages)
+    cursor_path = str(tmpdir.join('cursor.json'))
+
+    store = CkanDataStore('http://ckan.example', cursor_path=cursor_path)
+    store.client.action = action
+    monitor = Monitor(None, store, FakePrinter(), watch.sync_gather, None)
+    shown = []
+
+    async def get_resource(ini, rg_func, cmpt, package_key=None):
+        shown.append(ini.package['id'])
+    monitor.get_resource = get_resource
+
+    iterations = []
+
+    async def cmpt_wrap(fn, *args):
+        if len(iterations) == 3:
+            raise StopGathering()
+        iterations.append(args)
+        return await fn(None, *args)
+
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(StopGathering):
+            loop.run_until_complete(watch.sync_gather(store, monitor.watch_changed_packages, 0, 0, cmpt_wrap))
+    finally:
+        loop.close()
+
+    assert shown == ['p0', 'p1', 'p2']
+    assert action.searches == [
+        None,
+        'metadata_modified:[2020-01-02T00:00:00.000000Z TO *]',
+        'metadata_modified:[2020-01-03T00:00:00.000000Z TO *]'
+    ]
+    assert CkanDataStore('http://ckan.example', cursor_path=cursor_path).cursor == '2020-01-03T00:00:00.000000'
+
+
+def test_unchanged_resources_not_announced_again(monkeypatch):
+    monkeypatch.setattr(watch.store_limiter, 'rate', None)
+    announced = []
+
+    async def announce_fn(cmpt, resource, ini, source, update):
+        announced.append(resource['url'])
+
+    class Response:
+        status_code = 200
+        headers = {}
+
+        def iter_content(self, chunk_size=1):
+            return [b'a,b\n']
+
+        def close(self):
+            pass
+
+    def get(url, headers=None, stream=False):
+        return Response()
+
+    monitor = Monitor(None, DummyDataStore(), FakePrinter(), None, announce_fn, fingerprints=ResourceFingerprintCache())
+    ini = DoorstepIni(context_package={'resources': [{'url': 'https://url.com/1'}]})
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(monitor.get_resource(ini, get, None))
+        loop.run_until_complete(monitor.get_resource(ini, get, None))
+    finally:
+        loop.close()
+
+    assert announced == ['https://url.com/1']
+    assert monitor.fingerprints.counts['same-content'] == 1
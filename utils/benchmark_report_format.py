@@ -0,0 +1,87 @@
+"""Compare JSON and the binary (msgpack) report encoding for size and speed.
+
+By default, this builds a synthetic report of cell-level issues, e.g.
+
+    python utils/benchmark_report_format.py --issues 200000
+
+or times existing compiled JSON reports given with --report (repeatable).
+"""
+
+import json
+import time
+import gettext
+import logging
+import click
+import tabulate
+
+gettext.install('ltldoorstep')
+
+from ltldoorstep.reports import report as report_module
+from ltldoorstep.reports import binary
+from ltldoorstep.reports.tabular import TabularReport
+
+def synthetic_report(issues):
+    headers = ['id', 'name', 'place', 'value']
+    rprt = TabularReport('benchmark-processor:1', 'Synthetic report', headers=headers)
+    for n in range(issues):
+        row = [str(n // 3), 'Name %d' % (n // 3), 'Place', str(n)]
+        rprt.add_issue(
+            logging.ERROR if n % 5 else logging.WARNING,
+            'bad-value' if n % 2 else 'missing-value',
+            'Value does not match its column',
+            row_number=n // 3 + 1,
+            column_number=n % 4 + 1,
+            row=row
+        )
+    return rprt.compile()
+
+def best_of(repeats, fn):
+    best = None
+    for _i in range(repeats):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+@click.command()
+@click.option('--report', 'report_files', multiple=True, help='Compiled JSON report to time (default: synthetic)')
+@click.option('-n', '--issues', default=100000, help='Issues in the synthetic report')
+@click.option('-r', '--repeats', default=3, help='Runs per format; the best is reported')
+def benchmark(report_files, issues, repeats):
+    if not binary.msgpack:
+        raise click.ClickException('msgpack is not installed')
+
+    reports = []
+    if report_files:
+        for report_file in report_files:
+            with open(report_file, 'r') as report_f:
+                reports.append((report_file, json.load(report_f)))
+    else:
+        reports.append(('synthetic (%d issues)' % issues, synthetic_report(issues)))
+
+    rows = []
+    for name, compiled in reports:
+        encoded_json = json.dumps(compiled).encode('utf-8')
+        encoded_binary = binary.encode_report(compiled)
+
+        for report_format, encoded, encode, decode in (
+            ('json', encoded_json, lambda: json.dumps(compiled), lambda: json.loads(encoded_json)),
+            ('msgpack', encoded_binary, lambda: binary.encode_report(compiled), lambda: binary.decode_report(encoded_binary))
+        ):
+            rows.append([
+                name,
+                report_format,
+                len(encoded),
+                '%.3f' % best_of(repeats, encode),
+                '%.3f' % best_of(repeats, decode),
+                '%.3f' % best_of(repeats, lambda: report_module.Report.parse(decode()).compile())
+            ])
+
+    click.echo(tabulate.tabulate(
+        rows,
+        headers=['report', 'format', 'bytes', 'encode (s)', 'decode (s)', 'decode+parse+compile (s)']
+    ))
+
+if __name__ == '__main__':
+    benchmark()
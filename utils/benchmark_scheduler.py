@@ -0,0 +1,84 @@
+"""Compare dask scheduler settings for processors run in-process.
+
+By default, this runs the synthetic processor in
+benchmark_scheduler_processor.py - eight independent branches of 0.1s
+tasks - over the given data file, e.g.
+
+    python utils/benchmark_scheduler.py tests/examples/data/bad.csv
+
+Its timings show how far each setting overlaps independent tasks, not how
+any real processor performs; for that, choose processors with --processor
+(repeatable).
+"""
+
+import os
+import time
+import gettext
+import logging
+import multiprocessing
+import click
+import tabulate
+
+gettext.install('ltldoorstep')
+
+from ltldoorstep.engines import dask_common
+from ltldoorstep.engines.dask_threaded import load_processor_module
+
+SYNTHETIC_PROCESSOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_scheduler_processor.py')
+
+def time_processor(data_file, processor_file, repeats):
+    best = None
+    for _i in range(repeats):
+        mod = load_processor_module(processor_file)
+        start = time.perf_counter()
+        dask_common.run(data_file, mod, {})
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+@click.command()
+@click.argument('data_file')
+@click.option('-p', '--processor', multiple=True, help='Processor module to time (default: the synthetic benchmark processor)')
+@click.option('-r', '--repeats', default=3, help='Runs per setting; the best is reported')
+@click.option('-w', '--workers', default=multiprocessing.cpu_count(), help='Worker count to compare with the default of 2')
+def benchmark(data_file, processor, repeats, workers):
+    processors = list(processor)
+    if not processors:
+        processors = [SYNTHETIC_PROCESSOR]
+
+    settings = [
+        ('synchronous', 1),
+        ('threaded', 2),
+        ('threaded', workers),
+        ('processes', workers)
+    ]
+
+    rows = []
+    for processor_file in processors:
+        baseline = None
+        for scheduler, num_workers in settings:
+            dask_common.configure(scheduler=scheduler, num_workers=num_workers)
+            try:
+                elapsed = time_processor(data_file, processor_file, repeats)
+            except Exception as e:
+                logging.warning("Skipping %s [%s]: %s", processor_file, scheduler, e)
+                break
+
+            if baseline is None:
+                baseline = elapsed
+
+            rows.append([
+                os.path.basename(processor_file),
+                scheduler,
+                num_workers,
+                '%.3f' % elapsed,
+                '%.2fx' % (baseline / elapsed)
+            ])
+
+    click.echo(tabulate.tabulate(
+        rows,
+        headers=['processor', 'scheduler', 'workers', 'best (s)', 'vs synchronous']
+    ))
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,39 @@
+"""Synthetic processor for benchmark_scheduler.py.
+
+Each of eight independent branches reads the data file and then holds its
+worker for a fixed time, standing in for a slow, I/O-bound check, before
+their results are gathered into one report. It measures how much a
+scheduler overlaps independent tasks, not what any real processor costs.
+"""
+
+import time
+import logging
+from ltldoorstep.processor import DoorstepProcessor
+
+BRANCHES = 8
+DELAY = 0.1
+
+def check_branch(filename, branch):
+    with open(filename, 'rb') as data_file:
+        rows = sum(1 for _row in data_file)
+    time.sleep(DELAY)
+    return branch, rows
+
+def gather(report, *results):
+    for branch, rows in results:
+        report.add_issue(logging.INFO, 'branch-%d' % branch, 'Branch %d saw %d rows' % (branch, rows))
+    return report
+
+class BranchingProcessor(DoorstepProcessor):
+    preset = 'tabular'
+    code = 'benchmark-branching'
+
+    def get_workflow(self, filename, metadata):
+        workflow = {
+            'branch-%d' % branch: (check_branch, filename, branch)
+            for branch in range(BRANCHES)
+        }
+        workflow['output'] = (gather, self._report) + tuple('branch-%d' % branch for branch in range(BRANCHES))
+        return workflow
+
+processor = BranchingProcessor.make